@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+
+import sys
+import os
+import argparse
+import logging
+import multiprocessing
+import resource
+import tempfile
+import shutil
+import time
+import numpy as np
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil import createchmimage
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_createchmimage')
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--image", help='Image to convert. If unset '
+                                        'synthetic JPEG and PNG images are '
+                                        'generated')
+    parser.add_argument("--size", default='6000x6000',
+                        help='Size of synthetic images in WxH format '
+                             '(default 6000x6000)')
+    parser.add_argument("--factors", default='2,4,8',
+                        help='Comma delimited list of downsampling '
+                             'factors (default 2,4,8)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _create_images(temp_dir, width, height):
+    """Creates synthetic RGB JPEG and PNG images
+    :returns: list of paths to images
+    """
+    rstate = np.random.RandomState(1)
+    coarse = rstate.randint(0, 256, size=(int(height / 8) + 1,
+                                          int(width / 8) + 1, 3),
+                            dtype=np.uint8)
+    data = np.repeat(np.repeat(coarse, 8, axis=0), 8, axis=1)
+    img = Image.fromarray(np.ascontiguousarray(data[:height, :width]))
+    images = []
+    for name in ['synthetic.jpg', 'synthetic.png']:
+        path = os.path.join(temp_dir, name)
+        img.save(path)
+        images.append(path)
+    img.close()
+    return images
+
+
+def _run_conversion(image_file, dest_file, arglist, queue):
+    """Runs `createchmimage._convert_image` in this process putting
+       runtime and increase in peak resident memory in kilobytes on
+       `queue`
+    """
+    theargs = createchmimage._parse_arguments('', [image_file, dest_file] +
+                                              arglist)
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    createchmimage._convert_image(image_file, dest_file, theargs)
+    duration = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((duration, peak_rss - start_rss))
+
+
+def _run_benchmark(theargs):
+    """Converts each image with equalize, gaussian blur and each
+       downsampling factor with and without --downsamplefirst, running
+       each conversion in its own process so peak memory can be measured
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if theargs.image is not None:
+            images = [os.path.abspath(theargs.image)]
+        else:
+            width, height = [int(v) for v in theargs.size.split('x')]
+            sys.stdout.write('Generating images of size ' + theargs.size +
+                             '\n')
+            images = _create_images(temp_dir, width, height)
+
+        sys.stdout.write('%-16s %7s %-16s %10s %18s\n' %
+                         ('Image', 'Factor', 'Mode', 'Time (s)',
+                          'Peak memory (MB)'))
+        dest_file = os.path.join(temp_dir, 'out.png')
+        for image_file in images:
+            for factor in theargs.factors.split(','):
+                for label, extra in [('after filters', []),
+                                     ('downsamplefirst',
+                                      ['--downsamplefirst'])]:
+                    arglist = ['--equalize', '--gaussianblur',
+                               '--downsample', factor] + extra
+                    queue = multiprocessing.Queue()
+                    proc = multiprocessing.Process(target=_run_conversion,
+                                                   args=(image_file,
+                                                         dest_file,
+                                                         arglist, queue))
+                    proc.start()
+                    (duration, peak_kb) = queue.get()
+                    proc.join()
+                    sys.stdout.write('%-16s %7s %-16s %10.3f %18.1f\n' %
+                                     (os.path.basename(image_file), factor,
+                                      label, duration, peak_kb / 1024.0))
+        return 0
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks runtime and peak memory of createchmimage.py
+              with --equalize --gaussianblur at several --downsample
+              factors with and without --downsamplefirst. Peak memory
+              is the increase in maximum resident set size reported by
+              getrusage on Linux.
+
+              Example Usage:
+
+              bench_createchmimage.py --image someimage.tif
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil.imageheader import get_image_size_and_format
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_imageheader')
+
+FORMAT_TO_SUFFIX = {'PNG': '.png', 'TIFF': '.tif', 'JPEG': '.jpg'}
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--imagedir",
+                        help='Probe images in this directory instead of '
+                             'generating images')
+    parser.add_argument("--numfiles", type=int, default=3000,
+                        help='Number of images to generate split evenly '
+                             'between PNG, TIFF and JPEG (default 3000)')
+    parser.add_argument("--size", default='256x256',
+                        help='Size of generated images in WxH '
+                             'format (default 256x256)')
+    parser.add_argument("--repeat", type=int, default=3,
+                        help='Number of times to probe all images with '
+                             'each method, best time is reported '
+                             '(default 3)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _best_time(func, repeat):
+    """Runs `func` `repeat` times
+    :returns: best time in seconds
+    """
+    best = None
+    for x in range(0, repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def _create_images(image_dir, numfiles, width, height):
+    """Writes `numfiles` images cycling through PNG, TIFF and JPEG
+    """
+    im = Image.new('L', (width, height))
+    formats = sorted(FORMAT_TO_SUFFIX.keys())
+    for x in range(0, numfiles):
+        fmt = formats[x % len(formats)]
+        im.save(os.path.join(image_dir, str(x) + FORMAT_TO_SUFFIX[fmt]),
+                fmt)
+
+
+def _probe_with_pillow(file_list):
+    """Opens every image with Image.open
+    """
+    for fp in file_list:
+        im = Image.open(fp)
+        im.size
+        im.format
+        im.close()
+
+
+def _probe_with_header_reader(file_list):
+    """Reads header of every image with get_image_size_and_format
+    """
+    for fp in file_list:
+        get_image_size_and_format(fp)
+
+
+def _run_benchmark(theargs):
+    """Runs benchmark getting size and format of images in a directory
+       with Image.open and with the imageheader module
+    """
+    temp_dir = None
+    image_dir = theargs.imagedir
+    try:
+        if image_dir is None:
+            temp_dir = tempfile.mkdtemp()
+            image_dir = temp_dir
+            width, height = [int(v) for v in theargs.size.split('x')]
+            _create_images(image_dir, theargs.numfiles, width, height)
+
+        file_list = core.get_image_path_list(image_dir, None)
+        methods = [('Image.open', _probe_with_pillow),
+                   ('imageheader', _probe_with_header_reader)]
+
+        sys.stdout.write('Probing ' + str(len(file_list)) + ' files in ' +
+                         image_dir + '\n')
+        sys.stdout.write('%-30s %12s %14s\n' % ('Method', 'Time (s)',
+                                                'Files/sec'))
+        for label, func in methods:
+            duration = _best_time(lambda: func(file_list), theargs.repeat)
+            sys.stdout.write('%-30s %12.4f %14.1f\n' %
+                             (label, duration,
+                              len(file_list) / max(duration, 1e-9)))
+        return 0
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks getting width, height and format of images by
+              opening each with Image.open compared to parsing the
+              header with the imageheader module. Unless --imagedir is
+              set, --numfiles PNG, TIFF and JPEG images are generated
+              in a temporary directory.
+
+              NOTE: Operating system file caching is not cleared so
+                    repeated runs mostly measure parsing cost, not
+                    file system latency.
+
+              Example Usage:
+
+              bench_imageheader.py --numfiles 10000
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
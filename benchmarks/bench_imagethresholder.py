@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+
+import sys
+import argparse
+import logging
+import time
+import numpy as np
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil.image import ImageThresholder
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_imagethresholder')
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--size", default='4000x4000',
+                        help='Size of random probability map in WxH '
+                             'format (default 4000x4000)')
+    parser.add_argument("--threshpc", type=int, default=30,
+                        help='Threshold percent (default 30)')
+    parser.add_argument("--repeat", type=int, default=5,
+                        help='Number of times to run each method, best '
+                             'time is reported (default 5)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _best_time(func, repeat):
+    """Runs `func` `repeat` times
+    :returns: best time in seconds
+    """
+    best = None
+    for x in range(0, repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def _run_benchmark(theargs):
+    """Runs benchmark thresholding random probability map with
+       Image.eval, Image.point and NumPy comparison in place
+    """
+    width, height = [int(v) for v in theargs.size.split('x')]
+    rstate = np.random.RandomState(1)
+    data = rstate.randint(0, 256, size=(height, width)).astype(np.uint8)
+    img = Image.fromarray(data)
+    thresh = ImageThresholder(threshold_percent=theargs.threshpc)
+    cutoff = thresh.get_pixel_intensity_cutoff()
+    buf = np.empty_like(data)
+
+    methods = [('Image.eval', lambda: Image.eval(img,
+                                                 lambda px: 0 if px < cutoff
+                                                 else 255)),
+               ('Image.point', lambda: thresh.threshold_image(img)),
+               ('numpy compare', lambda: thresh.threshold_array(data)),
+               ('numpy compare reused buffer',
+                lambda: thresh.threshold_array(data, out=buf))]
+
+    sys.stdout.write('%-30s %12s %14s\n' % ('Method', 'Time (s)',
+                                            'Mpixels/sec'))
+    mpixels = float(width * height) / 1000000
+    for label, func in methods:
+        duration = _best_time(func, theargs.repeat)
+        sys.stdout.write('%-30s %12.4f %14.1f\n' %
+                         (label, duration, mpixels / max(duration, 1e-9)))
+    return 0
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks thresholding of a random probability map by
+              ImageThresholder comparing Image.eval with a Python
+              lambda, Image.point and a NumPy comparison with and
+              without a reused output buffer.
+
+              Example Usage:
+
+              bench_imagethresholder.py --size 8000x8000
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+
+import sys
+import os
+import argparse
+import logging
+import tempfile
+import shutil
+import time
+import numpy as np
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil.imagestream import OutputProfile
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_outputprofiles')
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--probmap", help='Probability map to encode. If '
+                                          'unset a synthetic probability '
+                                          'map is generated')
+    parser.add_argument("--size", default='8000x8000',
+                        help='Size of synthetic probability map in WxH '
+                             'format (default 8000x8000)')
+    parser.add_argument("--repeat", type=int, default=3,
+                        help='Number of times to encode and decode with '
+                             'each profile, best time is reported '
+                             '(default 3)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _create_synthetic_probmap(width, height):
+    """Creates probability map like array where most pixels are zero
+       and the rest are smooth blobs of varying intensity
+    :returns: 2D NumPy uint8 array
+    """
+    rstate = np.random.RandomState(1)
+    coarse = rstate.randint(0, 256, size=(int(height / 16) + 1,
+                                          int(width / 16) + 1))
+    data = np.repeat(np.repeat(coarse, 16, axis=0), 16, axis=1)
+    data = data[:height, :width]
+    data[data < 160] = 0
+    return data.astype(np.uint8)
+
+
+def _get_profiles():
+    """Gets list of (label, `OutputProfile`) to benchmark
+    """
+    profiles = [('default', OutputProfile())]
+    for level in [0, 1, 6, 9]:
+        profiles.append(('png level ' + str(level),
+                         OutputProfile(OutputProfile.PNG,
+                                       compress_level=level)))
+    profiles.append(('tiff', OutputProfile(OutputProfile.TIFF)))
+    profiles.append(('tiff-lzw', OutputProfile(OutputProfile.TIFF_LZW)))
+    profiles.append(('npy', OutputProfile(OutputProfile.NPY)))
+    return profiles
+
+
+def _get_suffix(profile):
+    """Gets suffix of file written with `profile`
+    """
+    if profile.get_profile() == OutputProfile.DEFAULT:
+        return '.png'
+    return OutputProfile.PROFILE_SUFFIXES[profile.get_profile()][0]
+
+
+def _decode(profile, path):
+    """Decodes image written with `profile`
+    """
+    if profile.get_profile() == OutputProfile.NPY:
+        return np.load(path)
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+def _best_time(func, repeat):
+    """Runs `func` `repeat` times
+    :returns: best time in seconds
+    """
+    best = None
+    for x in range(0, repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def _run_benchmark(theargs):
+    """Runs benchmark encoding and decoding probability map with each
+       output profile
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if theargs.probmap is not None:
+            img = Image.open(theargs.probmap).convert(mode='L')
+            data = np.asarray(img)
+            img.close()
+        else:
+            width, height = [int(v) for v in theargs.size.split('x')]
+            sys.stdout.write('Generating probability map of size ' +
+                             theargs.size + '\n')
+            data = _create_synthetic_probmap(width, height)
+
+        sys.stdout.write('%-14s %12s %14s %12s\n' %
+                         ('Profile', 'Encode (s)', 'Size (bytes)',
+                          'Decode (s)'))
+        for label, profile in _get_profiles():
+            out_file = os.path.join(temp_dir, 'out' + _get_suffix(profile))
+            encode = _best_time(lambda: profile.write_array(data, out_file),
+                                theargs.repeat)
+            decode = _best_time(lambda: _decode(profile, out_file),
+                                theargs.repeat)
+            sys.stdout.write('%-14s %12.3f %14d %12.3f\n' %
+                             (label, encode, os.path.getsize(out_file),
+                              decode))
+            os.remove(out_file)
+        return 0
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks output profiles available to mergetiles.py
+              and createprobmapoverlay.py reporting encode time, file
+              size and decode time for each profile.
+
+              Example Usage:
+
+              bench_outputprofiles.py --probmap probmaps/foo.png
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+
+import sys
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+import numpy as np
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil.image import ImageThresholder
+from chmutil.image import ColorizeGrayscaleImage
+from chmutil.image import ProbabilityMapOverlayGenerator
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_probmapoverlay')
+
+THRESHPC = 30
+COLOR = (0, 0, 1)
+OPACITY = 70
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--size", default='6000x6000',
+                        help='Size of synthetic base image and probability '
+                             'map in WxH format (default 6000x6000)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _create_images(width, height):
+    """Creates grayscale base image and probability map where most
+       pixels are zero
+    :returns: tuple (base image, probability map) as Image objects
+    """
+    rstate = np.random.RandomState(1)
+    base = rstate.randint(0, 256, size=(height, width), dtype=np.uint8)
+    coarse = rstate.randint(0, 256, size=(int(height / 16) + 1,
+                                          int(width / 16) + 1),
+                            dtype=np.uint8)
+    probmap = np.repeat(np.repeat(coarse, 16, axis=0), 16, axis=1)
+    probmap = np.ascontiguousarray(probmap[:height, :width])
+    probmap[probmap < 160] = 0
+    return Image.fromarray(base), Image.fromarray(probmap)
+
+
+def _alpha_composite_overlay(base, probmap):
+    """Creates overlay the way createprobmapoverlay.py did before the
+       fused kernel by thresholding, colorizing and alpha compositing
+    """
+    thresh = ImageThresholder(threshold_percent=THRESHPC)
+    thresh_image = thresh.threshold_image(probmap)
+    colorizer = ColorizeGrayscaleImage(color=COLOR, opacity=OPACITY)
+    col_img = colorizer.colorize_image(thresh_image)
+    thresh_image.close()
+    img = base.convert(mode='RGBA')
+    return Image.alpha_composite(img, col_img)
+
+
+def _fused_overlay(base, probmap):
+    """Creates overlay with `ProbabilityMapOverlayGenerator`
+    """
+    gen = ProbabilityMapOverlayGenerator(threshold_percent=THRESHPC,
+                                         color=COLOR, opacity=OPACITY)
+    return gen.create_overlay(base, probmap)
+
+
+def _run_method(func, width, height, queue):
+    """Runs `func` in this process putting runtime, increase in peak
+       resident memory in kilobytes and resulting image bytes on `queue`
+    """
+    base, probmap = _create_images(width, height)
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    res = func(base, probmap)
+    duration = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((duration, peak_rss - start_rss, res.tobytes()))
+
+
+def _run_benchmark(theargs):
+    """Runs each overlay method in its own process so peak memory of
+       one does not hide the other
+    """
+    width, height = [int(v) for v in theargs.size.split('x')]
+    methods = [('alpha_composite', _alpha_composite_overlay),
+               ('fused', _fused_overlay)]
+    sys.stdout.write('%-16s %10s %18s\n' % ('Method', 'Time (s)',
+                                            'Peak memory (MB)'))
+    results = []
+    for label, func in methods:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_run_method,
+                                       args=(func, width, height, queue))
+        proc.start()
+        (duration, peak_kb, data) = queue.get()
+        proc.join()
+        results.append(data)
+        sys.stdout.write('%-16s %10.3f %18.1f\n' % (label, duration,
+                                                    peak_kb / 1024.0))
+    if results[0] != results[1]:
+        sys.stderr.write('ERROR fused overlay differs from alpha '
+                         'composite overlay\n')
+        return 1
+    sys.stdout.write('Outputs are identical\n')
+    return 0
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks runtime and peak memory of creating a
+              probability map overlay by thresholding, colorizing and
+              alpha compositing versus the fused kernel in
+              ProbabilityMapOverlayGenerator and verifies both produce
+              identical output. Peak memory is the increase in maximum
+              resident set size reported by getrusage on Linux.
+
+              Example Usage:
+
+              bench_probmapoverlay.py --size 10000x10000
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
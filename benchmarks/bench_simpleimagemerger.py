@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+
+import sys
+import os
+import argparse
+import logging
+import tempfile
+import shutil
+import time
+import numpy as np
+from PIL import Image
+
+import chmutil
+from chmutil.core import Parameters
+from chmutil import core
+from chmutil.image import SimpleImageMerger
+
+LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
+
+# create logger
+logger = logging.getLogger('chmutil.bench_simpleimagemerger')
+
+
+def _parse_arguments(desc, args):
+    """Parses command line arguments using argparse.
+    """
+    parsed_arguments = Parameters()
+
+    help_formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_formatter)
+    parser.add_argument("--imagedir", help='Directory of image tiles to '
+                                           'merge. If unset synthetic '
+                                           'tiles are generated')
+    parser.add_argument("--numtiles", type=int, default=10,
+                        help='Number of synthetic tiles to generate '
+                             '(default 10)')
+    parser.add_argument("--size", default='4000x4000',
+                        help='Size of synthetic tiles in WxH format '
+                             '(default 4000x4000)')
+    parser.add_argument("--repeat", type=int, default=3,
+                        help='Number of times to run each merge, best '
+                             'time is reported (default 3)')
+    parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
+                        'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Set the logging level (default WARNING)",
+                        default='WARNING')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' + chmutil.__version__))
+
+    return parser.parse_args(args, namespace=parsed_arguments)
+
+
+def _create_synthetic_tiles(dest_dir, numtiles, width, height):
+    """Writes `numtiles` sparse 8-bit png images to `dest_dir`
+       mimicking CHM task output where only a band of each image
+       has data
+    :returns: list of paths to images
+    """
+    im_list = []
+    band = max(1, int(height / numtiles))
+    rstate = np.random.RandomState(1)
+    for x in range(0, numtiles):
+        data = np.zeros((height, width), dtype=np.uint8)
+        upper = min(x * band, height - 1)
+        data[upper:upper + band, :] = rstate.randint(0, 256,
+                                                     size=(min(band,
+                                                               height -
+                                                               upper),
+                                                           width))
+        img_path = os.path.join(dest_dir, str(x).zfill(3) + '.png')
+        Image.fromarray(data).save(img_path, 'PNG')
+        im_list.append(img_path)
+    return im_list
+
+
+def _time_merge(merger, im_list, repeat):
+    """Runs merge `repeat` times
+    :returns: tuple (best time in seconds, merged Pillow image)
+    """
+    best = None
+    merged = None
+    for x in range(0, repeat):
+        start = time.time()
+        merged = merger.merge_images(im_list)
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best, merged
+
+
+def _run_benchmark(theargs):
+    """Runs benchmark comparing NumPy and ImageMath merge engines
+    """
+    temp_dir = None
+    try:
+        if theargs.imagedir is not None:
+            im_list = core.get_image_path_list(theargs.imagedir, 'png')
+        else:
+            temp_dir = tempfile.mkdtemp()
+            width, height = [int(v) for v in theargs.size.split('x')]
+            sys.stdout.write('Generating ' + str(theargs.numtiles) +
+                             ' tiles of size ' + theargs.size + '\n')
+            im_list = _create_synthetic_tiles(temp_dir, theargs.numtiles,
+                                              width, height)
+
+        np_time, np_merged = _time_merge(SimpleImageMerger(), im_list,
+                                         theargs.repeat)
+        imath_merger = SimpleImageMerger(use_imagemath=True)
+        im_time, im_merged = _time_merge(imath_merger, im_list,
+                                         theargs.repeat)
+
+        sys.stdout.write('Tiles merged: ' + str(len(im_list)) + '\n')
+        sys.stdout.write('ImageMath merge: %.3f seconds\n' % im_time)
+        sys.stdout.write('NumPy merge:     %.3f seconds\n' % np_time)
+        sys.stdout.write('Speedup:         %.2fx\n' % (im_time / np_time))
+        if np_merged.tobytes() != im_merged.tobytes():
+            sys.stderr.write('ERROR merged images differ\n')
+            return 1
+        return 0
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+
+def main(arglist):
+    """Main function
+    :param arglist: Should be set to sys.argv which is list of arguments
+                    passed on commandline including script being run as arg 0
+    :returns: exit code. 0 is success otherwise failure
+    """
+    desc = """
+              Version {version}
+
+              Benchmarks SimpleImageMerger comparing the NumPy
+              in place maximum merge against the pairwise Pillow
+              ImageMath merge.
+
+              Example Usage:
+
+              bench_simpleimagemerger.py --numtiles 20 --size 8000x8000
+
+              """.format(version=chmutil.__version__)
+
+    theargs = _parse_arguments(desc, arglist[1:])
+    theargs.program = arglist[0]
+    theargs.version = chmutil.__version__
+    core.setup_logging(logger, log_format=LOG_FORMAT,
+                       loglevel=theargs.loglevel)
+    try:
+        return _run_benchmark(theargs)
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -55,9 +55,9 @@ def _run_jobs(chmconfig, theargs, taskid):
     bconfig = configparser.ConfigParser()
     bconfig.read(chmconfig.get_batchedjob_config_file_path())
 
-    config = configparser.ConfigParser()
-    config.read(os.path.join(theargs.jobdir,
-                             CHMJobCreator.CONFIG_FILE_NAME))
+    config = core.load_chm_task_config(os.path.join(theargs.jobdir,
+                                                    CHMJobCreator.
+                                                    CONFIG_FILE_NAME))
 
     tasks = bconfig.get(taskid, CHMJobCreator.BCONFIG_TASK_ID).split(',')
     process_list = []
@@ -149,7 +149,11 @@ def _run_single_chm_job(jobdir, scratchdir, taskid, config):
                      ' to final destination: ' +
                      out_image)
 
-        shutil.move(prob_map, out_image)
+        # move to temporary name first and rename so incremental
+        # merges never see a partially copied image
+        tmp_out_image = out_image + '.tmp'
+        shutil.move(prob_map, tmp_out_image)
+        os.rename(tmp_out_image, out_image)
 
         return exitcode
     finally:
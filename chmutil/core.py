@@ -2,16 +2,24 @@
 
 
 import os
+import bisect
 import datetime
+import hashlib
+import json
 import logging
 import configparser
 from configparser import NoOptionError
+from configparser import NoSectionError
 import shlex
 import subprocess
 import time
+from multiprocessing.pool import ThreadPool
 from PIL import Image
 
 import chmutil
+from chmutil.imageheader import get_image_size_and_format
+from chmutil.imageheader import check_image_size
+from chmutil.imageheader import InvalidImageHeaderError
 
 logger = logging.getLogger(__name__)
 
@@ -78,6 +86,7 @@ def setup_logging(thelogger,
     logging.getLogger('chmutil.core').setLevel(numericloglevel)
     logging.getLogger('chmutil.cluster').setLevel(numericloglevel)
     logging.getLogger('chmutil.image').setLevel(numericloglevel)
+    logging.getLogger('chmutil.imagestream').setLevel(numericloglevel)
 
 
 def add_standard_parameters(parser):
@@ -181,7 +190,8 @@ def wait_for_children_to_exit(process_list):
 
 def get_image_path_list(image_dir, suffix,
                         keysortfunc=None):
-    """Gets list of images with suffix from dir
+    """Gets list of images with suffix from dir. Hidden files, those
+       whose name starts with a period, are skipped
     :param image_dir: Path to directory with images
     :param suffix: Only include files ending with suffix.
                    code uses str().endswidth for checking.
@@ -204,6 +214,9 @@ def get_image_path_list(image_dir, suffix,
 
     img_list = []
     for entry in os.listdir(image_dir):
+        if entry.startswith('.'):
+            logger.debug(entry + ' is a hidden file. skipping')
+            continue
         fp = os.path.join(image_dir, entry)
         if not os.path.isfile(fp):
             logger.debug(entry + ' is not a file. skipping')
@@ -287,11 +300,77 @@ def get_first_sequence_of_numbers_in_string(val):
     return int(cur_val)
 
 
+def parse_tile_args(args):
+    """Parses CHM tile flags into a list of column, row tuples
+
+       Example:
+       >> parse_tile_args('-t 1,1 -t 1,2')
+       >> [(1, 1), (1, 2)]
+
+    :param args: string of tile flags in -t col,row format
+    :raises ValueError: if a tile flag cannot be parsed
+    :returns: list of tuples (col, row) as ints or empty list
+              if `args` is None
+    """
+    if args is None:
+        return []
+
+    coord_list = []
+    for entry in args.split('-t'):
+        entry = entry.strip()
+        if entry == '':
+            continue
+        coords = entry.split(',')
+        if len(coords) != 2:
+            raise ValueError('Unable to parse tile flag: -t ' + entry)
+        coord_list.append((int(coords[0]), int(coords[1])))
+    return coord_list
+
+
+def load_chm_task_config(cfile):
+    """Loads CHM task configuration. If the [DEFAULT] section sets
+       taskmanifest a `CHMTaskManifest` is returned, otherwise the
+       tasks are listed one per section and the
+       `configparser.ConfigParser` is returned. Both support the
+       sections() and get() calls used to look up tasks
+    :param cfile: path to CHM task configuration file
+    :raises LoadConfigError: if `cfile` or task manifest does not exist
+    :returns: CHMTaskManifest or configparser.ConfigParser
+    """
+    if not os.path.isfile(cfile):
+        raise LoadConfigError(cfile + ' configuration file does not exist')
+
+    config = configparser.ConfigParser()
+    config.read(cfile)
+    if not config.has_option(CHMJobCreator.CONFIG_DEFAULT,
+                             CHMJobCreator.CONFIG_TASK_MANIFEST):
+        return config
+
+    mfile = config.get(CHMJobCreator.CONFIG_DEFAULT,
+                       CHMJobCreator.CONFIG_TASK_MANIFEST)
+    if not os.path.isabs(mfile):
+        mfile = os.path.join(os.path.dirname(cfile), mfile)
+    if not os.path.isfile(mfile):
+        raise LoadConfigError(mfile + ' task manifest does not exist')
+
+    image_table = []
+    with open(mfile, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line == '' or line.startswith('#'):
+                continue
+            (first_task, width, height, i_name) = line.split('\t', 3)
+            image_table.append((int(first_task), int(width), int(height),
+                                i_name))
+    return CHMTaskManifest(config, image_table)
+
+
 class CHMJobCreator(object):
     """Creates CHM Job to run on cluster
     """
     JOB_DIR = 'jobdir'
     CONFIG_FILE_NAME = 'base.chm.tasks.list'
+    TASK_MANIFEST_FILE_NAME = 'base.chm.tasks.manifest'
     CONFIG_BATCHED_TASKS_FILE_NAME = 'batched.chm.tasks.list'
     MERGE_CONFIG_FILE_NAME = 'base.merge.tasks.list'
     MERGE_CONFIG_BATCHED_TASKS_FILE_NAME = 'batched.merge.tasks.list'
@@ -300,6 +379,9 @@ class CHMJobCreator(object):
     MERGE_OUTPUT_OVERLAY_IMAGE = 'overlayoutputimage'
     MERGE_MERGETILES_BIN = 'mergetilesbin'
     MERGE_TASKS_PER_NODE = 'mergetaskspernode'
+    MERGE_OVERLAY_THRESHPC = 'overlaythreshpc'
+    MERGE_OVERLAY_COLOR = 'overlaycolor'
+    MERGE_OVERLAY_OPACITY = 'overlayopacity'
     RUN_DIR = 'chmrun'
     STDOUT_DIR = 'stdout'
     TILES_DIR = 'tiles'
@@ -323,6 +405,7 @@ class CHMJobCreator(object):
     CONFIG_ACCOUNT = 'account'
     CHMUTIL_VERSION = 'chmutilversion'
     CONFIG_CLUSTER = 'cluster'
+    CONFIG_TASK_MANIFEST = 'taskmanifest'
     CHMRUNNER = 'chmrunner.py'
     MERGERUNNER = 'mergetilerunner.py'
     CHECKCHMJOB = 'checkchmjob.py'
@@ -374,7 +457,14 @@ Below is a description of data in this directory
 
 base.chm.tasks.list
   -- Main configuration file for CHM job. Created when createchmjob.py is
-     run and contains CHM tasks to run.
+     run and contains CHM tasks to run. If taskmanifest is set in the
+     [DEFAULT] section the tasks are not listed and instead are derived
+     from the tile options and the table of images in that file.
+
+base.chm.tasks.manifest
+  -- Table of input images with width, height and id of first CHM task
+     for each image. Only created if --legacytasklist was not passed to
+     createchmjob.py.
 
 batched.chm.tasks.list
   -- Batched CHM task configuration file. This defines how the CHM
@@ -478,6 +568,24 @@ runmerge.CLUSTER
         f.close()
         return cfile
 
+    def _write_task_manifest(self, image_table):
+        """Writes table of images to task manifest file
+        :param image_table: list of tuples (first task id, width, height,
+                            image name)
+        :returns: Path to written manifest file
+        """
+        mfile = os.path.join(self._chmopts.get_out_dir(),
+                             CHMJobCreator.TASK_MANIFEST_FILE_NAME)
+        logger.debug('Writing task manifest to : ' + mfile)
+        f = open(mfile, 'w')
+        f.write(CHMTaskManifest.HEADER)
+        for (first_task, width, height, i_name) in image_table:
+            f.write(str(first_task) + '\t' + str(width) + '\t' +
+                    str(height) + '\t' + i_name + '\n')
+        f.flush()
+        f.close()
+        return mfile
+
     def _write_readme(self, config):
         """Writes out readme.txt file
         """
@@ -515,6 +623,12 @@ runmerge.CLUSTER
                    self._chmopts.get_out_dir())
         config.set('', CHMJobCreator.MERGE_TASKS_PER_NODE,
                    str(self._chmopts.get_number_merge_tasks_per_node()))
+        config.set('', CHMJobCreator.MERGE_OVERLAY_THRESHPC,
+                   str(self._chmopts.get_overlay_threshpc()))
+        config.set('', CHMJobCreator.MERGE_OVERLAY_COLOR,
+                   str(self._chmopts.get_overlay_color()))
+        config.set('', CHMJobCreator.MERGE_OVERLAY_OPACITY,
+                   str(self._chmopts.get_overlay_opacity()))
         config.set('', CHMJobCreator.CONFIG_CLUSTER,
                    str(self._chmopts.get_cluster()))
         return config
@@ -616,7 +730,12 @@ runmerge.CLUSTER
         statsfac = ImageStatsFromDirectoryFactory(self._chmopts.get_images(),
                                                   max_image_pixels=self.
                                                   _chmopts.
-                                                  get_max_image_pixels())
+                                                  get_max_image_pixels(),
+                                                  cache_file=self._chmopts.
+                                                  get_imagestats_cache(),
+                                                  refresh_cache=self.
+                                                  _chmopts.
+                                                  get_refresh_imagestats())
         imagestats = statsfac.get_input_image_stats()
         config = self._create_config()
         mergeconfig = self._create_merge_config()
@@ -624,20 +743,36 @@ runmerge.CLUSTER
         mergecounter = 1
         run_dir = self._create_run_dir()
 
+        use_manifest = self._chmopts.get_task_manifest()
+        image_table = []
+
         for iis in imagestats:
             i_name = self._create_output_image_dir(iis, run_dir)
             img_cntr = 1
             self._add_mergetask_for_image_to_config(mergeconfig,
                                                     str(mergecounter),
                                                     i_name)
-            for a in arg_gen.get_args(iis):
+            grid = arg_gen.get_tile_grid(iis.get_width(), iis.get_height())
+            mergecounter += 1
+            if use_manifest is True:
+                image_table.append((counter, iis.get_width(),
+                                    iis.get_height(), i_name))
+                counter += grid.get_number_of_tasks()
+                continue
+            for a in grid.get_args():
                 counter_as_str = str(counter)
                 self._add_task_for_image_to_config(config, counter_as_str,
                                                    i_name, img_cntr, a)
                 counter += 1
                 img_cntr += 1
-            mergecounter += 1
-        self._write_config(config)
+        if use_manifest is True:
+            config.set('', CHMJobCreator.CONFIG_TASK_MANIFEST,
+                       CHMJobCreator.TASK_MANIFEST_FILE_NAME)
+            self._write_task_manifest(image_table)
+            self._write_config(config)
+            config = CHMTaskManifest(config, image_table)
+        else:
+            self._write_config(config)
         self._write_merge_config(mergeconfig)
         self._chmopts.set_config(config)
         self._chmopts.set_merge_config(mergeconfig)
@@ -665,12 +800,18 @@ class CHMConfig(object):
                  max_image_pixels=768000000,
                  max_chm_memory_in_gb=10,
                  max_merge_memory_in_gb=10,
+                 overlay_threshpc=30,
+                 overlay_color='blue',
+                 overlay_opacity=70,
                  version='unknown',
                  cluster='rocce',
                  account='',
                  config=None,
                  mergeconfig=None,
-                 rawargs=None):
+                 rawargs=None,
+                 imagestats_cache=None,
+                 refresh_imagestats=False,
+                 task_manifest=False):
         """Constructor
         """
         self._images = images
@@ -692,6 +833,9 @@ class CHMConfig(object):
         self._max_image_pixels = max_image_pixels
         self._max_chm_memory_in_gb = max_chm_memory_in_gb
         self._max_merge_memory_in_gb = max_merge_memory_in_gb
+        self._overlay_threshpc = overlay_threshpc
+        self._overlay_color = overlay_color
+        self._overlay_opacity = overlay_opacity
         self._account = account
         self._version = version
         self._config = config
@@ -699,6 +843,9 @@ class CHMConfig(object):
         self._merge_tasks_per_node = merge_tasks_per_node
         self._cluster = cluster
         self._rawargs = rawargs
+        self._imagestats_cache = imagestats_cache
+        self._refresh_imagestats = refresh_imagestats
+        self._task_manifest = task_manifest
 
     def _extract_width_and_height(self, val):
         """parses WxH value into tuple
@@ -732,6 +879,22 @@ class CHMConfig(object):
         """
         return self._rawargs
 
+    def get_imagestats_cache(self):
+        """Gets path to file caching size and format of images or None
+        """
+        return self._imagestats_cache
+
+    def get_refresh_imagestats(self):
+        """Gets whether every image should be opened ignoring cache
+        """
+        return self._refresh_imagestats
+
+    def get_task_manifest(self):
+        """Gets whether CHM tasks are written as a task manifest instead
+           of one configuration section per task
+        """
+        return self._task_manifest
+
     def get_account(self):
         """Gets account to charge processing to
         """
@@ -754,6 +917,22 @@ class CHMConfig(object):
         """
         return self._max_merge_memory_in_gb
 
+    def get_overlay_threshpc(self):
+        """Gets percent cut off used to threshold probability map
+           when creating overlay in merge phase
+        """
+        return self._overlay_threshpc
+
+    def get_overlay_color(self):
+        """Gets color of overlay created in merge phase
+        """
+        return self._overlay_color
+
+    def get_overlay_opacity(self):
+        """Gets opacity of overlay created in merge phase
+        """
+        return self._overlay_opacity
+
     def get_version(self):
         """Gets version of chmutil
         """
@@ -930,6 +1109,199 @@ class CHMConfig(object):
         return self._chmbin
 
 
+class CHMTaskManifest(object):
+    """CHM task configuration where tasks are not enumerated. Only a
+       table of images, with the id of the first task of each image, is
+       stored and a task id is resolved to its image by binary search
+       and to its tiles with `TileGrid`. The sections(), get(),
+       getint(), getboolean(), has_section() and has_option() methods
+       behave like those of `configparser.ConfigParser` loaded with one
+       section per task so existing code can use either
+    """
+    HEADER = '# firsttaskid\twidth\theight\timage\n'
+
+    def __init__(self, config, image_table):
+        """Constructor
+        :param config: configparser.ConfigParser with [DEFAULT] section
+                       holding options shared by all tasks
+        :param image_table: list of tuples (first task id, width, height,
+                            image name) sorted by first task id
+        """
+        self._config = config
+        self._image_table = image_table
+        self._first_tasks = [entry[0] for entry in image_table]
+        default = CHMJobCreator.CONFIG_DEFAULT
+        chmopts = CHMConfig(None, None, None,
+                            config.get(default,
+                                       CHMJobCreator.CONFIG_TILE_SIZE),
+                            config.get(default,
+                                       CHMJobCreator.CONFIG_OVERLAP_SIZE),
+                            number_tiles_per_task=config.
+                            getint(default,
+                                   CHMJobCreator.CONFIG_TILES_PER_TASK))
+        self._arg_gen = CHMArgGenerator(chmopts)
+        self._num_tasks = 0
+        if len(image_table) > 0:
+            (first_task, width, height, i_name) = image_table[-1]
+            self._num_tasks = (first_task - 1 +
+                               self._get_tile_grid(width, height).
+                               get_number_of_tasks())
+
+    def _get_tile_grid(self, width, height):
+        """Gets `TileGrid` for image of size `width` by `height`
+        """
+        return self._arg_gen.get_tile_grid(width, height)
+
+    def get_number_of_tasks(self):
+        """Gets number of CHM tasks
+        """
+        return self._num_tasks
+
+    def get_image_table(self):
+        """Gets table of images
+        :returns: list of tuples (first task id, width, height, image name)
+        """
+        return self._image_table
+
+    def _get_task_id(self, section):
+        """Converts `section` to task id
+        :returns: task id as int or None if `section` is not a task
+        """
+        try:
+            task_id = int(section)
+        except (TypeError, ValueError):
+            return None
+        if str(task_id) != str(section):
+            return None
+        if task_id < 1 or task_id > self._num_tasks:
+            return None
+        return task_id
+
+    def _locate_task(self, task_id):
+        """Finds image processed by task `task_id` by binary search
+        :raises NoSectionError: if `task_id` is not a valid task
+        :returns: tuple (image table entry, index of task within image
+                  starting at 0)
+        """
+        t_id = self._get_task_id(task_id)
+        if t_id is None:
+            raise NoSectionError(str(task_id))
+        entry = self._image_table[bisect.bisect_right(self._first_tasks,
+                                                      t_id) - 1]
+        return entry, t_id - entry[0]
+
+    def _get_output_image(self, i_name, img_task):
+        """Gets path relative to chmrun directory of output image
+        """
+        return os.path.join(CHMJobCreator.TILES_DIR, i_name,
+                            str(img_task + 1).zfill(3) + '.' + i_name)
+
+    def get_task(self, task_id):
+        """Gets image and tiles processed by CHM task `task_id`
+        :param task_id: id of task starting at 1
+        :raises NoSectionError: if `task_id` is not a valid task
+        :returns: tuple (image name, args, output image) where args is
+                  string of -t col,row flags and output image is path
+                  relative to chmrun directory
+        """
+        ((first_task, width, height, i_name),
+         img_task) = self._locate_task(task_id)
+        args = ' '.join(self._get_tile_grid(width, height).
+                        get_task_args(img_task))
+        return i_name, args, self._get_output_image(i_name, img_task)
+
+    def get_task_ids_for_image(self, image_name):
+        """Gets ids of tasks that process `image_name`
+        :param image_name: name of image as stored in manifest
+        :returns: list of task ids as strings, empty if image not found
+        """
+        for (first_task, width, height, i_name) in self._image_table:
+            if i_name == image_name:
+                num_tasks = self._get_tile_grid(width, height).\
+                    get_number_of_tasks()
+                return [str(t) for t in range(first_task,
+                                              first_task + num_tasks)]
+        return []
+
+    def defaults(self):
+        """Gets options in [DEFAULT] section
+        """
+        return self._config.defaults()
+
+    def sections(self):
+        """Gets task ids
+        :returns: list of task ids as strings in order
+        """
+        return [str(t) for t in range(1, self._num_tasks + 1)]
+
+    def has_section(self, section):
+        """Checks if `section` is a valid task id
+        """
+        return self._get_task_id(section) is not None
+
+    def has_option(self, section, option):
+        """Checks if `option` is set for `section`
+        """
+        if section == CHMJobCreator.CONFIG_DEFAULT:
+            return self._config.has_option(section, option)
+        if not self.has_section(section):
+            return False
+        if option in (CHMJobCreator.CONFIG_INPUT_IMAGE,
+                      CHMJobCreator.CONFIG_ARGS,
+                      CHMJobCreator.CONFIG_OUTPUT_IMAGE):
+            return True
+        return self._config.has_option(CHMJobCreator.CONFIG_DEFAULT,
+                                       option)
+
+    def get(self, section, option):
+        """Gets value of `option` for task `section`. Options not
+           specific to a task are read from [DEFAULT] section
+        :raises NoSectionError: if `section` is not a valid task id
+        :raises NoOptionError: if `option` is not set
+        """
+        if section == CHMJobCreator.CONFIG_DEFAULT:
+            return self._config.get(section, option)
+        if option == CHMJobCreator.CONFIG_INPUT_IMAGE:
+            return self._locate_task(section)[0][3]
+        if option == CHMJobCreator.CONFIG_ARGS:
+            return self.get_task(section)[1]
+        if option == CHMJobCreator.CONFIG_OUTPUT_IMAGE:
+            (entry, img_task) = self._locate_task(section)
+            return self._get_output_image(entry[3], img_task)
+        if not self.has_section(section):
+            raise NoSectionError(str(section))
+        return self._config.get(CHMJobCreator.CONFIG_DEFAULT, option)
+
+    def set(self, section, option, value):
+        """Sets `option` in [DEFAULT] section. Options of individual
+           tasks are derived and cannot be set
+        :raises NoSectionError: if `section` is not DEFAULT
+        """
+        if section != CHMJobCreator.CONFIG_DEFAULT:
+            raise NoSectionError(str(section))
+        self._config.set(section, option, value)
+
+    def write(self, fileobject):
+        """Writes [DEFAULT] section, which refers to the task manifest
+           file, to `fileobject`. The manifest file is not written
+        """
+        self._config.write(fileobject)
+
+    def getint(self, section, option):
+        """Gets value of `option` for task `section` as int
+        """
+        return int(self.get(section, option))
+
+    def getboolean(self, section, option):
+        """Gets value of `option` for task `section` as boolean
+        :raises ValueError: if value is not a boolean
+        """
+        val = self.get(section, option).lower()
+        if val not in configparser.ConfigParser.BOOLEAN_STATES:
+            raise ValueError('Not a boolean: ' + val)
+        return configparser.ConfigParser.BOOLEAN_STATES[val]
+
+
 class CHMConfigFromConfigFactory(object):
     """Creates CHMOpts object from configuration file
     """
@@ -972,9 +1344,9 @@ class CHMConfigFromConfigFactory(object):
                   passed into constructor
         """
         if skip_loading_config is False:
-            config = self._get_config(cfile=os.path.join(self._job_dir,
-                                                         CHMJobCreator.
-                                                         CONFIG_FILE_NAME))
+            config = load_chm_task_config(os.path.join(self._job_dir,
+                                                       CHMJobCreator.
+                                                       CONFIG_FILE_NAME))
         else:
             logger.debug('Skipping load of job configuration')
             config = None
@@ -1077,43 +1449,354 @@ class ImageStats(object):
         return self._format
 
 
+def get_default_image_stats_cache_file(image_dir):
+    """Gets path to file under user cache directory, $XDG_CACHE_HOME or
+       ~/.cache if not set, that caches `ImageStats` of images in
+       `image_dir`. The file name is derived from the absolute path of
+       `image_dir` so each directory gets its own cache file
+    :param image_dir: directory of images
+    :returns: path to cache file
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache')
+    digest = hashlib.md5(os.path.abspath(image_dir).
+                         encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'chmutil', 'imagestats.' + digest +
+                        '.json')
+
+
+class ImageStatsCache(object):
+    """Persistent cache of `ImageStats` stored as JSON. Entries are
+       keyed by image path and are only returned if the size and
+       modification time of the image match those stored
+    """
+    def __init__(self, cache_file):
+        """Constructor
+        :param cache_file: path to JSON file holding cache
+        """
+        self._cache_file = cache_file
+        self._entries = {}
+
+    def get_cache_file(self):
+        """Gets path to cache file
+        """
+        return self._cache_file
+
+    def load(self):
+        """Loads entries from cache file. If the file does not exist or
+           cannot be parsed the cache is left empty
+        """
+        self._entries = {}
+        if not os.path.isfile(self._cache_file):
+            logger.debug('No image stats cache ' + self._cache_file)
+            return
+        try:
+            with open(self._cache_file, 'r') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except Exception:
+            logger.exception('Ignoring image stats cache ' +
+                             self._cache_file + ' that could not be read')
+        logger.debug('Loaded ' + str(len(self._entries)) +
+                     ' entries from image stats cache ' + self._cache_file)
+
+    def get_image_stats(self, path, size, mtime):
+        """Gets cached `ImageStats` for image
+        :param path: path to image
+        :param size: size of image file in bytes
+        :param mtime: modification time of image file
+        :returns: ImageStats or None if not cached or if image changed
+        """
+        entry = self._entries.get(path)
+        if entry is None or len(entry) != 5:
+            return None
+        if entry[0] != size or entry[1] != mtime:
+            return None
+        return ImageStats(path, entry[2], entry[3], entry[4])
+
+    def set_image_stats(self, image_stats, size, mtime):
+        """Adds or replaces entry for image in cache
+        :param image_stats: ImageStats of image
+        :param size: size of image file in bytes
+        :param mtime: modification time of image file
+        """
+        self._entries[image_stats.get_file_path()] = [
+            size, mtime, image_stats.get_width(), image_stats.get_height(),
+            image_stats.get_format()]
+
+    def save(self, path_list=None):
+        """Writes cache to cache file, creating parent directory if
+           needed. The file is written to a temporary file that is
+           renamed into place so readers never see a partial file
+        :param path_list: if not None only entries for these paths are
+                          saved which drops images no longer present
+        """
+        if path_list is not None:
+            self._entries = dict((p, self._entries[p]) for p in path_list
+                                 if p in self._entries)
+        cache_dir = os.path.dirname(self._cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = self._cache_file + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(tmp_file, self._cache_file)
+
+
 class ImageStatsFromDirectoryFactory(object):
     """Creates ImageStats objects from directory of images
     """
+    DEFAULT_WORKERS = 8
 
-    def __init__(self, directory, max_image_pixels=768000000):
+    def __init__(self, directory, max_image_pixels=768000000,
+                 workers=DEFAULT_WORKERS, cache_file=None,
+                 refresh_cache=False):
         """Constructor
+        :param directory: directory of images
+        :param max_image_pixels: value to set Image.MAX_IMAGE_PIXELS to
+        :param workers: number of threads used to read image headers.
+                        Reading headers is mostly waiting on the file
+                        system so this can exceed the number of cpus
+        :param cache_file: path to `ImageStatsCache` file. If set only
+                           images that are new or whose size or
+                           modification time changed are opened
+        :param refresh_cache: if True ignore entries in `cache_file` and
+                              open every image
         """
         self._directory = directory
+        self._workers = workers
+        self._cache_file = cache_file
+        self._refresh_cache = refresh_cache
+        self._cache = None
         logger.debug('Setting MAX_IMAGE_PIXELS to ' + str(max_image_pixels))
         Image.MAX_IMAGE_PIXELS = max_image_pixels
 
+    def _read_image_stats(self, fp):
+        """Reads size and format of image `fp` from its header
+        :param fp: path to image
+        :returns: ImageStats or None if image could not be opened
+        """
+        try:
+            (width, height, fmt) = get_image_size_and_format(fp)
+            return ImageStats(fp, width, height, fmt)
+        except Exception:
+            logger.exception('Skipping file unable to open ' + fp)
+        return None
+
+    def _get_image_stats(self, fp):
+        """Gets `ImageStats` for `fp` from cache if set and up to date
+           otherwise by opening the image. Cached images are subject to
+           the same size limit as images that are opened
+        :param fp: path to image
+        :returns: ImageStats or None if image could not be opened
+        """
+        if self._cache is None:
+            return self._read_image_stats(fp)
+        try:
+            st = os.stat(fp)
+        except OSError:
+            logger.exception('Skipping file unable to stat ' + fp)
+            return None
+        iis = self._cache.get_image_stats(fp, st.st_size, st.st_mtime)
+        if iis is not None:
+            try:
+                check_image_size(iis.get_width(), iis.get_height())
+            except InvalidImageHeaderError as e:
+                logger.error('Skipping file ' + fp + ': ' + str(e))
+                return None
+            return iis
+        iis = self._read_image_stats(fp)
+        if iis is not None:
+            self._cache.set_image_stats(iis, st.st_size, st.st_mtime)
+        return iis
+
+    def _load_cache(self):
+        """Creates `ImageStatsCache` if cache file was set loading
+           its entries unless a refresh was requested
+        """
+        self._cache = None
+        if self._cache_file is None:
+            return
+        self._cache = ImageStatsCache(self._cache_file)
+        if self._refresh_cache is True:
+            logger.debug('Refreshing image stats cache ' + self._cache_file)
+            return
+        self._cache.load()
+
+    def _save_cache(self, file_list):
+        """Saves cache if one was loaded. Failure to write cache is
+           logged, but not raised
+        :param file_list: list of paths to images in directory
+        """
+        if self._cache is None:
+            return
+        try:
+            self._cache.save(path_list=file_list)
+        except Exception:
+            logger.exception('Unable to write image stats cache ' +
+                             self._cache_file)
+
     def get_input_image_stats(self,
                               keysortfunc=None):
-        """Gets InputImageStats objects as list
+        """Gets InputImageStats objects as list. Image headers are read
+           on a pool of threads, but the list is in the same order as
+           the files in the directory. Files that cannot be opened as
+           images are skipped
+        :returns: list of ImageStats objects
         """
-        image_stats_list = []
         if os.path.isfile(self._directory):
             return []
         file_list = get_image_path_list(self._directory,
                                         None)
-        for fp in file_list:
-            im = None
+        self._load_cache()
+        num_workers = min(self._workers, len(file_list))
+        if num_workers <= 1:
+            stats_list = [self._get_image_stats(fp) for fp in file_list]
+        else:
+            start_time = time.time()
+            pool = ThreadPool(num_workers)
             try:
-                im = Image.open(fp)
-                iis = ImageStats(fp, im.size[0],
-                                 im.size[1], im.format)
-                image_stats_list.append(iis)
-            except Exception:
-                logger.exception('Skipping file unable to open ' + fp)
+                stats_list = pool.map(self._get_image_stats, file_list)
             finally:
-                try:
-                    im.close()
-                except Exception:
-                    logger.exception('Caught exception attempting '
-                                     'to close image')
+                pool.close()
+                pool.join()
+            logger.debug('Read ' + str(len(file_list)) + ' image headers ' +
+                         'with ' + str(num_workers) + ' threads in ' +
+                         str(int(time.time() - start_time)) + ' seconds')
+        self._save_cache(file_list)
+        return [iis for iis in stats_list if iis is not None]
+
+
+class TileGrid(object):
+    """Geometry of the CHM tiles covering an image. Tiles are numbered
+       by column and row starting at 1 as passed to the CHM -t flag and
+       ordered column by column as they are assigned to tasks. Everything
+       is computed arithmetically so no per tile objects are created
+       until asked for
+    """
+    def __init__(self, width, height, tile_width, tile_height,
+                 overlap_width=0, overlap_height=0, tiles_per_task=1):
+        """Constructor
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :param tile_width: width of tile in pixels including overlap
+        :param tile_height: height of tile in pixels including overlap
+        :param overlap_width: pixels of overlap on left and right of tile
+        :param overlap_height: pixels of overlap on top and bottom of tile
+        :param tiles_per_task: number of tiles assigned to each task
+        :raises OverlapTooLargeForTileSizeError: if overlap leaves no
+                valid pixels in tile
+        """
+        self._width = width
+        self._height = height
+        self._overlap_width = overlap_width
+        self._overlap_height = overlap_height
+        self._step_width = tile_width - (2 * overlap_width)
+        if self._step_width <= 0:
+            raise OverlapTooLargeForTileSizeError('Overlap width too large '
+                                                  'for tile')
+        self._step_height = tile_height - (2 * overlap_height)
+        if self._step_height <= 0:
+            raise OverlapTooLargeForTileSizeError('Overlap height too large '
+                                                  'for tile')
+        self._tiles_per_task = max(int(tiles_per_task), 1)
+        self._cols = ((width + self._step_width - 1) //
+                      self._step_width)
+        self._rows = ((height + self._step_height - 1) //
+                      self._step_height)
+
+    def get_size(self):
+        """Gets size of image
+        :returns: tuple (width, height)
+        """
+        return self._width, self._height
+
+    def get_number_of_tiles_tuple(self):
+        """Gets number of tiles in horizontal and vertical directions
+        :returns: tuple (columns, rows)
+        """
+        return self._cols, self._rows
+
+    def get_number_of_tiles(self):
+        """Gets total number of tiles
+        """
+        return self._cols * self._rows
+
+    def get_number_of_tasks(self):
+        """Gets number of tasks needed to process all tiles
+        """
+        return ((self.get_number_of_tiles() + self._tiles_per_task - 1) //
+                self._tiles_per_task)
+
+    def get_tile_box(self, col, row):
+        """Gets region of image that CHM tile `col`, `row` generates
+           valid probabilities for. This is the tile minus the overlap
+           which CHM discards.
+        :param col: column of tile starting at 1
+        :param row: row of tile starting at 1
+        :returns: tuple (left, upper, right, lower) clipped to image
+        """
+        left = (int(col) - 1) * self._step_width
+        upper = (int(row) - 1) * self._step_height
+        return (min(left, self._width), min(upper, self._height),
+                min(left + self._step_width, self._width),
+                min(upper + self._step_height, self._height))
+
+    def get_padded_tile_box(self, col, row):
+        """Gets region of image CHM reads for tile `col`, `row` which is
+           the valid region plus the overlap on each side
+        :param col: column of tile starting at 1
+        :param row: row of tile starting at 1
+        :returns: tuple (left, upper, right, lower) clipped to image
+        """
+        (left, upper, right, lower) = self.get_tile_box(col, row)
+        return (max(left - self._overlap_width, 0),
+                max(upper - self._overlap_height, 0),
+                min(right + self._overlap_width, self._width),
+                min(lower + self._overlap_height, self._height))
 
-        return image_stats_list
+    def get_tile(self, index):
+        """Gets column and row of tile at `index` in task order
+        :param index: index of tile starting at 0
+        :returns: tuple (col, row) starting at 1
+        """
+        return (index // self._rows) + 1, (index % self._rows) + 1
+
+    def get_task_tile_range(self, task):
+        """Gets range of tile indexes processed by `task`
+        :param task: index of task starting at 0
+        :returns: tuple (start, end) of tile indexes, end is exclusive
+        """
+        start = task * self._tiles_per_task
+        return (start, min(start + self._tiles_per_task,
+                           self.get_number_of_tiles()))
+
+    def get_task_tiles(self, task):
+        """Gets generator of tiles processed by `task`
+        :param task: index of task starting at 0
+        :returns: Generator that returns (col, row) tuples
+        """
+        (start, end) = self.get_task_tile_range(task)
+        for index in range(start, end):
+            yield self.get_tile(index)
+
+    def get_task_args(self, task):
+        """Gets CHM tile flags for `task`
+        :param task: index of task starting at 0
+        :returns: list of strings in -t col,row format
+        """
+        return ['-t ' + str(c) + ',' + str(r)
+                for (c, r) in self.get_task_tiles(task)]
+
+    def get_args(self):
+        """Gets generator of CHM tile flags for each task
+        :returns: Generator that returns a list of -t col,row strings
+                  per task
+        """
+        for task in range(0, self.get_number_of_tasks()):
+            yield self.get_task_args(task)
 
 
 class CHMArgGenerator(object):
@@ -1136,35 +1819,68 @@ class CHMArgGenerator(object):
         if self._t_height_w_over <= 0:
             raise OverlapTooLargeForTileSizeError('Overlap height too large '
                                                   'for tile')
+        self._grids = {}
+
+    def get_tile_grid(self, width, height):
+        """Gets `TileGrid` for image of size `width` by `height`. Grids
+           are cached so images of the same size share one
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :returns: TileGrid
+        """
+        grid = self._grids.get((width, height))
+        if grid is None:
+            grid = TileGrid(width, height,
+                            self._chmopts.get_tile_width(),
+                            self._chmopts.get_tile_height(),
+                            overlap_width=self._chmopts.get_overlap_width(),
+                            overlap_height=self._chmopts.
+                            get_overlap_height(),
+                            tiles_per_task=self._chmopts.
+                            get_number_tiles_per_task())
+            self._grids[(width, height)] = grid
+        return grid
 
     def get_args(self, image_stats):
         """Creates a list of tile args
         """
-        (tiles_w, tiles_h) = self._get_number_of_tiles_tuple(image_stats)
-        tile_list = []
-        for c in range(1, int(tiles_w + 1)):
-            for r in range(1, int(tiles_h + 1)):
-                tile_list.append('-t ' + str(c) + ',' + str(r))
-        total = tiles_w * tiles_h
-        split_list = []
-        t_per_job = self._chmopts.get_number_tiles_per_task()
-
-        for ts in range(0, total, t_per_job):
-            split_list.append(tile_list[ts:ts+t_per_job])
+        return list(self._get_grid_for_image(image_stats).get_args())
 
-        return split_list
+    def _get_grid_for_image(self, image_stats):
+        """Gets `TileGrid` for image described by `image_stats`
+        """
+        return self.get_tile_grid(image_stats.get_width(),
+                                  image_stats.get_height())
 
     def _get_number_of_tiles_tuple(self, image_stats):
         """Gets number of tiles needed in horizontal and vertical
            directions to analyze an image
         """
-        tiles_width = (image_stats.get_width() +
-                       self._t_width_w_over - 1) / self._t_width_w_over
-
-        tiles_height = (image_stats.get_height() +
-                        self._t_height_w_over - 1) / self._t_height_w_over
-
-        return int(tiles_width), int(tiles_height)
+        return self._get_grid_for_image(image_stats).\
+            get_number_of_tiles_tuple()
+
+    def get_tile_box(self, col, row, width, height):
+        """Gets region of image that CHM tile `col`, `row` generates
+           valid probabilities for. This is the tile minus the overlap
+           which CHM discards.
+        :param col: column of tile starting at 1 as passed to -t flag
+        :param row: row of tile starting at 1 as passed to -t flag
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :returns: tuple (left, upper, right, lower) clipped to image
+        """
+        return self.get_tile_grid(width, height).get_tile_box(col, row)
+
+    def get_tile_boxes_from_args(self, args, width, height):
+        """Gets list of regions of image covered by tile flags in `args`
+        :param args: string of tile flags as generated by `get_args`
+                     ie -t 1,1 -t 1,2
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :returns: list of tuples (left, upper, right, lower)
+        """
+        grid = self.get_tile_grid(width, height)
+        return [grid.get_tile_box(c, r) for (c, r) in parse_tile_args(args)]
 
 
 class Box(object):
@@ -3,20 +3,39 @@
 import sys
 import os
 import argparse
+import json
 import logging
+import math
+import multiprocessing
+import time
 import chmutil
+import numpy as np
 from PIL import Image
 from PIL import ImageOps
 from PIL import ImageFilter
 
 from chmutil.core import Parameters
 from chmutil import core
+from chmutil.imagestream import get_image_row_reader
+from chmutil.imagestream import get_image_row_writer
+from chmutil.imagestream import save_image
+from chmutil.imagestream import TEMP_SUFFIX
 
 LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
 
 # create logger
 logger = logging.getLogger('chmutil.createchmimage')
 
+# Radius passed to ImageFilter.GaussianBlur by --gaussianblur
+GAUSSIAN_BLUR_RADIUS = 2
+
+# Number of box blur passes Pillow uses to approximate a gaussian blur
+GAUSSIAN_BLUR_PASSES = 3
+
+# File in output directory holding lookup table images were equalized
+# with by --equalizestack
+STACK_EQUALIZE_LUT_FILE = '.equalizestack.json'
+
 
 class NoInputImageFoundError(Exception):
     """Raised if input image does not exist
@@ -32,13 +51,28 @@ def _parse_arguments(desc, args):
     help_formatter = argparse.RawDescriptionHelpFormatter
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=help_formatter)
-    parser.add_argument("image", help='Image to convert')
+    parser.add_argument("image", help='Image to convert or directory of '
+                                      'images to convert')
     parser.add_argument("output", help='Output image path, should have .png'
                                        ' extension, if not .png will be '
-                                       'appended')
+                                       'appended. If image is a directory '
+                                       'this is the directory to write '
+                                       'converted images to')
     parser.add_argument("--equalize", action='store_true',
                         help='Run ImageOps.equalize on image'
                              'with no mask')
+    parser.add_argument("--equalizestack", action='store_true',
+                        help='If image is a directory, equalize all images '
+                             'with one lookup table computed from the '
+                             'summed histogram of every image in the '
+                             'directory instead of equalizing each image '
+                             'independently. The histograms are computed '
+                             'in a first pass over the images. The table '
+                             'is stored in ' + STACK_EQUALIZE_LUT_FILE +
+                             ' in the output directory and if it changes '
+                             'every image is converted again. For a '
+                             'single image this is the same as '
+                             '--equalize')
     parser.add_argument("--autocontrast", action='store_true',
                         help='Run ImageOps.autocontrast '
                              'on image with no mask')
@@ -48,6 +82,31 @@ def _parse_arguments(desc, args):
                                              'image 50%% of original size'
                                              '(default 0)',
                         default=0, type=int)
+    parser.add_argument("--downsamplefirst", action='store_true',
+                        help='Downsample while decoding the image, before '
+                             'grayscale conversion and the other '
+                             'operations, instead of after them. JPEG '
+                             'images are decoded at reduced scale and '
+                             'remaining downsampling is done with a box '
+                             'filter. Much faster for large factors, but '
+                             'output differs slightly since the '
+                             'operations run on the downsampled image')
+    parser.add_argument("--bandheight", type=int, default=0,
+                        help='If greater then 0, image is read, processed '
+                             'and written this many rows at a time so '
+                             'memory use depends on band height instead '
+                             'of image size. Bands carry enough extra rows '
+                             'that output matches processing the whole '
+                             'image except downsampled rows which may '
+                             'differ by 1 due to floating point rounding. '
+                             'Only PNG input is streamed, other formats '
+                             'are loaded fully. Ignored if '
+                             '--downsamplefirst is set (default 0)')
+    parser.add_argument("--workers", type=int, default=1,
+                        help='If image is a directory, number of '
+                             'processes to convert images with. Each '
+                             'process holds one image in memory at a '
+                             'time (default 1)')
     parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
                         'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level (default WARNING)",
@@ -58,22 +117,356 @@ def _parse_arguments(desc, args):
     return parser.parse_args(args, namespace=parsed_arguments)
 
 
-def _convert_image(image_file, dest_file, theargs):
-    """Convert image
+def _open_downsampled_image(image_file, downsample):
+    """Opens image reducing it by `downsample` while decoding. JPEG
+       images are asked via `Image.draft` to decode in grayscale at the
+       largest of 1/8, 1/4 or 1/2 scale that divides `downsample` and the
+       remaining factor is applied with `Image.reduce` box filter. The
+       result has the same size `Image.resize` produces in
+       `_convert_image`
+    :param image_file: path to image
+    :param downsample: int downsampling factor greater then 1
+    :returns: Image object downsampled
+    """
+    img = Image.open(image_file)
+    try:
+        (width, height) = img.size
+        target = (int(width / downsample), int(height / downsample))
+        if target[0] < 1 or target[1] < 1:
+            return img.resize(target)
+
+        for candidate in [8, 4, 2]:
+            if downsample % candidate == 0:
+                img.draft('L', (width // candidate, height // candidate))
+                break
+        # draft only changes size of JPEG images
+        scale = int(round(float(width) / img.size[0]))
+
+        logger.debug('Decoding at 1/' + str(scale) + ' scale')
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            reduced = ImageOps.grayscale(img)
+        else:
+            reduced = img
+        factor = downsample // scale
+        return _reduce_image(reduced, factor, target)
+    finally:
+        img.close()
+
+
+def _reduce_image(img, factor, target):
+    """Shrinks `img` by integer `factor` averaging each `factor` by
+       `factor` block of pixels into one pixel. Uses `Image.reduce`
+       which needs Pillow 7 or later, falling back to a box filter
+       resize which may differ by 1 in pixel value
+    :param img: Image object
+    :param factor: int factor to shrink by
+    :param target: tuple (width, height) of result, pixels beyond
+                   `target` times `factor` are ignored
+    :returns: Image object of size `target`
+    """
+    box = (0, 0, target[0] * factor, target[1] * factor)
+    if hasattr(img, 'reduce'):
+        return img.reduce(factor, box=box)
+    logger.debug('Image.reduce not available, resizing with box filter')
+    cropped = img.crop(box)
+    try:
+        return cropped.resize(target, Image.BOX)
+    finally:
+        cropped.close()
+
+
+def _open_grayscale_image(image_file, theargs):
+    """Opens image and converts it to grayscale, downsampling it while
+       decoding if --downsamplefirst is set
     :raises NoInputImageFoundError: if input image file does not exist
+    :returns: tuple (Image object, downsampling factor still to apply)
     """
     if not os.path.isfile(image_file):
         raise NoInputImageFoundError('Image ' + image_file + ' not found')
     logger.debug('Opening file ' + image_file)
 
-    img = Image.open(image_file)
+    downsample = int(theargs.downsample)
+    if theargs.downsamplefirst is True and downsample > 1:
+        logger.info('Downsampling while decoding by factor of ' +
+                    str(downsample))
+        orig_img = _open_downsampled_image(image_file, downsample)
+        downsample = 0
+    else:
+        orig_img = Image.open(image_file)
+    try:
+        logger.info('Running ImageOps.grayscale')
+        return ImageOps.grayscale(orig_img), downsample
+    finally:
+        # close so file handles are not held in directory mode workers
+        orig_img.close()
+
+
+def _get_equalize_lut(histogram):
+    """Gets lookup table that equalizes an image with `histogram`
+       computed the same way as ImageOps.equalize
+    :param histogram: list of 256 pixel counts
+    :returns: list of 256 values
+    """
+    histo = [count for count in histogram if count]
+    if len(histo) <= 1:
+        return list(range(256))
+    step = (sum(histo) - histo[-1]) // 255
+    if not step:
+        return list(range(256))
+    lut = []
+    n = step // 2
+    for i in range(256):
+        lut.append(n // step)
+        n = n + histogram[i]
+    return lut
+
+
+def _get_autocontrast_lut(histogram):
+    """Gets lookup table that maximizes contrast of an image with
+       `histogram` computed the same way as ImageOps.autocontrast
+    :param histogram: list of 256 pixel counts
+    :returns: list of 256 values
+    """
+    for lo in range(256):
+        if histogram[lo]:
+            break
+    for hi in range(255, -1, -1):
+        if histogram[hi]:
+            break
+    if hi <= lo:
+        return list(range(256))
+    scale = 255.0 / (hi - lo)
+    offset = -lo * scale
+    lut = []
+    for ix in range(256):
+        ix = int(ix * scale + offset)
+        if ix < 0:
+            ix = 0
+        elif ix > 255:
+            ix = 255
+        lut.append(ix)
+    return lut
+
+
+def _get_blur_halo(radius, passes=GAUSSIAN_BLUR_PASSES):
+    """Gets number of rows beyond a band that ImageFilter.GaussianBlur
+       with `radius` reads when blurring it. Pillow approximates the
+       gaussian with `passes` box blurs whose radius is computed here
+       the same way and each box blur reads one row beyond its radius
+    :returns: int number of rows
+    """
+    sigma2 = float(radius) * radius / passes
+    box_l = math.floor((math.sqrt(12.0 * sigma2 + 1.0) - 1.0) / 2.0)
+    box_a = (2 * box_l + 1) * (box_l * (box_l + 1) - 3 * sigma2)
+    box_a /= 6 * (sigma2 - (box_l + 1) * (box_l + 1))
+    return passes * (int(box_l + box_a) + 1)
+
 
-    logger.info('Running ImageOps.grayscale')
-    img = ImageOps.grayscale(img)
+class _RowWindow(object):
+    """Holds a sliding window of rows pulled from an iterator of 2D
+       arrays of consecutive image rows. Requested rows must never
+       start above rows previously requested since older rows are
+       discarded
+    """
+    def __init__(self, rows_iter):
+        """Constructor
+        :param rows_iter: iterator of 2D NumPy arrays of consecutive rows
+        """
+        self._rows_iter = rows_iter
+        self._rows = None
+        self._start = 0
+
+    def get_rows(self, upper, lower):
+        """Gets rows `upper` up to `lower` discarding rows above `upper`
+        :returns: 2D NumPy array
+        """
+        while self._rows is None or self._start + len(self._rows) < lower:
+            rows = next(self._rows_iter)
+            if self._rows is None:
+                self._rows = rows
+            else:
+                self._rows = np.concatenate((self._rows, rows))
+        self._rows = self._rows[upper - self._start:]
+        self._start = upper
+        return self._rows[:lower - upper]
+
+
+def _read_grayscale_rows(image_file, band_height):
+    """Reads image `band_height` rows at a time converting each band to
+       grayscale
+    :returns: generator of 2D NumPy uint8 arrays
+    """
+    reader = get_image_row_reader(image_file)
+    try:
+        band = reader.read_rows(band_height)
+        while band is not None:
+            gray = ImageOps.grayscale(band)
+            band.close()
+            yield np.array(gray)
+            gray.close()
+            band = reader.read_rows(band_height)
+    finally:
+        reader.close()
 
-    if theargs.equalize is True:
-        logger.info('Running ImageOps.equalize')
-        img = ImageOps.equalize(img)
+
+def _get_streamed_histogram(image_file, band_height):
+    """Gets histogram of grayscale image reading it a band at a time
+    :returns: list of 256 pixel counts
+    """
+    histogram = np.zeros(256, dtype=np.int64)
+    for rows in _read_grayscale_rows(image_file, band_height):
+        histogram += Image.fromarray(rows).histogram()
+    return histogram.tolist()
+
+
+def _get_band_lut(image_file, theargs, equalize_lut=None):
+    """Gets single lookup table that applies --equalize and then
+       --autocontrast computing the grayscale histogram of the image
+       in a first pass over it if needed
+    :param equalize_lut: If set this lookup table is used to equalize
+                         the image
+    :returns: list of 256 values or None if neither is set
+    """
+    equalize = theargs.equalize is True or theargs.equalizestack is True
+    if not equalize and theargs.autocontrast is not True:
+        return None
+
+    histogram = None
+    if (equalize and equalize_lut is None) or theargs.autocontrast is True:
+        logger.info('Computing histogram of ' + image_file)
+        histogram = _get_streamed_histogram(image_file, theargs.bandheight)
+
+    lut = list(range(256))
+    if equalize:
+        if equalize_lut is None:
+            equalize_lut = _get_equalize_lut(histogram)
+        # Image.point clips values above 255 in equalize lookup tables
+        lut = [min(255, value) for value in equalize_lut]
+
+    if theargs.autocontrast is True:
+        equalized = [0] * 256
+        for value in range(256):
+            equalized[lut[value]] += histogram[value]
+        autocontrast_lut = _get_autocontrast_lut(equalized)
+        lut = [autocontrast_lut[value] for value in lut]
+    return lut
+
+
+def _blur_rows(rows_iter, height, band_height):
+    """Blurs rows from `rows_iter` a band at a time. Each band is
+       blurred along with enough rows above and below it that the
+       result matches blurring the whole image
+    :returns: generator of 2D NumPy uint8 arrays
+    """
+    halo = _get_blur_halo(GAUSSIAN_BLUR_RADIUS)
+    window = _RowWindow(rows_iter)
+    for upper in range(0, height, band_height):
+        lower = min(height, upper + band_height)
+        halo_upper = max(0, upper - halo)
+        rows = window.get_rows(halo_upper, min(height, lower + halo))
+        blurred = Image.fromarray(rows).filter(
+            ImageFilter.GaussianBlur(GAUSSIAN_BLUR_RADIUS))
+        yield np.asarray(blurred)[upper - halo_upper:lower - halo_upper]
+        blurred.close()
+
+
+def _resize_rows(rows_iter, width, height, downsample, band_height):
+    """Downsamples rows from `rows_iter` the same way `Image.resize` does
+       for the whole image in `_convert_image` a band of output rows at a
+       time. Each band is resized from the rows within reach of the
+       bicubic filter passing the location of the band to `Image.resize`
+    :returns: generator of 2D NumPy uint8 arrays
+    """
+    out_size = (int(width / downsample), int(height / downsample))
+    scale = float(height) / out_size[1]
+    # bicubic filter has support of 2 scaled by the downsampling
+    support = 2.0 * scale
+    out_band_height = max(1, int(band_height / downsample))
+    window = _RowWindow(rows_iter)
+    for out_upper in range(0, out_size[1], out_band_height):
+        out_lower = min(out_size[1], out_upper + out_band_height)
+        upper = max(0, int(out_upper * scale - support + 0.5) - 1)
+        lower = min(height, int(out_lower * scale + support + 0.5) + 1)
+        rows = Image.fromarray(window.get_rows(upper, lower))
+        res = rows.resize((out_size[0], out_lower - out_upper),
+                          box=(0, out_upper * scale - upper, width,
+                               out_lower * scale - upper))
+        yield np.asarray(res)
+        res.close()
+        rows.close()
+
+
+def _convert_image_in_bands(image_file, dest_file, theargs,
+                            equalize_lut=None):
+    """Converts image the same way as `_convert_image` reading,
+       processing and writing --bandheight rows at a time. The image is
+       written to a temporary file renamed to `dest_file` once complete
+       so if conversion fails nothing is left at `dest_file`
+    :param equalize_lut: If set and image is to be equalized, this
+                         lookup table is applied
+    :raises NoInputImageFoundError: if input image file does not exist
+    """
+    if not os.path.isfile(image_file):
+        raise NoInputImageFoundError('Image ' + image_file + ' not found')
+
+    band_height = theargs.bandheight
+    lut = _get_band_lut(image_file, theargs, equalize_lut=equalize_lut)
+    reader = get_image_row_reader(image_file)
+    (width, height) = reader.get_size()
+    reader.close()
+
+    logger.info('Converting ' + image_file + ' in bands of ' +
+                str(band_height) + ' rows')
+    rows_iter = _read_grayscale_rows(image_file, band_height)
+    if lut is not None:
+        lut_array = np.array(lut, dtype=np.uint8)
+        rows_iter = (np.take(lut_array, rows) for rows in rows_iter)
+
+    if theargs.gaussianblur:
+        rows_iter = _blur_rows(rows_iter, height, band_height)
+
+    # downsampling by 1 leaves image unchanged
+    downsample = int(theargs.downsample)
+    if downsample > 1:
+        rows_iter = _resize_rows(rows_iter, width, height, downsample,
+                                 band_height)
+        (width, height) = (int(width / downsample),
+                           int(height / downsample))
+
+    writer = get_image_row_writer(dest_file, width, height)
+    try:
+        for rows in rows_iter:
+            writer.write_rows(rows)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return 0
+
+
+def _convert_image(image_file, dest_file, theargs, equalize_lut=None):
+    """Convert image
+    :param equalize_lut: If set and image is to be equalized, this
+                         lookup table is applied instead of running
+                         ImageOps.equalize
+    :raises NoInputImageFoundError: if input image file does not exist
+    """
+    if theargs.bandheight > 0 and not (theargs.downsamplefirst is True and
+                                       int(theargs.downsample) > 1):
+        if not dest_file.endswith('.png'):
+            dest_file += '.png'
+        return _convert_image_in_bands(image_file, dest_file, theargs,
+                                       equalize_lut=equalize_lut)
+
+    (img, downsample) = _open_grayscale_image(image_file, theargs)
+
+    if theargs.equalize is True or theargs.equalizestack is True:
+        if equalize_lut is not None:
+            logger.info('Applying stack equalization lookup table')
+            img = img.point(equalize_lut)
+        else:
+            logger.info('Running ImageOps.equalize')
+            img = ImageOps.equalize(img)
 
     if theargs.autocontrast is True:
         logger.info('Running ImageOps.autocontrast')
@@ -81,16 +474,214 @@ def _convert_image(image_file, dest_file, theargs):
 
     if theargs.gaussianblur:
         logger.info('Running Image.filter Gaussian Blur')
-        img = img.filter(ImageFilter.GaussianBlur())
+        img = img.filter(ImageFilter.GaussianBlur(GAUSSIAN_BLUR_RADIUS))
 
-    if theargs.downsample > 0:
-        ds = int(theargs.downsample)
+    if downsample > 0:
+        ds = downsample
         logger.info('Downsampling by factor of ' + str(ds))
         img = img.resize((int(img.size[0]/ds), int(img.size[1]/ds)))
 
     if not dest_file.endswith('.png'):
         dest_file += '.png'
-    img.save(dest_file, "PNG")
+    save_image(img, dest_file, 'PNG')
+    return 0
+
+
+# Set in each process of directory mode pool by _init_worker
+_worker_args = None
+
+
+def _init_worker(theargs):
+    """Initializes process of directory mode pool
+    """
+    global _worker_args
+    _worker_args = theargs
+
+
+def _run_worker(task):
+    """Converts image of `task` using arguments set by `_init_worker`
+    :param task: tuple (image file, dest file, stack equalization
+                 lookup table or None)
+    :returns: tuple (dest file, None or error message if it failed)
+    """
+    (image_file, dest_file, equalize_lut) = task
+    try:
+        _convert_image(image_file, dest_file, _worker_args,
+                       equalize_lut=equalize_lut)
+        return dest_file, None
+    except Exception as e:
+        logger.exception('Unable to convert ' + image_file)
+        return dest_file, str(e)
+
+
+def _run_histogram_worker(image_file):
+    """Computes histogram of grayscale image as it would be equalized
+       using arguments set by `_init_worker`. Only the histogram is kept
+    :returns: list of 256 pixel counts or None if image could not
+              be read
+    """
+    try:
+        (img, downsample) = _open_grayscale_image(image_file, _worker_args)
+        histogram = img.histogram()
+        img.close()
+        return histogram
+    except Exception:
+        logger.exception('Unable to compute histogram of ' + image_file)
+        return None
+
+
+def _map_in_pool(pool, func, items):
+    """Runs `func` on each of `items` on `pool` or serially if `pool`
+       is None
+    :returns: list of results in no particular order
+    """
+    if pool is None:
+        return [func(item) for item in items]
+    return list(pool.imap_unordered(func, items, chunksize=1))
+
+
+def _get_stack_equalize_lut(image_files, pool):
+    """Computes histogram of every image on `pool` and sums them into
+       the lookup table that equalizes the whole stack
+    :returns: list of 256 values
+    """
+    total = [0] * 256
+    for histogram in _map_in_pool(pool, _run_histogram_worker,
+                                  image_files):
+        if histogram is None:
+            continue
+        for i in range(256):
+            total[i] += histogram[i]
+    return _get_equalize_lut(total)
+
+
+def _read_stack_equalize_lut(lut_file):
+    """Reads lookup table written by `_write_stack_equalize_lut`
+    :returns: list of 256 values or None if `lut_file` does not exist or
+              cannot be parsed
+    """
+    if not os.path.isfile(lut_file):
+        return None
+    try:
+        f = open(lut_file, 'r')
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except ValueError:
+        logger.warning('Unable to parse ' + lut_file)
+        return None
+
+
+def _write_stack_equalize_lut(lut_file, lut):
+    """Writes lookup table to `lut_file` via a temporary file
+    """
+    temp_file = lut_file + TEMP_SUFFIX
+    f = open(temp_file, 'w')
+    try:
+        json.dump(lut, f)
+    finally:
+        f.close()
+    os.rename(temp_file, lut_file)
+
+
+def _get_image_files(image_dir):
+    """Gets sorted list of paths to files in `image_dir` ignoring files
+       ending with `TEMP_SUFFIX` which are images still being written
+       and hidden files such as `STACK_EQUALIZE_LUT_FILE`
+    """
+    image_files = []
+    for entry in sorted(os.listdir(image_dir)):
+        if entry.startswith('.') or entry.endswith(TEMP_SUFFIX):
+            continue
+        image_file = os.path.join(image_dir, entry)
+        if os.path.isfile(image_file):
+            image_files.append(image_file)
+    return image_files
+
+
+def _get_images_to_convert(image_dir, dest_dir, skip_up_to_date=True):
+    """Gets images in `image_dir` whose converted image in `dest_dir`
+       does not exist or is older then the image. Converted images are
+       renamed into place once complete so any that exist are complete
+    :param skip_up_to_date: If False every image is returned
+    :returns: tuple (list of tuples (image file, dest file), number of
+              images skipped because they are up to date)
+    """
+    pairs = []
+    skipped = 0
+    for image_file in _get_image_files(image_dir):
+        entry = os.path.basename(image_file)
+        dest_file = os.path.join(dest_dir,
+                                 os.path.splitext(entry)[0] + '.png')
+        if (skip_up_to_date is True and os.path.isfile(dest_file) and
+                os.path.getmtime(dest_file) >= os.path.getmtime(image_file)):
+            logger.debug('Skipping ' + dest_file + ' which is up to date')
+            skipped += 1
+            continue
+        pairs.append((image_file, dest_file))
+    return pairs, skipped
+
+
+def _convert_images_in_directory(image_dir, dest_dir, theargs):
+    """Converts every image in `image_dir` writing a png with the same
+       name to `dest_dir` on a pool of --workers processes. Images whose
+       converted image is newer then the image are skipped. If
+       --equalizestack is set, a first pass over all images on the pool
+       computes the histograms used to equalize the stack. If the
+       resulting lookup table differs from the one stored in
+       `STACK_EQUALIZE_LUT_FILE` by the last run, every image is
+       converted since adding or changing any image changes the
+       equalization of all of them
+    :returns: 0 if all images were converted otherwise 1
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+
+    (pairs, skipped) = _get_images_to_convert(image_dir, dest_dir)
+    lut_file = os.path.join(dest_dir, STACK_EQUALIZE_LUT_FILE)
+    start = time.time()
+    pool = None
+    if theargs.workers > 1:
+        pool = multiprocessing.Pool(processes=theargs.workers,
+                                    initializer=_init_worker,
+                                    initargs=(theargs,))
+    else:
+        _init_worker(theargs)
+    try:
+        equalize_lut = None
+        if theargs.equalizestack is True:
+            logger.info('Computing histograms for stack equalization')
+            equalize_lut = _get_stack_equalize_lut(
+                _get_image_files(image_dir), pool)
+            if equalize_lut != _read_stack_equalize_lut(lut_file):
+                logger.info('Stack equalization lookup table differs from '
+                            + lut_file + ', converting every image')
+                if os.path.isfile(lut_file):
+                    os.remove(lut_file)
+                (pairs, skipped) = _get_images_to_convert(
+                    image_dir, dest_dir, skip_up_to_date=False)
+        results = _map_in_pool(pool, _run_worker,
+                               [(image_file, dest_file, equalize_lut)
+                                for (image_file, dest_file) in pairs])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    duration = time.time() - start
+
+    failed = [dest_file for (dest_file, error) in results
+              if error is not None]
+    converted = len(results) - len(failed)
+    sys.stdout.write('Converted ' + str(converted) + ' images, skipped ' +
+                     str(skipped) + ' up to date and ' + str(len(failed)) +
+                     ' failed in ' + '%.2f' % duration + ' seconds (' +
+                     '%.2f' % (converted / max(duration, 1e-6)) +
+                     ' images/sec)\n')
+    if len(failed) > 0:
+        return 1
+    if equalize_lut is not None:
+        _write_stack_equalize_lut(lut_file, equalize_lut)
     return 0
 
 
@@ -118,10 +709,25 @@ def main(arglist):
               4. GaussianBlur
               5. Downsample
 
+              If --downsamplefirst is set, Downsample is instead done
+              while decoding the image before all other operations.
+
+              If image is a directory and --equalizestack is set, every
+              image is equalized with the same lookup table computed from
+              the histograms of all images in the directory so contrast
+              is consistent across the stack.
+
               Example Usage:
 
               createchmimage.py someimage.tif someimage.png
 
+              If image is a directory every image in it is converted
+              and written to output directory as a png with the same
+              name on a pool of --workers processes. Images whose
+              converted image is newer then the image are skipped:
+
+              createchmimage.py --workers 8 rawimages/ images/
+
               """.format(version=chmutil.__version__)
 
     theargs = _parse_arguments(desc, arglist[1:])
@@ -130,6 +736,10 @@ def main(arglist):
     core.setup_logging(logger, log_format=LOG_FORMAT,
                        loglevel=theargs.loglevel)
     try:
+        if os.path.isdir(theargs.image):
+            return _convert_images_in_directory(
+                os.path.abspath(theargs.image),
+                os.path.abspath(theargs.output), theargs)
         return _convert_image(os.path.abspath(theargs.image),
                               os.path.abspath(theargs.output),
                               theargs)
@@ -10,6 +10,7 @@ from chmutil.core import CHMJobCreator
 from chmutil.core import CHMConfig
 from chmutil.core import Parameters
 from chmutil.cluster import ClusterFactory
+from chmutil.image import OVERLAY_COLORS
 from chmutil import core
 
 # create logger
@@ -84,12 +85,52 @@ def _parse_arguments(desc, args):
     parser.add_argument('--walltime', default='12:00:00',
                         help='Sets walltime for job in HH:MM:SS format '
                              'default(12:00:00) ')
+    parser.add_argument('--overlaythreshpc', default=30, type=int,
+                        help='Percent cut off for thresholding probability '
+                             'maps when creating overlay images in merge '
+                             'phase with valid range 0-100 (default 30)')
+    parser.add_argument('--overlaycolor', default='blue',
+                        choices=sorted(OVERLAY_COLORS.keys()),
+                        help='Color of overlay images created in merge '
+                             'phase (default blue)')
+    parser.add_argument('--overlayopacity', default=70, type=int,
+                        help='Opacity of overlay images created in merge '
+                             'phase. 0 is transparent and 255 is opaque '
+                             '(default 70)')
+    parser.add_argument('--imagestatscache', default=None,
+                        help='File caching width, height and format of '
+                             'images which are only reopened if their '
+                             'size or modification time changed. '
+                             '(default a file under $XDG_CACHE_HOME/chmutil '
+                             'or ~/.cache/chmutil)')
+    parser.add_argument('--refreshimagestats', action='store_true',
+                        help='If set, ignore --imagestatscache and reopen '
+                             'every image to get its width, height and '
+                             'format')
+    parser.add_argument('--legacytasklist', action='store_true',
+                        help='If set, write a section for every CHM task '
+                             'to ' + CHMJobCreator.CONFIG_FILE_NAME +
+                             ' instead of writing the table of images to ' +
+                             CHMJobCreator.TASK_MANIFEST_FILE_NAME +
+                             '. Needed if job will be run by chmutil '
+                             'older then 0.6.0')
     parser.add_argument('--version', action='version',
                         version=('%(prog)s ' + chmutil.__version__))
 
     return parser.parse_args(args, namespace=parsed_arguments)
 
 
+def _get_imagestats_cache(theargs):
+    """Gets path to image stats cache file
+    :param theargs: list of arguments obtained from _parse_arguments()
+    :returns: --imagestatscache if set otherwise default cache file
+              for images directory
+    """
+    if theargs.imagestatscache is not None:
+        return os.path.abspath(theargs.imagestatscache)
+    return core.get_default_image_stats_cache_file(theargs.images)
+
+
 def _create_chm_job(theargs):
     """Creates CHM Job
     :param theargs: list of arguments obtained from _parse_arguments()
@@ -117,9 +158,15 @@ def _create_chm_job(theargs):
                         account=theargs.account,
                         mergejobname='merge' + theargs.jobname,
                         merge_tasks_per_node=mergetaskspernode,
+                        overlay_threshpc=theargs.overlaythreshpc,
+                        overlay_color=theargs.overlaycolor,
+                        overlay_opacity=theargs.overlayopacity,
                         version=chmutil.__version__,
                         cluster=theargs.cluster,
-                        rawargs=theargs.rawargs)
+                        rawargs=theargs.rawargs,
+                        imagestats_cache=_get_imagestats_cache(theargs),
+                        refresh_imagestats=theargs.refreshimagestats,
+                        task_manifest=not theargs.legacytasklist)
 
         creator = CHMJobCreator(con)
         creator.create_job()
@@ -175,9 +222,15 @@ def main(arglist):
                     At the top of this file are some are options common
                     to all CHM tasks denoted by the header [DEFAULT]
 
-                    Following the [DEFAULT] section are options for each
-                    CHM task which are delimited by a [#] where # is a number
-                    starting at 1.
+                    By default the [DEFAULT] section sets
+                    taskmanifest = {manifest} and the CHM tasks are
+                    derived from the tile options and the table of
+                    images in {manifest} which lists the id of the
+                    first task, width, height and name of each image.
+
+                    If --legacytasklist is set, following the [DEFAULT]
+                    section are options for each CHM task which are
+                    delimited by a [#] where # is a number starting at 1.
 
                     Example default:
 
@@ -202,7 +255,9 @@ def main(arglist):
 
 
               {mergeconfig}
-                 -- Configuration containing merge tasks
+                 -- Configuration containing merge tasks. The [DEFAULT]
+                    section holds the threshold, color and opacity
+                    used to create the overlay images
 
               runjobs.<cluster>
                   -- Cluster submit script
@@ -245,6 +300,7 @@ def main(arglist):
               Once job is created invoke checkchmjob.py for job submission.
               """.format(version=chmutil.__version__,
                          config=CHMJobCreator.CONFIG_FILE_NAME,
+                         manifest=CHMJobCreator.TASK_MANIFEST_FILE_NAME,
                          mergeconfig=CHMJobCreator.MERGE_CONFIG_FILE_NAME,
                          rundir=CHMJobCreator.RUN_DIR,
                          stdout=CHMJobCreator.STDOUT_DIR,
@@ -4,19 +4,34 @@ import sys
 import os
 import argparse
 import logging
+import multiprocessing
+import time
 import chmutil
+import numpy as np
 from PIL import Image
 
 from chmutil.core import Parameters
 from chmutil import core
-from chmutil.image import ImageThresholder
-from chmutil.image import ColorizeGrayscaleImage
+from chmutil.image import ProbabilityMapOverlayGenerator
+from chmutil.image import SingleColumnImageTileGenerator
+from chmutil.image import InvalidImageError
+from chmutil.image import OVERLAY_COLORS
+from chmutil.imagestream import OutputProfile
+from chmutil.imagestream import TEMP_SUFFIX
+from chmutil.imagestream import save_image
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import get_image_row_reader
 
 LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
 
 # create logger
 logger = logging.getLogger('chmutil.createprobmapoverlay')
 
+# Estimate of bytes held per pixel of a band when streaming which
+# covers the decoded base and probability map rows and their copies,
+# the lookup index, the RGBA result and the filtered output rows
+BAND_BYTES_PER_PIXEL = 24
+
 
 class NoInputImageFoundError(Exception):
     """Raised if input image does not exist
@@ -32,17 +47,21 @@ def _parse_arguments(desc, args):
     help_formatter = argparse.RawDescriptionHelpFormatter
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=help_formatter)
-    parser.add_argument("image", help='Base image')
-    parser.add_argument("probmap", help='Probability map')
+    parser.add_argument("image", help='Base image or directory of base '
+                                      'images')
+    parser.add_argument("probmap", help='Probability map or directory of '
+                                        'probability maps')
 
     parser.add_argument("output", help='Output image path, should have .png'
                                        'extension, if not .png will be '
-                                       'appended')
+                                       'appended unless --outputprofile '
+                                       'is set. If image and probmap are '
+                                       'directories this is the '
+                                       'directory to write overlays to')
     parser.add_argument("--overlaycolor", type=str,
                         help="Color to use for overlay"
                              "(default blue)",
-                        choices=['red', 'blue', 'green', 'yellow',
-                                 'cyan', 'magenta', 'purple'],
+                        choices=sorted(OVERLAY_COLORS.keys()),
                         default='blue')
     parser.add_argument("--threshpc", type=int,
                         help='Percent cut off for thresholding with '
@@ -55,6 +74,42 @@ def _parse_arguments(desc, args):
     parser.add_argument("--opacity", type=int, default=70,
                         help='Sets level of opacity of overlay. 0 is '
                              'transparent and 255 is opaque. (default 70)')
+    parser.add_argument("--outputprofile", default=OutputProfile.DEFAULT,
+                        choices=OutputProfile.PROFILES,
+                        help='Format and compression used to write '
+                             '<output>. {default} writes PNG with default '
+                             'compression, {png} is PNG with '
+                             '--compresslevel compression, {tiff} is '
+                             'uncompressed TIFF, {tifflzw} is LZW '
+                             'compressed TIFF and {npy} is a NumPy .npy '
+                             'file. For profiles other then {default} '
+                             'the path is used as given. '
+                             '(default {default})'
+                             ''.format(default=OutputProfile.DEFAULT,
+                                       png=OutputProfile.PNG,
+                                       tiff=OutputProfile.TIFF,
+                                       tifflzw=OutputProfile.TIFF_LZW,
+                                       npy=OutputProfile.NPY))
+    parser.add_argument("--compresslevel", type=int, default=6,
+                        choices=range(0, 10), metavar='[0-9]',
+                        help='zlib compression level used by '
+                             '--outputprofile ' + OutputProfile.PNG +
+                             '. 0 is no compression, 1 is fastest and 9 '
+                             'is smallest (default 6)')
+    parser.add_argument("--workers", type=int, default=1,
+                        help='Number of threads to use to compress PNG '
+                             'output. If image and probmap are '
+                             'directories this is the number of processes '
+                             'overlays are created with (default 1)')
+    parser.add_argument("--maxmemory", type=int,
+                        help='If set, base image and probability map are '
+                             'read and the overlay written a horizontal '
+                             'band at a time with the band height chosen '
+                             'so each band uses at most this many '
+                             'megabytes. Only PNG input is streamed, other '
+                             'formats are loaded fully. Ignored for output '
+                             'profiles that cannot be written '
+                             'incrementally')
     parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
                         'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level (default WARNING)",
@@ -69,49 +124,135 @@ def _get_pixel_coloring_tuple(thecolor):
 
     logger.debug('Overlay color set to: ' + thecolor)
 
-    if thecolor == 'red':
-        return 1, 0, 0
+    return OVERLAY_COLORS.get(thecolor, OVERLAY_COLORS['blue'])
 
-    if thecolor == 'green':
-        return 0, 1, 0
 
-    if thecolor == 'yellow':
-        return 1, 1, 0
+def _get_band_height(width, max_memory):
+    """Gets height of band whose overlay can be created within
+       `max_memory` megabytes
+    :param width: width of image in pixels
+    :param max_memory: memory budget in megabytes
+    :returns: band height in rows which is at least 1
+    """
+    return max(1, int(max_memory * 1024 * 1024 /
+                      (width * BAND_BYTES_PER_PIXEL)))
+
+
+def _convert_image_in_bands(image_file, probmap_file, dest_file,
+                            generator, profile, max_memory):
+    """Creates overlay a horizontal band at a time reading rows of
+       base image and probability map and writing each overlay band
+       to a temporary file which is renamed to `dest_file` once every
+       band is written. If this fails nothing is left at `dest_file`
+    :param image_file: path to base image
+    :param probmap_file: path to probability map
+    :param dest_file: path to write overlay to
+    :param generator: `ProbabilityMapOverlayGenerator`
+    :param profile: `OutputProfile` used to write overlay
+    :param max_memory: memory budget in megabytes
+    :raises InvalidImageError: if images differ in size
+    :raises UnsupportedImageFormatError: if `profile` cannot write
+                                         `dest_file` incrementally
+    """
+    base_reader = get_image_row_reader(image_file)
+    prob_reader = None
+    writer = None
+    try:
+        prob_reader = get_image_row_reader(probmap_file)
+        (width, height) = base_reader.get_size()
+        if prob_reader.get_size() != (width, height):
+            raise InvalidImageError('Base image size ' + str((width, height)) +
+                                    ' does not match probability map size ' +
+                                    str(prob_reader.get_size()))
+        writer = profile.get_row_writer(dest_file, width, height,
+                                        mode='RGBA')
+        band_height = _get_band_height(width, max_memory)
+        logger.info('Writing ' + dest_file + ' in bands of ' +
+                    str(band_height) + ' rows')
+        tiler = SingleColumnImageTileGenerator(tileheight=band_height)
+        for box in tiler.get_tile_boxes(width, height):
+            num_rows = box[3] - box[1]
+            base = base_reader.read_rows(num_rows)
+            probmap = prob_reader.read_rows(num_rows)
+            res = generator.create_overlay(base, probmap)
+            writer.write_rows(np.asarray(res))
+            res.close()
+            probmap.close()
+            base.close()
+        writer.close()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        base_reader.close()
+        if prob_reader is not None:
+            prob_reader.close()
 
-    if thecolor == 'cyan':
-        return 0, 1, 1
 
-    if thecolor == 'magenta':
-        return 1, 0, 1
+def _get_overlay_generator(theargs):
+    """Gets `ProbabilityMapOverlayGenerator` configured from `theargs`
+    """
+    colortuple = _get_pixel_coloring_tuple(theargs.overlaycolor)
+    return ProbabilityMapOverlayGenerator(
+        threshold_percent=int(theargs.threshpc), color=colortuple,
+        opacity=theargs.opacity)
 
-    if thecolor == 'purple':
-        return 0.5, 0, 0.5
 
-    return 0, 0, 1
+def _get_output_profile(theargs, workers):
+    """Gets `OutputProfile` configured from `theargs`
+    :param workers: number of threads used to compress PNG output
+    """
+    return OutputProfile(theargs.outputprofile,
+                         compress_level=theargs.compresslevel,
+                         workers=workers)
 
 
-def _get_thresholded_probmap(probmap_file, threshpc):
-    """Reads probability map and thresholds it according to
-    value of `threshpc`
-    :param probmap_file:
-    :param threshpc: threshold percent ie 30 means to threshold
-           all pixels below 30% max intensity to 0 and the rest
-           to 255
-    :return: Pillow Image that is grayscale thresholded to be
-             values of 0 or 255
+def _get_dest_file(dest_file, profile):
+    """Gets path overlay is written to which has .png appended
+       if `profile` is the default profile and `dest_file` does not
+       already end with .png
+    """
+    if profile.get_profile() == OutputProfile.DEFAULT:
+        if not dest_file.endswith('.png'):
+            return dest_file + '.png'
+    return dest_file
+
+
+def _create_overlay(image_file, probmap_file, dest_file, generator,
+                    profile, max_memory):
+    """Creates overlay of `probmap_file` on `image_file` and writes
+       it to `dest_file`
+    :param generator: `ProbabilityMapOverlayGenerator`
+    :param profile: `OutputProfile` used to write overlay
+    :param max_memory: if not None create overlay a band at a time
+                       within this many megabytes
     """
-    probimg = None
+    if max_memory is not None:
+        try:
+            _convert_image_in_bands(image_file, probmap_file, dest_file,
+                                    generator, profile, max_memory)
+            return
+        except UnsupportedImageFormatError as e:
+            logger.warning(str(e) + '. Creating entire overlay in memory')
+
+    probimg = Image.open(probmap_file)
+    img = Image.open(image_file)
     try:
-        probimg = Image.open(probmap_file).convert(mode='L')
-
-        # threshold image anything belowtheargs.threshpc percentage
-        #  set to zero, rest to 255
-        logger.info('Thresholding probability map')
-        thresh = ImageThresholder(threshold_percent=int(threshpc))
-        return thresh.threshold_image(probimg)
+        logger.info('Combining base image with probability map')
+        res = generator.create_overlay(img, probimg)
     finally:
-        if probimg is not None:
-            probimg.close()
+        img.close()
+        probimg.close()
+
+    if (profile.get_profile() == OutputProfile.DEFAULT and
+            profile.get_workers() <= 1):
+        save_image(res, dest_file, 'PNG')
+        return
+
+    logger.info('Writing ' + dest_file + ' with output profile ' +
+                profile.get_profile())
+    profile.write_array(np.asarray(res), dest_file)
 
 
 def _convert_image(image_file, probmap_file, dest_file, theargs):
@@ -123,26 +264,131 @@ def _convert_image(image_file, probmap_file, dest_file, theargs):
     if not os.path.isfile(probmap_file):
         raise NoInputImageFoundError('Image ' + probmap_file + ' not found')
 
-    thresh_image = _get_thresholded_probmap(probmap_file,
-                                            theargs.threshpc)
+    profile = _get_output_profile(theargs, theargs.workers)
+    _create_overlay(image_file, probmap_file,
+                    _get_dest_file(dest_file, profile),
+                    _get_overlay_generator(theargs), profile,
+                    theargs.maxmemory)
+    return 0
 
-    logger.info('Colorizing probability map')
-    colortuple = _get_pixel_coloring_tuple(theargs.overlaycolor)
-    colorizer = ColorizeGrayscaleImage(color=colortuple,
-                                       opacity=theargs.opacity)
 
-    col_img = colorizer.colorize_image(thresh_image)
-    thresh_image.close()
+# Set in each process of batch mode pool by _init_batch_worker
+_batch_worker_state = None
+
 
-    logger.info('Loading base image')
-    img = Image.open(image_file).convert(mode='RGBA')
+def _init_batch_worker(theargs):
+    """Initializes process of batch mode pool by creating the overlay
+       generator and output profile once so the lookup tables of the
+       generator are reused for every image the process handles
+    """
+    global _batch_worker_state
+    _batch_worker_state = (_get_overlay_generator(theargs),
+                           _get_output_profile(theargs, 1),
+                           theargs.maxmemory)
 
-    logger.info('Combining base image with probability map')
-    res = Image.alpha_composite(img, col_img)
 
-    if not dest_file.endswith('.png'):
-        dest_file += '.png'
-    res.save(dest_file, "PNG")
+def _run_batch_worker(pair):
+    """Creates overlay for `pair` using state set by `_init_batch_worker`
+    :param pair: tuple (image file, probability map file, dest file)
+    :returns: tuple (dest file, None or error message if it failed)
+    """
+    (generator, profile, max_memory) = _batch_worker_state
+    (image_file, probmap_file, dest_file) = pair
+    try:
+        _create_overlay(image_file, probmap_file, dest_file, generator,
+                        profile, max_memory)
+        return dest_file, None
+    except Exception as e:
+        logger.exception('Unable to create overlay ' + dest_file)
+        return dest_file, str(e)
+
+
+def _get_batch_dest_file(dest_dir, entry, profile):
+    """Gets path overlay of probability map `entry` is written to in
+       batch mode. For profiles other then the default the suffix of
+       `entry` is replaced with the suffix of the format written
+    """
+    if profile.get_profile() == OutputProfile.DEFAULT:
+        return _get_dest_file(os.path.join(dest_dir, entry), profile)
+    suffix = OutputProfile.PROFILE_SUFFIXES[profile.get_profile()][0]
+    return os.path.join(dest_dir, os.path.splitext(entry)[0] + suffix)
+
+
+def _get_batch_pairs(image_dir, probmap_dir, dest_dir, profile):
+    """Pairs each probability map in `probmap_dir` with the image in
+       `image_dir` that has the same name ignoring suffix. Files ending
+       with `TEMP_SUFFIX`, which are images still being written, are
+       ignored
+    :returns: list of tuples (image file, probability map file,
+              dest file)
+    """
+    images = {}
+    for entry in os.listdir(image_dir):
+        image_file = os.path.join(image_dir, entry)
+        if os.path.isfile(image_file) and not entry.endswith(TEMP_SUFFIX):
+            images[os.path.splitext(entry)[0]] = image_file
+
+    pairs = []
+    for entry in sorted(os.listdir(probmap_dir)):
+        probmap_file = os.path.join(probmap_dir, entry)
+        if not os.path.isfile(probmap_file) or entry.endswith(TEMP_SUFFIX):
+            continue
+        image_file = images.get(os.path.splitext(entry)[0])
+        if image_file is None:
+            logger.warning('No image found in ' + image_dir +
+                           ' for probability map ' + entry)
+            continue
+        pairs.append((image_file, probmap_file,
+                      _get_batch_dest_file(dest_dir, entry, profile)))
+    return pairs
+
+
+def _convert_images_in_batch(image_dir, probmap_dir, dest_dir, theargs):
+    """Creates overlay for every probability map in `probmap_dir` on the
+       image with the same name in `image_dir` writing them to `dest_dir`
+       on a pool of --workers processes. Overlays that already exist are
+       skipped. Overlays are renamed into place only once completely
+       written so any that exist are complete
+    :returns: 0 if all overlays were created otherwise 1
+    """
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir)
+
+    profile = _get_output_profile(theargs, 1)
+    pairs = []
+    skipped = 0
+    for pair in _get_batch_pairs(image_dir, probmap_dir, dest_dir, profile):
+        if os.path.isfile(pair[2]):
+            logger.debug('Skipping ' + pair[2] + ' which exists')
+            skipped += 1
+            continue
+        pairs.append(pair)
+
+    start = time.time()
+    if theargs.workers <= 1:
+        _init_batch_worker(theargs)
+        results = [_run_batch_worker(pair) for pair in pairs]
+    else:
+        pool = multiprocessing.Pool(processes=theargs.workers,
+                                    initializer=_init_batch_worker,
+                                    initargs=(theargs,))
+        try:
+            results = pool.map(_run_batch_worker, pairs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    duration = time.time() - start
+
+    failed = [dest_file for (dest_file, error) in results
+              if error is not None]
+    created = len(results) - len(failed)
+    sys.stdout.write('Created ' + str(created) + ' overlays, skipped ' +
+                     str(skipped) + ' existing and ' + str(len(failed)) +
+                     ' failed in ' + '%.2f' % duration + ' seconds (' +
+                     '%.2f' % (created / max(duration, 1e-6)) +
+                     ' images/sec)\n')
+    if len(failed) > 0:
+        return 1
     return 0
 
 
@@ -163,6 +409,23 @@ def main(arglist):
 
               createprobmapoverlay.py baseimage.png probmap.png overlay.png
 
+              If image and probmap are directories, such as the input
+              image directory and run/probmaps directory of a job, an
+              overlay is created in output directory for every
+              probability map paired with the image of the same name
+              ignoring suffix. Overlays are created on a pool of
+              --workers processes and those that already exist are
+              skipped:
+
+              createprobmapoverlay.py --workers 8 images/ run/probmaps \\
+                                      run/overlaymaps
+
+              For images too large to fit in memory add --maxmemory to
+              create the overlay a band at a time:
+
+              createprobmapoverlay.py --maxmemory 2000 baseimage.png \\
+                                      probmap.png overlay.png
+
               """.format(version=chmutil.__version__)
 
     theargs = _parse_arguments(desc, arglist[1:])
@@ -171,6 +434,11 @@ def main(arglist):
     core.setup_logging(logger, log_format=LOG_FORMAT,
                        loglevel=theargs.loglevel)
     try:
+        if os.path.isdir(theargs.image) and os.path.isdir(theargs.probmap):
+            return _convert_images_in_batch(os.path.abspath(theargs.image),
+                                            os.path.abspath(theargs.probmap),
+                                            os.path.abspath(theargs.output),
+                                            theargs)
         return _convert_image(os.path.abspath(theargs.image),
                               os.path.abspath(theargs.probmap),
                               os.path.abspath(theargs.output),
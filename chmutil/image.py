@@ -1,11 +1,31 @@
 # -*- coding: utf-8 -*-
 
+import os
 import logging
+import threading
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
 from PIL import Image
 from PIL import ImageMath
 
+from chmutil.core import TileGrid
+from chmutil.imagestream import PNGRowReader
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import get_image_row_reader
+from chmutil.imagestream import get_image_row_writer
+
 logger = logging.getLogger(__name__)
 
+OVERLAY_COLORS = {'red': (1, 0, 0),
+                  'green': (0, 1, 0),
+                  'blue': (0, 0, 1),
+                  'yellow': (1, 1, 0),
+                  'cyan': (0, 1, 1),
+                  'magenta': (1, 0, 1),
+                  'purple': (0.5, 0, 0.5)}
+
 
 class InvalidImageError(Exception):
     """Denotes invalid image object
@@ -17,20 +37,467 @@ class SimpleImageMerger(object):
     """Merges two same size images together by taking maximum
     pixel value from either image
     """
-    def __init__(self):
+    # Number of rows inflated at a time when skipping rows of a PNG
+    # above the valid regions of a tile
+    SKIP_ROWS = 256
+
+    def __init__(self, use_imagemath=False, workers=1):
         """Constructor
+        :param use_imagemath: If True merge images pairwise with
+                              Pillow ImageMath instead of folding
+                              them into a single NumPy array
+        :param workers: Number of threads to use to decode images.
+                        At most this many decoded images are held in
+                        memory waiting to be merged
         """
-        pass
+        self._use_imagemath = use_imagemath
+        self._workers = max(1, int(workers))
 
-    def merge_images(self, image_list):
+    def merge_images(self, image_list, tile_boxes=None):
         """Merge list of images
         :param image_list: List of full path to image files to merge
+        :param tile_boxes: Optional dict where key is path to image in
+                           `image_list` and value is a list of
+                           (left, upper, right, lower) tuples denoting
+                           the only regions of that image with data.
+                           See `merge_images_into_array`
         :return: Pillow Image containing merge of all images
         """
         if image_list is None:
             logger.error('No images to merge')
             return None
         logger.info('Found ' + str(len(image_list)) + ' images to merge')
+
+        if self._use_imagemath is True:
+            return self._merge_images_with_imagemath(image_list)
+
+        merged = self.merge_images_into_array(image_list,
+                                              tile_boxes=tile_boxes)
+        if merged is None:
+            return None
+        return Image.fromarray(merged)
+
+    def merge_images_into_array(self, image_list, tile_boxes=None,
+                                canvas_file=None, canvas=None):
+        """Merges list of images into a single 8-bit NumPy array
+        by decoding each image and folding it into the array with
+        an in place maximum.
+
+        If `tile_boxes` has an entry for an image then only the
+        regions listed are copied from that image into the merged
+        array, the rest of the image is ignored. The regions of
+        different images must not overlap.
+
+        :param image_list: List of full path to image files to merge
+        :param tile_boxes: Optional dict where key is path to image in
+                           `image_list` and value is a list of
+                           (left, upper, right, lower) tuples
+        :param canvas_file: If set, the merged array is a `numpy.memmap`
+                            backed by this file which is created or
+                            overwritten. Caller is responsible for
+                            removing the file
+        :param canvas: If set, images are merged into this existing
+                       2D NumPy uint8 array, such as a partially merged
+                       image from an earlier call, and `canvas_file`
+                       is ignored
+        :returns: 2D NumPy array of type uint8 or None if `image_list`
+                  is None or empty
+        """
+        if image_list is None or len(image_list) == 0:
+            return None
+
+        if tile_boxes is None:
+            tile_boxes = {}
+
+        start_time = time.time()
+        if canvas is not None:
+            merged = canvas
+        else:
+            merged = self._create_array_for_image(image_list[0],
+                                                  canvas_file=canvas_file)
+        item_list = [(entry, tile_boxes.get(entry)) for entry in image_list]
+        pool = self._get_thread_pool()
+        try:
+            for regions in self._imap_bounded(pool, self._decode_image,
+                                              item_list):
+                self._merge_regions_into_array(merged, regions)
+        finally:
+            self._close_thread_pool(pool)
+        self._log_merge_rate(len(image_list), start_time)
+        return merged
+
+    def merge_images_to_file(self, image_list, dest_file, band_height,
+                             tile_boxes=None, band_callback=None,
+                             output_profile=None):
+        """Merges list of images writing the result to `dest_file`
+        one horizontal band of `band_height` rows at a time. PNG images
+        are read incrementally so memory use depends on `band_height`
+        and number of images and not the size of the images. If any
+        image is not a PNG that can be streamed the images are merged
+        in memory with `merge_images_into_array` instead. `dest_file`
+        only appears once it is completely written.
+        :param image_list: List of full path to image files to merge
+        :param dest_file: Path to write merged image to. Must have
+                          suffix supported by
+                          `imagestream.get_image_row_writer`
+        :param band_height: Number of rows to merge at a time
+        :param tile_boxes: Optional dict where key is path to image in
+                           `image_list` and value is a list of
+                           (left, upper, right, lower) tuples. See
+                           `merge_images_into_array`
+        :param band_callback: Optional function called with
+                              ((left, upper, right, lower) location of
+                              band, 2D NumPy uint8 array of merged band)
+                              after each band is written
+        :param output_profile: Optional `imagestream.OutputProfile`
+                               used to write `dest_file`
+        :raises UnsupportedImageFormatError: if `dest_file` format
+                cannot be written incrementally
+        :returns: True if images were merged or False if `image_list`
+                  is None or empty
+        """
+        if image_list is None or len(image_list) == 0:
+            logger.error('No images to merge')
+            return False
+
+        if tile_boxes is None:
+            tile_boxes = {}
+
+        readers = self._get_row_readers(image_list)
+        merged = None
+        if readers is None:
+            logger.info('Not all images can be read incrementally, '
+                        'merging ' + str(len(image_list)) + ' images in '
+                        'memory')
+            merged = self.merge_images_into_array(image_list,
+                                                  tile_boxes=tile_boxes)
+            (height, width) = merged.shape
+            readers = []
+        else:
+            logger.info('Merging ' + str(len(image_list)) + ' images in '
+                        'bands of ' + str(band_height) + ' rows')
+            (width, height) = readers[0].get_size()
+        start_time = time.time()
+        writer = None
+        pool = None
+        try:
+            if output_profile is None:
+                writer = get_image_row_writer(dest_file, width, height)
+            else:
+                writer = output_profile.get_row_writer(dest_file, width,
+                                                       height)
+            pool = self._get_thread_pool()
+            band_gen = SingleColumnImageTileGenerator(tileheight=band_height)
+            for band_box in band_gen.get_tile_boxes(width, height):
+                if merged is not None:
+                    band = merged[band_box[1]:band_box[3]]
+                else:
+                    band = self._merge_band(pool, image_list, readers,
+                                            band_box, tile_boxes)
+                writer.write_rows(band)
+                if band_callback is not None:
+                    band_callback(band_box, band)
+            writer.close()
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            self._close_thread_pool(pool)
+            for reader in readers:
+                reader.close()
+        if merged is None:
+            self._log_merge_rate(len(image_list), start_time)
+        return True
+
+    def _get_row_readers(self, image_list):
+        """Opens a row reader for every image in `image_list`
+        :param image_list: List of full path to image files
+        :returns: list of `imagestream.PNGRowReader` objects or None if
+                  any image cannot be read incrementally, in which case
+                  no readers are left open
+        """
+        readers = []
+        try:
+            for entry in image_list:
+                reader = get_image_row_reader(entry)
+                readers.append(reader)
+                if not isinstance(reader, PNGRowReader):
+                    logger.debug(entry + ' cannot be read incrementally')
+                    for reader in readers:
+                        reader.close()
+                    return None
+        except Exception:
+            for reader in readers:
+                reader.close()
+            raise
+        return readers
+
+    def _merge_band(self, pool, image_list, readers, band_box, tile_boxes):
+        """Reads band `band_box` from every reader and merges them
+        :returns: 2D NumPy uint8 array of merged band
+        """
+        band = np.zeros((band_box[3] - band_box[1],
+                         band_box[2] - band_box[0]), dtype=np.uint8)
+        item_list = []
+        for entry, reader in zip(image_list, readers):
+            item_list.append((reader, band_box, tile_boxes.get(entry)))
+        for regions in self._imap_bounded(pool, self._read_band,
+                                          item_list):
+            self._merge_regions_into_array(band, regions)
+        return band
+
+    def _get_thread_pool(self):
+        """Creates thread pool used to decode images
+        :returns: ThreadPool or None if only one worker was requested
+        """
+        if self._workers <= 1:
+            return None
+        logger.debug('Decoding images with ' + str(self._workers) +
+                     ' threads')
+        return ThreadPool(self._workers)
+
+    def _close_thread_pool(self, pool):
+        """Shuts down thread pool created by `_get_thread_pool`
+        """
+        if pool is None:
+            return
+        pool.terminate()
+        pool.join()
+
+    def _imap_bounded(self, pool, func, item_list):
+        """Generator that invokes `func` on each item in `item_list`
+        using `pool`, yielding results in order of completion. At most
+        `workers` results are being computed or waiting to be consumed
+        at any time since a result is only considered consumed once
+        the caller asks for the next one.
+        :param pool: ThreadPool or None to invoke `func` serially
+        :param func: function taking a single item
+        :param item_list: list of items
+        :returns: Generator of results from `func`
+        """
+        if pool is None:
+            for item in item_list:
+                yield func(item)
+            return
+
+        slots = threading.Semaphore(self._workers)
+
+        def bounded_func(item):
+            slots.acquire()
+            try:
+                return func(item)
+            except Exception:
+                slots.release()
+                raise
+
+        try:
+            for res in pool.imap_unordered(bounded_func, item_list):
+                yield res
+                slots.release()
+        finally:
+            # wake any threads still waiting so pool can be shut down
+            for x in range(0, self._workers):
+                slots.release()
+
+    def _log_merge_rate(self, num_images, start_time):
+        """Logs number of images merged per second
+        """
+        duration = time.time() - start_time
+        if duration > 0:
+            rate = '%.2f' % (float(num_images) / duration)
+        else:
+            rate = 'inf'
+        logger.info('Merged ' + str(num_images) + ' tiles in ' +
+                    '%.3f' % duration + ' seconds (' + rate + ' tiles/sec)')
+
+    def _decode_image(self, item):
+        """Decodes image keeping only the bounding box of nonzero
+           pixels in the image or in each box of the image
+        :param item: tuple (path to image, list of boxes or None)
+        :returns: list of tuples (box, 2D NumPy uint8 array, copy) where
+                  copy is True if the array should be copied into the
+                  merged array and False if it should be merged with
+                  an in place maximum
+        """
+        (image_file, box_list) = item
+        logger.debug('Decoding image ' + image_file)
+        if box_list is not None:
+            regions = self._decode_png_regions(image_file, box_list)
+            if regions is not None:
+                return regions
+        img = Image.open(image_file)
+        try:
+            if img.mode != 'L':
+                logger.debug('Converting ' + image_file + ' from mode ' +
+                             img.mode + ' to L')
+                img = img.convert(mode='L')
+            data = np.asarray(img, dtype=np.uint8)
+            if box_list is None:
+                return self._get_nonzero_regions(data, [None], False,
+                                                 image_file)
+            return self._get_nonzero_regions(data, box_list, True,
+                                             image_file)
+        finally:
+            img.close()
+
+    def _decode_png_regions(self, image_file, box_list):
+        """Decodes only the rows of PNG image spanned by `box_list`
+           using `imagestream.PNGRowReader` which stops inflating the
+           image after the last row needed. Rows above the first box
+           are still inflated, since PNG rows can only be unfiltered in
+           order, but a band at a time so they are never all in memory
+        :param image_file: path to image
+        :param box_list: list of (left, upper, right, lower) tuples
+        :returns: list of tuples like `_decode_image` or None if
+                  `image_file` is not a PNG that can be read incrementally
+                  or the boxes reach the last row of the image in which
+                  case decoding the entire image with Pillow is faster
+        """
+        try:
+            reader = PNGRowReader(image_file)
+        except UnsupportedImageFormatError:
+            return None
+        try:
+            boxes = [box for box in box_list
+                     if box[0] < box[2] and box[1] < box[3]]
+            if len(boxes) == 0:
+                return []
+            height = reader.get_size()[1]
+            upper = min(min([box[1] for box in boxes]), height)
+            lower = max([box[3] for box in boxes])
+            if lower >= height:
+                return None
+            row = 0
+            while row < upper:
+                num_rows = min(SimpleImageMerger.SKIP_ROWS, upper - row)
+                reader.read_rows(num_rows).close()
+                row += num_rows
+            if lower <= upper:
+                return []
+            rows = reader.read_rows(lower - upper)
+        finally:
+            reader.close()
+        if rows.mode != 'L':
+            rows = rows.convert(mode='L')
+        data = np.asarray(rows, dtype=np.uint8)
+        rows.close()
+        band_boxes = [(box[0], box[1] - upper, box[2], box[3] - upper)
+                      for box in boxes]
+        regions = []
+        for (box, region, copy) in self._get_nonzero_regions(
+                data, band_boxes, True, image_file):
+            regions.append(((box[0], box[1] + upper, box[2],
+                             box[3] + upper), region, copy))
+        return regions
+
+    def _read_band(self, item):
+        """Reads next band of rows from image reader keeping only the
+           bounding box of nonzero pixels in the band or in each box
+        :param item: tuple (reader from
+                     `imagestream.get_image_row_reader`,
+                     (left, upper, right, lower) location of band in image,
+                     list of boxes denoting valid regions of image or None
+                     if entire image is valid)
+        :returns: list of tuples (box, 2D NumPy uint8 array, copy) where
+                  box is relative to band
+        """
+        (reader, band_box, box_list) = item
+        rows = reader.read_rows(band_box[3] - band_box[1])
+        if rows.mode != 'L':
+            rows = rows.convert(mode='L')
+        rows = np.asarray(rows, dtype=np.uint8)
+        if box_list is None:
+            return self._get_nonzero_regions(rows, [None], False)
+
+        band_boxes = []
+        for box in box_list:
+            upper = max(box[1], band_box[1]) - band_box[1]
+            lower = min(box[3], band_box[3]) - band_box[1]
+            band_boxes.append((box[0], upper, box[2], lower))
+        return self._get_nonzero_regions(rows, band_boxes, True)
+
+    def _get_nonzero_regions(self, data, box_list, copy, image_file=None):
+        """Finds bounding box of nonzero pixels within each box
+           of `data`. Boxes that are empty or only contain zero pixels
+           are omitted
+        :param data: 2D NumPy uint8 array
+        :param box_list: list of (left, upper, right, lower) tuples, a
+                         None entry denotes the entire array
+        :param copy: value to set as copy in tuples returned
+        :param image_file: if set, time taken to find bounding boxes
+                           and fraction of image they cover is logged
+                           under this name
+        :returns: list of tuples (box, 2D NumPy uint8 array, copy) where
+                  box is location of bounding box in `data` and array
+                  is a view of `data`
+        """
+        start_time = time.time()
+        regions = []
+        num_pixels = 0
+        for box in box_list:
+            if box is None:
+                box = (0, 0, data.shape[1], data.shape[0])
+            elif box[0] >= box[2] or box[1] >= box[3]:
+                continue
+            region = data[box[1]:box[3], box[0]:box[2]]
+            rows = np.flatnonzero(region.any(axis=1))
+            if rows.size == 0:
+                continue
+            upper = int(rows[0])
+            lower = int(rows[-1]) + 1
+            cols = np.flatnonzero(region[upper:lower].any(axis=0))
+            left = int(cols[0])
+            right = int(cols[-1]) + 1
+            num_pixels += (right - left) * (lower - upper)
+            regions.append(((box[0] + left, box[1] + upper,
+                             box[0] + right, box[1] + lower),
+                            region[upper:lower, left:right], copy))
+        if image_file is not None:
+            logger.debug('Bounding boxes of ' + image_file + ' cover ' +
+                         str(num_pixels) + ' of ' + str(data.size) +
+                         ' pixels and took ' +
+                         str(round(time.time() - start_time, 4)) +
+                         ' seconds to find')
+        return regions
+
+    def _merge_regions_into_array(self, merged, regions):
+        """Merges decoded regions into `merged` array. Regions flagged
+        as copy are copied, the rest are merged with an in place maximum
+        :param merged: 2D NumPy array of type uint8
+        :param regions: list of tuples (box, 2D NumPy uint8 array, copy)
+        """
+        for box, data, copy in regions:
+            target = merged[box[1]:box[3], box[0]:box[2]]
+            if copy is True:
+                target[:] = data
+            else:
+                np.maximum(target, data, out=target)
+
+    def _create_array_for_image(self, image_file, canvas_file=None):
+        """Creates zero filled 8-bit NumPy array matching dimensions of
+           image without decoding image data
+        :param image_file: Path to image
+        :param canvas_file: If set, array is a `numpy.memmap` backed by
+                            this file
+        :returns: 2D NumPy array of type uint8
+        """
+        img = Image.open(image_file)
+        try:
+            (width, height) = img.size
+        finally:
+            img.close()
+        if canvas_file is None:
+            return np.zeros((height, width), dtype=np.uint8)
+        logger.info('Creating memory mapped canvas ' + canvas_file)
+        return np.memmap(canvas_file, dtype=np.uint8, mode='w+',
+                         shape=(height, width))
+
+    def _merge_images_with_imagemath(self, image_list):
+        """Merges list of images pairwise using Pillow ImageMath
+        :param image_list: List of full path to image files to merge
+        :return: Pillow Image containing merge of all images
+        """
         merged = None
         for entry in image_list:
             if merged is None:
@@ -62,6 +529,26 @@ class SimpleImageMerger(object):
                 image1.close()
 
 
+def _threshold_image_file(args):
+    """Thresholds image file writing result to destination file.
+       Defined at module level so it can be invoked by a process pool
+    :param args: tuple of (`ImageThresholder`, source image file,
+                 destination image file)
+    :returns: destination image file
+    """
+    thresholder, image_file, dest_file = args
+    img = Image.open(image_file)
+    try:
+        if img.mode != 'L':
+            img = img.convert(mode='L')
+        data = np.array(img)
+    finally:
+        img.close()
+    thresholder.threshold_array(data, out=data)
+    Image.fromarray(data).save(dest_file)
+    return dest_file
+
+
 class ImageThresholder(object):
     """Thresholds image by percent specified
     """
@@ -74,6 +561,7 @@ class ImageThresholder(object):
         """
         self._threshold_percent = threshold_percent
         self._cutoff = int((float(threshold_percent)*0.01)*255)
+        self._lut = [0 if px < self._cutoff else 255 for px in range(256)]
 
     def get_pixel_intensity_cutoff(self):
         """Gets pixel intensity cutoff as calculated in constructor
@@ -84,7 +572,8 @@ class ImageThresholder(object):
         return self._cutoff
 
     def threshold_image(self, image):
-        """Thresholds image passed in
+        """Thresholds image passed in. 8-bit grayscale images are
+           thresholded with lookup table computed in constructor
         :param image: Image object from PIL to be thresholded
         :returns: Image object thresholded which is pointing to same
                   object image
@@ -92,8 +581,66 @@ class ImageThresholder(object):
         if image is None:
             raise InvalidImageError('Image is None')
 
+        if image.mode == 'L':
+            return image.point(self._lut)
+
         return Image.eval(image, lambda px: 0 if px < self._cutoff else 255)
 
+    def threshold_array(self, data, out=None):
+        """Thresholds 8-bit NumPy array. Since the lookup table computed
+           in constructor is a single step this is done with a comparison
+           against the cutoff written as booleans into `out` which are then
+           negated in place to turn 1 into 255. This is much faster then
+           indexing the lookup table with `data`
+        :param data: NumPy array of type uint8 to threshold
+        :param out: NumPy array of type uint8 with same shape as `data`
+                    to write result to. Can be `data` to threshold in
+                    place. If None a new array is allocated
+        :raises InvalidImageError: if `data` is None or not of type uint8
+        :returns: thresholded NumPy array which is `out` if set
+        """
+        if data is None:
+            raise InvalidImageError('Image is None')
+
+        if data.dtype != np.uint8:
+            raise InvalidImageError('Only uint8 arrays can be thresholded '
+                                    'not ' + str(data.dtype))
+
+        if out is None:
+            out = np.empty_like(data)
+
+        np.greater_equal(data, self._cutoff, out=out.view(np.bool_))
+        return np.negative(out, out=out)
+
+    def threshold_many(self, image_files, dest_dir, workers=1):
+        """Thresholds image files writing each result to a file with the
+           same name under `dest_dir`. Images are converted to 8-bit
+           grayscale before thresholding.
+        :param image_files: list of paths to images to threshold
+        :param dest_dir: directory to write thresholded images to
+        :param workers: number of processes to threshold images with. If
+                        1 or less images are thresholded serially
+        :returns: list of paths to thresholded images in same order as
+                  `image_files`
+        """
+        args = []
+        for image_file in image_files:
+            args.append((self, image_file,
+                         os.path.join(dest_dir,
+                                      os.path.basename(image_file))))
+
+        if workers is None or workers <= 1:
+            return [_threshold_image_file(a) for a in args]
+
+        logger.debug('Thresholding ' + str(len(args)) + ' images with ' +
+                     str(workers) + ' processes')
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            return pool.map(_threshold_image_file, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
 
 class ColorizeGrayscaleImage(object):
     """Takes an image that is grayscale and colorizes it by converting
@@ -109,6 +656,7 @@ class ColorizeGrayscaleImage(object):
         """
         self._color = color
         self._opacity = int(opacity)
+        self._rgba_lut = None
 
     def get_color_tuple(self):
         """Gets colorizing tuple
@@ -117,40 +665,227 @@ class ColorizeGrayscaleImage(object):
         """
         return self._color
 
-    def colorize_image(self, image):
-        """Colorizes grayscale image
-        :param image: Image object from PIL to be colorized
+    def _get_rgba_lut(self):
+        """Gets lookup table mapping each 8-bit grayscale value to its
+           RGBA color, building it on first call
+        :returns: NumPy uint8 array of shape (256, 4)
+        """
+        if self._rgba_lut is not None:
+            return self._rgba_lut
+
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        for px in range(256):
+            for band in range(3):
+                lut[px, band] = max(0, min(255,
+                                           int(px*self._color[band])))
+            lut[px, 3] = 0 if px == 0 else max(0, min(255, self._opacity))
+        self._rgba_lut = lut
+        return lut
+
+    def colorize_image(self, image, palette=False):
+        """Colorizes grayscale image in a single pass by looking up each
+           pixel in a RGBA lookup table cached by this object
+        :param image: Image object from PIL to be colorized. Images not
+                      of mode L are converted to L first
+        :param palette: If True return a palette image instead that
+                        shares pixel values with `image` and whose
+                        palette has a transparency entry for each color.
+                        This uses a quarter of the memory of a RGBA image
+                        and is faster to encode
+        :raises InvalidImageError: if `image` is None
         :returns: Image object colorized of same size as input but of
-                  type RGBA
+                  type RGBA or P if `palette` is True
         """
         if image is None:
             raise InvalidImageError('Image is None')
 
-        red = Image.eval(image, lambda px: int(px*self._color[0]))
-        green = Image.eval(image, lambda px: int(px*self._color[1]))
-        blue = Image.eval(image, lambda px: int(px*self._color[2]))
-        alpha = Image.eval(image, lambda px: 0 if px == 0 else self._opacity)
+        lut = self._get_rgba_lut()
+        if image.mode != 'L':
+            image = image.convert(mode='L')
+
+        if palette is True:
+            resimage = image.copy()
+            resimage.putpalette(lut.tobytes(), rawmode='RGBA')
+            return resimage
+
+        # view each RGBA entry as one 32-bit value so a single take
+        # writes all 4 bands of a pixel at once
+        data = np.take(lut.view(np.uint32).ravel(), np.asarray(image))
+        return Image.fromarray(data.view(np.uint8).reshape(data.shape +
+                                                           (4,)), 'RGBA')
+
+
+class ProbabilityMapOverlayGenerator(object):
+    """Thresholds and colorizes a probability map and composites it
+       on top of a base image. Since color and opacity are constant the
+       result of compositing each base pixel is looked up in tables
+       computed once with `Image.alpha_composite` which lets the overlay
+       be blended directly into the base image where the thresholded
+       probability map is set. Grayscale base images are converted to
+       RGBA and blended in a single lookup per pixel
+    """
+    ROWS_PER_BAND = 1024
+
+    def __init__(self, threshold_percent=30, color=(0, 0, 1), opacity=70):
+        """
+        Constructor
+        :param threshold_percent: int value ranging between 0 and 100
+                                  passed to `ImageThresholder`
+        :param color: (R, G, B) tuple passed to `ColorizeGrayscaleImage`
+        :param opacity: 0 is transparent and 255 is opaque
+        """
+        self._thresholder = ImageThresholder(threshold_percent)
+        self._colorizer = ColorizeGrayscaleImage(color=color,
+                                                 opacity=opacity)
+        self._blend_luts = None
+        self._grayscale_lut = None
+
+    def _get_blend_luts(self):
+        """Gets lookup tables of the result of compositing the colorized
+           pixel on top of every base pixel, building them on first call.
+           Each table is flattened so entry (alpha << 8) | value is the
+           result for a base pixel with that alpha and band value
+        :returns: list of 4 NumPy uint8 arrays of length 65536 for the
+                  red, green, blue and alpha bands
+        """
+        if self._blend_luts is not None:
+            return self._blend_luts
+
+        # base has alpha varying by row and band value varying by column
+        base = np.empty((256, 256, 4), dtype=np.uint8)
+        base[:, :, :3] = np.arange(256, dtype=np.uint8)[np.newaxis, :,
+                                                        np.newaxis]
+        base[:, :, 3] = np.arange(256, dtype=np.uint8)[:, np.newaxis]
+        color = self._colorizer.colorize_image(Image.new('L', (256, 256),
+                                                         color=255))
+        res = np.asarray(Image.alpha_composite(Image.fromarray(base, 'RGBA'),
+                                               color))
+        self._blend_luts = [np.ascontiguousarray(res[:, :, band]).ravel()
+                            for band in range(4)]
+        return self._blend_luts
+
+    def _get_grayscale_lut(self):
+        """Gets lookup table of RGBA pixels for grayscale base images
+           viewed as 32-bit values, building it on first call. Entry
+           value is the base pixel converted to RGBA and entry
+           256 + value is the result of compositing the colorized pixel
+           on top of it
+        :returns: NumPy uint32 array of length 512
+        """
+        if self._grayscale_lut is not None:
+            return self._grayscale_lut
+
+        luts = self._get_blend_luts()
+        values = np.arange(256)
+        lut = np.empty((512, 4), dtype=np.uint8)
+        lut[:256, :3] = values[:, np.newaxis]
+        lut[:256, 3] = 255
+        for band in range(4):
+            lut[256:, band] = luts[band][(255 << 8) | values]
+        self._grayscale_lut = lut.view(np.uint32).ravel()
+        return self._grayscale_lut
 
-        resimage = Image.merge('RGBA', (red, green, blue, alpha))
+    def _create_overlay_from_grayscale(self, base_image, probmap):
+        """Creates RGBA overlay of `probmap` on grayscale `base_image` in
+           one lookup per pixel indexed by base value and whether
+           `probmap` is at or above the threshold cutoff. This is done
+           `ROWS_PER_BAND` rows at a time so the only full size
+           allocation is the result
+        :param base_image: Image object from PIL of mode L
+        :param probmap: Image object from PIL of mode L
+        :returns: NumPy uint8 array of shape (height, width, 4)
+        """
+        lut = self._get_grayscale_lut()
+        cutoff = self._thresholder.get_pixel_intensity_cutoff()
+        (width, height) = base_image.size
+        res = np.empty((height, width), dtype=np.uint32)
+        index = np.empty((min(height, self.ROWS_PER_BAND), width),
+                         dtype=np.uint16)
+        for offset in range(0, height, self.ROWS_PER_BAND):
+            box = (0, offset, width, min(height,
+                                         offset + self.ROWS_PER_BAND))
+            band_index = index[:box[3] - offset]
+            np.greater_equal(np.asarray(probmap.crop(box)), cutoff,
+                             out=band_index, casting='unsafe')
+            band_index <<= 8
+            band_index |= np.asarray(base_image.crop(box))
+            np.take(lut, band_index, out=res[offset:box[3]])
+        return res.view(np.uint8).reshape(res.shape + (4,))
+
+    def create_overlay_array(self, base, probmap):
+        """Blends overlay of `probmap` into `base` in place. Only base
+           pixels where `probmap` is at or above the threshold cutoff
+           are modified
+        :param base: NumPy uint8 array of shape (height, width, 4) holding
+                     RGBA base image
+        :param probmap: NumPy uint8 array of shape (height, width)
+        :returns: `base`
+        """
+        mask = probmap >= self._thresholder.get_pixel_intensity_cutoff()
+        if not mask.any():
+            return base
+
+        luts = self._get_blend_luts()
+        alpha = base[:, :, 3]
+        index = alpha[mask].astype(np.uint16) << 8
+        for band in range(3):
+            values = base[:, :, band]
+            values[mask] = np.take(luts[band], index | values[mask])
+        alpha[mask] = np.take(luts[3], index)
+        return base
+
+    def create_overlay(self, base_image, probmap):
+        """Creates overlay of `probmap` on `base_image`
+        :param base_image: Image object from PIL
+        :param probmap: Image object from PIL of mode L and same size
+                        as `base_image`
+        :raises InvalidImageError: if either image is None or images
+                                   differ in size
+        :returns: Image object of type RGBA
+        """
+        if base_image is None or probmap is None:
+            raise InvalidImageError('Image is None')
+
+        if base_image.size != probmap.size:
+            raise InvalidImageError('Base image size ' +
+                                    str(base_image.size) +
+                                    ' does not match probability map size ' +
+                                    str(probmap.size))
+        if probmap.mode != 'L':
+            probmap = probmap.convert(mode='L')
 
-        red.close()
-        green.close()
-        blue.close()
-        alpha.close()
-        return resimage
+        if base_image.mode == 'L':
+            base = self._create_overlay_from_grayscale(base_image, probmap)
+        else:
+            rgba = base_image.convert(mode='RGBA')
+            base = np.array(rgba)
+            rgba.close()
+            self.create_overlay_array(base, np.asarray(probmap))
+        return Image.fromarray(base, 'RGBA')
 
 
 class ImageTile(object):
-    """Represents a tile from a Pillow Image
+    """Represents a tile from a Pillow Image or from a NumPy array
+       holding a decoded image. When created from an array the tile
+       is a view of that array and no pixels are copied
     """
-    def __init__(self, image, box=None):
+    __slots__ = ('_image', '_box', '_valid_box', '_data')
+
+    def __init__(self, image, box=None, valid_box=None, data=None):
         """Constructor
-        :param image: Pillow Image representing tile
+        :param image: Pillow Image representing tile, can be None if
+                      `data` is set
         :param box: tuple (left, upper, right, lower) representing location of
                     tile in parent Image
+        :param valid_box: tuple (left, upper, right, lower) representing
+                          location in parent Image of region of tile
+                          that excludes the overlap. If None `box` is used
+        :param data: NumPy array view of tile or None
         """
         self._image = image
         self._box = box
+        self._valid_box = valid_box
+        self._data = data
 
     def get_box(self):
         """Gets location of tile in parent image
@@ -158,10 +893,41 @@ class ImageTile(object):
         """
         return self._box
 
+    def get_valid_box(self):
+        """Gets location of tile in parent image without the overlap
+        :returns: None or tuple (left, upper, right, lower)
+        """
+        if self._valid_box is None:
+            return self._box
+        return self._valid_box
+
+    def get_valid_box_in_tile(self):
+        """Gets location of valid region relative to upper left corner
+           of tile which can be used to crop or slice the tile
+        :returns: None or tuple (left, upper, right, lower)
+        """
+        valid_box = self.get_valid_box()
+        if valid_box is None or self._box is None:
+            return valid_box
+        return (valid_box[0] - self._box[0], valid_box[1] - self._box[1],
+                valid_box[2] - self._box[0], valid_box[3] - self._box[1])
+
+    def get_array(self):
+        """Gets tile as NumPy array. If tile was created from an array
+           the view is returned otherwise the Pillow Image is converted
+        :returns: NumPy array
+        """
+        if self._data is None and self._image is not None:
+            return np.asarray(self._image)
+        return self._data
+
     def get_image(self):
-        """Gets Image tile
+        """Gets Image tile. If tile was created from an array a
+           Pillow Image is created from it on each call
         :returns: Pillow Image
         """
+        if self._image is None and self._data is not None:
+            return Image.fromarray(self._data)
         return self._image
 
 
@@ -197,11 +963,100 @@ class SingleColumnImageTileGenerator(object):
             yield ImageTile(image.copy(), box=(0, 0, width, height))
             return
 
+        for box in self.get_tile_boxes(width, height):
+            logger.debug('Returning tile = ' + str(box))
+            yield ImageTile(image.crop(box), box=box)
+
+    def get_tile_boxes(self, width, height):
+        """Gets generator of locations of tiles for an image of
+        size `width` by `height`. Each location spans the width of
+        the image and is tileheight rows tall except the last
+        which may be shorter
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :returns: Generator that returns (left, upper, right, lower) tuples
+        """
         for offset in range(0, height, self._tileheight):
             if offset + self._tileheight <= height:
                 cur_tile_height = offset + self._tileheight
             else:
                 cur_tile_height = height
-            box = (0, offset, width, cur_tile_height)
+            yield (0, offset, width, cur_tile_height)
+
+
+class GridImageTileGenerator(object):
+    """Generator that extracts a grid of overlapping `ImageTile`
+       objects from a Pillow Image or NumPy array. Tiles are laid out
+       by a `TileGrid` the same way as the tiles CHM processes, each
+       tile covers tilewidth minus twice overlapwidth pixels
+       horizontally, and likewise vertically, plus the overlap on each
+       side clipped to the image. The image is decoded once and every
+       tile is a view of that buffer
+    """
+    def __init__(self, tilewidth=512, tileheight=512, overlapwidth=0,
+                 overlapheight=0):
+        """Constructor
+        :param tilewidth: int denoting width of tile in pixels including
+                          overlap
+        :param tileheight: int denoting height of tile in pixels including
+                           overlap
+        :param overlapwidth: int denoting pixels of overlap on left and
+                             right side of tile
+        :param overlapheight: int denoting pixels of overlap on top and
+                              bottom of tile
+        :raises OverlapTooLargeForTileSizeError: if overlap leaves no
+                valid pixels in tile
+        """
+        self._tilewidth = tilewidth
+        self._tileheight = tileheight
+        self._overlapwidth = overlapwidth
+        self._overlapheight = overlapheight
+        self._grids = {}
+        # validates tile and overlap sizes
+        self._get_tile_grid(0, 0)
+
+    def _get_tile_grid(self, width, height):
+        """Gets cached `TileGrid` for image of size `width` by `height`
+        """
+        grid = self._grids.get((width, height))
+        if grid is None:
+            grid = TileGrid(width, height, self._tilewidth,
+                            self._tileheight,
+                            overlap_width=self._overlapwidth,
+                            overlap_height=self._overlapheight)
+            self._grids[(width, height)] = grid
+        return grid
+
+    def get_image_tiles(self, image):
+        """Gets generator of `ImageTile` objects covering `image` from
+           left to right and top to bottom. Each tile is a NumPy view
+           of a single array holding `image`, no pixels are copied
+        :param image: Pillow image or NumPy array to tile
+        :returns: Generator that returns `ImageTile` objects
+        :raises InvalidImageError: if `image` is None
+        """
+        if image is None:
+            raise InvalidImageError('Image is None')
+
+        data = np.asarray(image)
+        (height, width) = data.shape[:2]
+        for (box, valid_box) in self.get_tile_boxes(width, height):
             logger.debug('Returning tile = ' + str(box))
-            yield ImageTile(image.crop(box), box=box)
+            yield ImageTile(None, box=box, valid_box=valid_box,
+                            data=data[box[1]:box[3], box[0]:box[2]])
+
+    def get_tile_boxes(self, width, height):
+        """Gets generator of locations of tiles for an image of
+        size `width` by `height` from left to right and top to bottom
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :returns: Generator that returns tuples of (box, valid_box)
+                  where each is a (left, upper, right, lower) tuple,
+                  box includes the overlap and valid_box does not
+        """
+        grid = self._get_tile_grid(width, height)
+        (cols, rows) = grid.get_number_of_tiles_tuple()
+        for row in range(1, rows + 1):
+            for col in range(1, cols + 1):
+                yield (grid.get_padded_tile_box(col, row),
+                       grid.get_tile_box(col, row))
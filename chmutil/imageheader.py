@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import struct
+from PIL import Image
+
+from chmutil.imagestream import PNG_SIGNATURE
+
+logger = logging.getLogger(__name__)
+
+HEADER_BYTES = 512
+
+TIFF_WIDTH_TAG = 256
+
+TIFF_LENGTH_TAG = 257
+
+# struct format of TIFF field types that can hold width or length
+TIFF_TYPE_TO_FORMAT = {3: 'H', 4: 'I', 16: 'Q'}
+
+# JPEG start of frame markers, these exclude DHT (C4), JPG (C8)
+# and DAC (CC) which share the same range
+JPEG_SOF_MARKERS = frozenset([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                              0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+# JPEG markers that have no length field
+JPEG_STANDALONE_MARKERS = frozenset([0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4,
+                                     0xD5, 0xD6, 0xD7, 0xD8])
+
+
+class InvalidImageHeaderError(Exception):
+    """Raised when header of image cannot be parsed
+    """
+    pass
+
+
+def _read_png_size(header):
+    """Gets size of PNG from IHDR chunk which must follow the signature
+    :param header: first bytes of PNG file
+    :returns: tuple (width, height)
+    :raises InvalidImageHeaderError: if IHDR chunk is not found
+    """
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        raise InvalidImageHeaderError('IHDR chunk not found')
+    return struct.unpack('>II', header[16:24])
+
+
+def _read_bytes(f, offset, length, header):
+    """Gets `length` bytes at `offset` in file `f` using `header` if
+       it already holds them
+    :raises InvalidImageHeaderError: if file ends before `length` bytes
+    """
+    if offset + length <= len(header):
+        data = header[offset:offset + length]
+    else:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise InvalidImageHeaderError('Unexpected end of file')
+    return data
+
+
+def _read_tiff_size(f, header):
+    """Gets size of first image in TIFF or BigTIFF file from the
+       ImageWidth and ImageLength tags of the first IFD
+    :param f: file object of TIFF opened in binary mode
+    :param header: first bytes of TIFF file
+    :returns: tuple (width, height)
+    :raises InvalidImageHeaderError: if tags are not found
+    """
+    order = '<' if header[0:2] == b'II' else '>'
+    version = struct.unpack(order + 'H', header[2:4])[0]
+    if version == 42:
+        offset = struct.unpack(order + 'I', header[4:8])[0]
+        count_fmt, entry_fmt, entry_size = 'H', 'HHI', 12
+    else:
+        offset = struct.unpack(order + 'Q', header[8:16])[0]
+        count_fmt, entry_fmt, entry_size = 'Q', 'HHQ', 20
+    count_size = struct.calcsize(count_fmt)
+    num_entries = struct.unpack(order + count_fmt,
+                                _read_bytes(f, offset, count_size,
+                                            header))[0]
+    ifd = _read_bytes(f, offset + count_size, num_entries * entry_size,
+                      header)
+    value_offset = struct.calcsize(order + entry_fmt)
+    size = {}
+    for pos in range(0, len(ifd), entry_size):
+        (tag, field_type,
+         count) = struct.unpack(order + entry_fmt,
+                                ifd[pos:pos + value_offset])
+        if tag not in (TIFF_WIDTH_TAG, TIFF_LENGTH_TAG):
+            continue
+        fmt = TIFF_TYPE_TO_FORMAT.get(field_type)
+        if fmt is None:
+            raise InvalidImageHeaderError('Unsupported type ' +
+                                          str(field_type) + ' for tag ' +
+                                          str(tag))
+        data = ifd[pos + value_offset:pos + value_offset +
+                   struct.calcsize(fmt)]
+        size[tag] = struct.unpack(order + fmt, data)[0]
+        if len(size) == 2:
+            return size[TIFF_WIDTH_TAG], size[TIFF_LENGTH_TAG]
+    raise InvalidImageHeaderError('ImageWidth and ImageLength tags '
+                                  'not found')
+
+
+def _read_jpeg_size(f, header):
+    """Gets size of JPEG from its start of frame segment skipping over
+       any segments before it such as EXIF data
+    :param f: file object of JPEG opened in binary mode
+    :param header: first bytes of JPEG file
+    :returns: tuple (width, height)
+    :raises InvalidImageHeaderError: if start of frame is not found
+    """
+    offset = 2
+    while True:
+        data = _read_bytes(f, offset, 4, header)
+        if data[0:1] != b'\xff':
+            raise InvalidImageHeaderError('Invalid JPEG marker at ' +
+                                          str(offset))
+        marker = bytearray(data[1:2])[0]
+        if marker == 0xFF:
+            # fill byte before marker
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            data = _read_bytes(f, offset + 5, 4, header)
+            height, width = struct.unpack('>HH', data)
+            if height == 0:
+                raise InvalidImageHeaderError('JPEG height is defined by '
+                                              'DNL marker')
+            return width, height
+        if marker == 0xD9 or marker == 0xDA:
+            raise InvalidImageHeaderError('Start of frame not found')
+        offset += 2 + struct.unpack('>H', data[2:4])[0]
+
+
+def read_image_header(image_file):
+    """Gets size and format of PNG, TIFF, BigTIFF or JPEG image by
+       parsing the start of the file without creating a Pillow Image
+    :param image_file: path to image
+    :returns: tuple (width, height, format) where format is the same
+              string Pillow would set on Image.format, or None if
+              image is not one of the formats supported
+    :raises InvalidImageHeaderError: if header of a supported format
+            cannot be parsed
+    :raises IOError: if file cannot be read
+    """
+    with open(image_file, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+        try:
+            if header[0:8] == PNG_SIGNATURE:
+                width, height = _read_png_size(header)
+                return width, height, 'PNG'
+            if header[0:4] in (b'II*\x00', b'MM\x00*', b'II+\x00',
+                               b'MM\x00+'):
+                width, height = _read_tiff_size(f, header)
+                return width, height, 'TIFF'
+            if header[0:3] == b'\xff\xd8\xff':
+                width, height = _read_jpeg_size(f, header)
+                return width, height, 'JPEG'
+        except struct.error as e:
+            raise InvalidImageHeaderError('Unable to parse header: ' +
+                                          str(e))
+    return None
+
+
+def check_image_size(width, height):
+    """Checks image is not too large to open. Like Image.open, images
+       with more then twice Image.MAX_IMAGE_PIXELS pixels are rejected
+    :param width: width of image in pixels
+    :param height: height of image in pixels
+    :raises InvalidImageHeaderError: if image is too large
+    """
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    if max_pixels is not None and width * height > 2 * max_pixels:
+        raise InvalidImageHeaderError('Image size (' + str(width * height) +
+                                      ' pixels) exceeds limit of ' +
+                                      str(2 * max_pixels) + ' pixels')
+
+
+def get_image_size_and_format(image_file):
+    """Gets size and format of image using `read_image_header` falling
+       back to Pillow for other formats or if the header cannot be
+       parsed. Like Image.open, images with more then twice
+       Image.MAX_IMAGE_PIXELS pixels are rejected
+    :param image_file: path to image
+    :returns: tuple (width, height, format)
+    :raises Exception: if image cannot be opened by Pillow or is too large,
+                       see `check_image_size`
+    """
+    res = None
+    try:
+        res = read_image_header(image_file)
+    except InvalidImageHeaderError:
+        logger.debug('Unable to parse header of ' + image_file +
+                     ' using Pillow', exc_info=True)
+    if res is None:
+        im = Image.open(image_file)
+        try:
+            return im.size[0], im.size[1], im.format
+        finally:
+            im.close()
+
+    check_image_size(res[0], res[1])
+    return res
@@ -0,0 +1,977 @@
+# -*- coding: utf-8 -*-
+
+import os
+import io
+import struct
+import zlib
+import logging
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedImageFormatError(Exception):
+    """Raised when an image format or mode cannot be streamed
+    """
+    pass
+
+
+class InvalidRowCountError(Exception):
+    """Raised when more or fewer rows are written to an image
+       then it was created with
+    """
+    pass
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+PNG_COLOR_TYPE_TO_MODE = {0: 'L', 2: 'RGB', 4: 'LA', 6: 'RGBA'}
+
+MODE_TO_PNG_COLOR_TYPE = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+MODE_TO_SAMPLES_PER_PIXEL = {'L': 1, 'RGB': 3, 'LA': 2, 'RGBA': 4}
+
+TIFF_SUFFIXES = ('.tif', '.tiff')
+
+SAMPLES_PER_PIXEL_TO_MODE = {3: 'RGB', 4: 'RGBA'}
+
+TEMP_SUFFIX = '.tmp'
+
+
+def _zlib_supports_zdict():
+    """Denotes if zlib.compressobj accepts a preset dictionary which
+       needs Python 3.3 or later
+    """
+    try:
+        zlib.compressobj(6, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL,
+                         zlib.Z_DEFAULT_STRATEGY, b'\x00')
+    except TypeError:
+        return False
+    return True
+
+
+# If False, strips written by ParallelPNGRowWriter are not primed with
+# the end of the previous strip which makes images slightly larger
+ZLIB_SUPPORTS_ZDICT = _zlib_supports_zdict()
+
+
+def _get_png_chunk(chunk_type, data):
+    """Creates PNG chunk
+    :param chunk_type: 4 byte chunk type ie b'IDAT'
+    :param data: bytes of chunk data
+    :returns: bytes containing length, type, data and crc of chunk
+    """
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def _get_png_ihdr_chunk(width, height, color_type):
+    """Creates PNG IHDR chunk for 8-bit non interlaced image
+    """
+    return _get_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                               8, color_type, 0, 0, 0))
+
+
+class PillowRowReader(object):
+    """Reads rows of an image by loading the entire image with
+       Pillow. Used for formats `PNGRowReader` cannot stream
+    """
+    def __init__(self, image_file):
+        """Constructor
+        :param image_file: Path to image
+        """
+        self._image = Image.open(image_file)
+        self._row = 0
+
+    def get_size(self):
+        """Gets size of image
+        :returns: tuple (width, height)
+        """
+        return self._image.size
+
+    def get_mode(self):
+        """Gets Pillow mode of image
+        """
+        return self._image.mode
+
+    def read_rows(self, num_rows):
+        """Reads next `num_rows` rows of image
+        :param num_rows: number of rows to read, if fewer rows
+                         remain only those rows are returned
+        :returns: Pillow Image holding rows read or None if no rows
+                  remain
+        """
+        (width, height) = self._image.size
+        if self._row >= height:
+            return None
+        lower = min(self._row + num_rows, height)
+        band = self._image.crop((0, self._row, width, lower))
+        self._row = lower
+        return band
+
+    def close(self):
+        """Closes image
+        """
+        self._image.close()
+
+
+class PNGRowReader(object):
+    """Reads rows of a non interlaced 8-bit PNG image without
+       decoding the entire image. Compressed image data is inflated
+       incrementally and each set of rows requested is unfiltered by
+       Pillow so memory use depends on number of rows read and not
+       size of image
+    """
+    READ_SIZE = 65536
+
+    def __init__(self, image_file):
+        """Constructor
+        :param image_file: Path to PNG image
+        :raises UnsupportedImageFormatError: if image is not a PNG or
+                is not a non interlaced 8-bit grayscale, RGB or RGBA
+                image
+        """
+        self._file = open(image_file, 'rb')
+        try:
+            self._read_header(image_file)
+        except Exception:
+            self._file.close()
+            raise
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b''
+        self._prev_row = None
+        self._row = 0
+
+    def _read_header(self, image_file):
+        """Reads PNG header chunks up to first IDAT chunk
+        """
+        if self._file.read(8) != PNG_SIGNATURE:
+            raise UnsupportedImageFormatError(image_file +
+                                              ' is not a PNG image')
+        while True:
+            length, chunk_type = self._read_chunk_header()
+            if chunk_type is None:
+                raise UnsupportedImageFormatError(image_file + ' has no '
+                                                               'image data')
+            if chunk_type == b'IHDR':
+                (self._width, self._height, depth,
+                 color_type, comp, filt,
+                 interlace) = struct.unpack('>IIBBBBB', self._file.read(13))
+                self._file.read(4)
+                if (depth != 8 or interlace != 0 or
+                        color_type not in PNG_COLOR_TYPE_TO_MODE):
+                    raise UnsupportedImageFormatError(image_file +
+                                                      ' must be non '
+                                                      'interlaced 8-bit '
+                                                      'grayscale, RGB or '
+                                                      'RGBA image')
+                self._color_type = color_type
+                self._mode = PNG_COLOR_TYPE_TO_MODE[color_type]
+                self._stride = (self._width *
+                                MODE_TO_SAMPLES_PER_PIXEL[self._mode])
+                continue
+            if chunk_type == b'IDAT':
+                self._idat_remaining = length
+                return
+            self._file.seek(length + 4, os.SEEK_CUR)
+
+    def _read_chunk_header(self):
+        """Reads length and type of next chunk
+        :returns: tuple (length, type) or (None, None) if at end of file
+        """
+        data = self._file.read(8)
+        if len(data) < 8:
+            return None, None
+        length, chunk_type = struct.unpack('>I4s', data)
+        return length, chunk_type
+
+    def _read_compressed_data(self):
+        """Reads next block of compressed data from IDAT chunks
+        :returns: bytes or empty bytes if no data remains
+        """
+        while self._idat_remaining == 0:
+            self._file.read(4)
+            length, chunk_type = self._read_chunk_header()
+            if chunk_type != b'IDAT':
+                self._idat_remaining = None
+                return b''
+            self._idat_remaining = length
+        if self._idat_remaining is None:
+            return b''
+        data = self._file.read(min(self._idat_remaining,
+                                   PNGRowReader.READ_SIZE))
+        self._idat_remaining -= len(data)
+        return data
+
+    def _fill_buffer(self, num_bytes):
+        """Inflates compressed data until at least `num_bytes` of
+           uncompressed data is in buffer or data runs out
+        """
+        chunks = [self._buffer]
+        have = len(self._buffer)
+        while have < num_bytes:
+            data = self._decompressor.unconsumed_tail
+            if not data:
+                data = self._read_compressed_data()
+                if not data:
+                    break
+            out = self._decompressor.decompress(data, num_bytes - have)
+            chunks.append(out)
+            have += len(out)
+        self._buffer = b''.join(chunks)
+
+    def get_size(self):
+        """Gets size of image
+        :returns: tuple (width, height)
+        """
+        return self._width, self._height
+
+    def get_mode(self):
+        """Gets Pillow mode of image
+        """
+        return self._mode
+
+    def read_rows(self, num_rows):
+        """Reads next `num_rows` rows of image
+        :param num_rows: number of rows to read, if fewer rows
+                         remain only those rows are returned
+        :raises IOError: if image data is truncated
+        :returns: Pillow Image holding rows read or None if no rows
+                  remain
+        """
+        if self._row >= self._height:
+            return None
+        num_rows = min(num_rows, self._height - self._row)
+        num_bytes = num_rows * (self._stride + 1)
+        self._fill_buffer(num_bytes)
+        if len(self._buffer) < num_bytes:
+            raise IOError('PNG image data is truncated')
+
+        filtered = self._buffer[:num_bytes]
+        self._buffer = self._buffer[num_bytes:]
+
+        # The first row may be filtered against the last row of
+        # the previous read so that row is prepended unfiltered and
+        # the rows are handed to Pillow as a small PNG to unfilter
+        total_rows = num_rows
+        if self._prev_row is not None:
+            filtered = b'\x00' + self._prev_row + filtered
+            total_rows += 1
+        band = Image.open(io.BytesIO(PNG_SIGNATURE +
+                                     _get_png_ihdr_chunk(self._width,
+                                                         total_rows,
+                                                         self._color_type) +
+                                     _get_png_chunk(b'IDAT',
+                                                    zlib.compress(filtered,
+                                                                  0)) +
+                                     _get_png_chunk(b'IEND', b'')))
+        band.load()
+        if self._prev_row is not None:
+            band = band.crop((0, 1, self._width, total_rows))
+        self._prev_row = band.crop((0, num_rows - 1, self._width,
+                                    num_rows)).tobytes()
+        self._row += num_rows
+        return band
+
+    def close(self):
+        """Closes image
+        """
+        self._file.close()
+
+
+def get_image_row_reader(image_file):
+    """Gets reader that returns rows of image incrementally. PNG
+       images are streamed via `PNGRowReader` and all other images
+       are loaded fully via `PillowRowReader`
+    :param image_file: Path to image
+    :returns: `PNGRowReader` or `PillowRowReader`
+    """
+    try:
+        return PNGRowReader(image_file)
+    except UnsupportedImageFormatError as e:
+        logger.debug(str(e) + ', loading entire image')
+    return PillowRowReader(image_file)
+
+
+def get_temp_file(image_file):
+    """Gets path an image is written to before it is renamed to
+       `image_file` so a partially written image is never found at
+       `image_file`
+    :param image_file: Path to image
+    :returns: `image_file` with `TEMP_SUFFIX` appended
+    """
+    return image_file + TEMP_SUFFIX
+
+
+def _write_to_temp_file(image_file, write_func):
+    """Calls `write_func` with path from `get_temp_file` and renames
+       that file to `image_file` if `write_func` succeeds otherwise it
+       is deleted
+    """
+    temp_file = get_temp_file(image_file)
+    try:
+        write_func(temp_file)
+    except Exception:
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+        raise
+    os.rename(temp_file, image_file)
+
+
+def save_image(img, image_file, image_format=None, **params):
+    """Saves Pillow image to `image_file` via a temporary file so a
+       partially written image is never found at `image_file`
+    :param img: Pillow Image
+    :param image_file: Path to write image to
+    :param image_format: Pillow format name, if None format is picked
+                         from suffix of `image_file` like Image.save does
+    :param params: extra parameters passed to Image.save
+    :raises ValueError: if `image_format` is None and suffix of
+                        `image_file` is not known to Pillow
+    """
+    if image_format is None:
+        Image.init()
+        suffix = os.path.splitext(image_file)[1].lower()
+        if suffix not in Image.EXTENSION:
+            raise ValueError('unknown file extension: ' + suffix)
+        image_format = Image.EXTENSION[suffix]
+    _write_to_temp_file(image_file,
+                        lambda temp_file: img.save(temp_file, image_format,
+                                                   **params))
+
+
+class _TempFileRowWriter(object):
+    """Base of row writers which write the image to the path given by
+       `get_temp_file` and rename it to the destination only once the
+       image is complete
+    """
+    def _open_temp_file(self, image_file):
+        """Opens temporary file for `image_file` for writing
+        """
+        self._image_file = image_file
+        self._temp_file = get_temp_file(image_file)
+        self._file = open(self._temp_file, 'wb')
+
+    def _check_row_count(self):
+        """Checks every row of image was written
+        :raises InvalidRowCountError: if fewer rows were written then the
+                height of the image
+        """
+        if self._row != self._height:
+            raise InvalidRowCountError('Only ' + str(self._row) + ' of ' +
+                                       str(self._height) +
+                                       ' rows were written')
+
+    def _finish(self):
+        """Writes end of image to file. Implemented by subclasses
+        """
+        raise NotImplementedError('subclasses must implement _finish')
+
+    def close(self):
+        """Finishes writing image and renames it to the destination. If
+           this fails the partially written image is deleted
+        :raises InvalidRowCountError: if fewer rows were written then the
+                height of the image
+        """
+        try:
+            self._check_row_count()
+            self._finish()
+            self._file.close()
+        except Exception:
+            self.abort()
+            raise
+        os.rename(self._temp_file, self._image_file)
+
+    def abort(self):
+        """Stops writing image and deletes what was written so far
+           leaving the destination untouched. Can be called after
+           `close` fails
+        """
+        self._file.close()
+        if os.path.isfile(self._temp_file):
+            os.remove(self._temp_file)
+
+
+class PNGRowWriter(_TempFileRowWriter):
+    """Writes a PNG image incrementally a set of rows at a time
+    """
+    def __init__(self, image_file, width, height, mode='L',
+                 compress_level=6):
+        """Constructor
+        :param image_file: Path to write PNG image to
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :param mode: Pillow mode of image. Must be one of L, LA, RGB,
+                     or RGBA
+        :param compress_level: zlib compression level 0-9
+        :raises UnsupportedImageFormatError: if mode is not supported
+        """
+        if mode not in MODE_TO_PNG_COLOR_TYPE:
+            raise UnsupportedImageFormatError('Mode ' + str(mode) +
+                                              ' not supported')
+        self._width = width
+        self._height = height
+        self._mode = mode
+        self._stride = width * MODE_TO_SAMPLES_PER_PIXEL[mode]
+        self._row = 0
+        self._prev_row = np.zeros(self._stride, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._open_temp_file(image_file)
+        self._file.write(PNG_SIGNATURE +
+                         _get_png_ihdr_chunk(width, height,
+                                             MODE_TO_PNG_COLOR_TYPE[mode]))
+
+    def _write_idat(self, data):
+        """Writes IDAT chunk if `data` is not empty
+        """
+        if data:
+            self._file.write(_get_png_chunk(b'IDAT', data))
+
+    def _get_filtered_rows(self, rows):
+        """Applies PNG Up filter to rows
+        :param rows: 2D NumPy array of type uint8 with one row per
+                     image row
+        :returns: bytes of filtered rows each prefixed by filter type
+        """
+        filtered = np.empty((rows.shape[0], self._stride + 1),
+                            dtype=np.uint8)
+        filtered[:, 0] = 2
+        np.subtract(rows[0], self._prev_row, out=filtered[0, 1:])
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        self._prev_row = rows[-1].copy()
+        return filtered.tobytes()
+
+    def write_rows(self, rows):
+        """Writes rows to image
+        :param rows: NumPy array of type uint8 with shape (rows, width) or
+                     (rows, width, samples per pixel)
+        :raises InvalidRowCountError: if more rows are written then the
+                height of the image
+        """
+        num_rows = rows.shape[0]
+        if num_rows == 0:
+            return
+        if self._row + num_rows > self._height:
+            raise InvalidRowCountError('Writing ' + str(num_rows) +
+                                       ' rows would exceed image height of '
+                                       + str(self._height))
+        rows = np.ascontiguousarray(rows,
+                                    dtype=np.uint8).reshape(num_rows,
+                                                            self._stride)
+        self._write_idat(self._compressor.compress(
+            self._get_filtered_rows(rows)))
+        self._row += num_rows
+
+    def _finish(self):
+        """Writes remaining compressed data and IEND chunk
+        """
+        self._write_idat(self._compressor.flush())
+        self._file.write(_get_png_chunk(b'IEND', b''))
+
+
+class ParallelPNGRowWriter(PNGRowWriter):
+    """Writes a PNG image incrementally a set of rows at a time deflating
+       strips of filtered rows on a thread pool. Each strip is compressed
+       as raw deflate data, primed with the last 32K of the previous
+       strip, and ended with a full flush so the strips concatenate into
+       a single zlib stream readable by any PNG decoder. If zlib does not
+       support priming, see `ZLIB_SUPPORTS_ZDICT`, each strip is
+       compressed on its own
+    """
+    WINDOW_SIZE = 32768
+
+    def __init__(self, image_file, width, height, mode='L',
+                 compress_level=6, workers=2, strip_size=1048576):
+        """Constructor
+        :param image_file: Path to write PNG image to
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :param mode: Pillow mode of image. Must be one of L, LA, RGB,
+                     or RGBA
+        :param compress_level: zlib compression level 0-9
+        :param workers: number of threads used to compress strips. At
+                        most this many strips are waiting to be written
+        :param strip_size: number of bytes of filtered data in each strip
+        :raises UnsupportedImageFormatError: if mode is not supported
+        """
+        super(ParallelPNGRowWriter, self).__init__(
+            image_file, width, height, mode=mode,
+            compress_level=compress_level)
+        self._compress_level = compress_level
+        self._workers = max(1, workers)
+        self._strip_size = strip_size
+        self._buffer = b''
+        self._prev_strip = b''
+        self._adler = 1
+        self._pending = []
+        self._pool = None
+        if self._workers > 1:
+            self._pool = ThreadPool(self._workers)
+        self._file.write(_get_png_chunk(b'IDAT',
+                                        self._get_zlib_header()))
+
+    def _get_zlib_header(self):
+        """Gets two byte zlib header for deflate data with 32K window
+        """
+        if self._compress_level < 2:
+            level = 0
+        elif self._compress_level < 6:
+            level = 1
+        elif self._compress_level == 6:
+            level = 2
+        else:
+            level = 3
+        cmf = 0x78
+        flg = level << 6
+        flg += 31 - ((cmf * 256 + flg) % 31)
+        return struct.pack('>BB', cmf, flg)
+
+    def _compress_strip(self, item):
+        """Compresses strip as raw deflate data
+        :param item: tuple (bytes of strip, bytes of preceding data to
+                     prime compressor with, True if this is last strip)
+        :returns: bytes of compressed strip
+        """
+        (data, zdict, last) = item
+        if zdict:
+            compressor = zlib.compressobj(self._compress_level,
+                                          zlib.DEFLATED, -15,
+                                          zlib.DEF_MEM_LEVEL,
+                                          zlib.Z_DEFAULT_STRATEGY, zdict)
+        else:
+            compressor = zlib.compressobj(self._compress_level,
+                                          zlib.DEFLATED, -15)
+        if last is True:
+            return compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+        return (compressor.compress(data) +
+                compressor.flush(zlib.Z_FULL_FLUSH))
+
+    def _submit_strip(self, data, last=False):
+        """Queues strip for compression writing any completed strips
+           so no more then `workers` strips are pending
+        """
+        self._adler = zlib.adler32(data, self._adler)
+        zdict = b''
+        if ZLIB_SUPPORTS_ZDICT is True:
+            zdict = self._prev_strip[-ParallelPNGRowWriter.WINDOW_SIZE:]
+        item = (data, zdict, last)
+        self._prev_strip = data
+        if self._pool is None:
+            self._write_idat(self._compress_strip(item))
+            return
+        self._pending.append(self._pool.apply_async(self._compress_strip,
+                                                    (item,)))
+        while len(self._pending) > self._workers:
+            self._write_idat(self._pending.pop(0).get())
+
+    def write_rows(self, rows):
+        """Writes rows to image
+        :param rows: NumPy array of type uint8 with shape (rows, width) or
+                     (rows, width, samples per pixel)
+        :raises InvalidRowCountError: if more rows are written then the
+                height of the image
+        """
+        num_rows = rows.shape[0]
+        if num_rows == 0:
+            return
+        if self._row + num_rows > self._height:
+            raise InvalidRowCountError('Writing ' + str(num_rows) +
+                                       ' rows would exceed image height of '
+                                       + str(self._height))
+        rows = np.ascontiguousarray(rows,
+                                    dtype=np.uint8).reshape(num_rows,
+                                                            self._stride)
+        self._buffer += self._get_filtered_rows(rows)
+        self._row += num_rows
+        offset = 0
+        while len(self._buffer) - offset >= self._strip_size:
+            self._submit_strip(self._buffer[offset:offset +
+                                            self._strip_size])
+            offset += self._strip_size
+        self._buffer = self._buffer[offset:]
+
+    def _terminate_pool(self):
+        """Shuts down thread pool if it is running
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _finish(self):
+        """Compresses remaining rows and writes adler32 checksum and
+           IEND chunk
+        """
+        self._submit_strip(self._buffer, last=True)
+        self._buffer = b''
+        while len(self._pending) > 0:
+            self._write_idat(self._pending.pop(0).get())
+        self._write_idat(struct.pack('>I', self._adler & 0xffffffff))
+        self._file.write(_get_png_chunk(b'IEND', b''))
+        self._terminate_pool()
+
+    def abort(self):
+        """Stops writing image and deletes what was written so far
+           leaving the destination untouched. Can be called after
+           `close` fails
+        """
+        self._terminate_pool()
+        self._pending = []
+        super(ParallelPNGRowWriter, self).abort()
+
+
+class TIFFRowWriter(_TempFileRowWriter):
+    """Writes an uncompressed TIFF image incrementally a set of rows
+       at a time. The image data is stored as a single strip
+    """
+    MAX_FILE_SIZE = 4294967295
+
+    def __init__(self, image_file, width, height, mode='L'):
+        """Constructor
+        :param image_file: Path to write TIFF image to
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        :param mode: Pillow mode of image. Must be one of L, RGB,
+                     or RGBA
+        :raises UnsupportedImageFormatError: if mode is not supported or
+                image is too large for a TIFF file
+        """
+        if mode not in ('L', 'RGB', 'RGBA'):
+            raise UnsupportedImageFormatError('Mode ' + str(mode) +
+                                              ' not supported')
+        self._width = width
+        self._height = height
+        self._mode = mode
+        self._samples = MODE_TO_SAMPLES_PER_PIXEL[mode]
+        self._stride = width * self._samples
+        if self._stride * height + 1024 > TIFFRowWriter.MAX_FILE_SIZE:
+            raise UnsupportedImageFormatError('Image too large for TIFF')
+        self._row = 0
+        self._open_temp_file(image_file)
+        # byte order, version and placeholder for offset to first IFD
+        self._file.write(b'II' + struct.pack('<HI', 42, 0))
+
+    def write_rows(self, rows):
+        """Writes rows to image
+        :param rows: NumPy array of type uint8 with shape (rows, width) or
+                     (rows, width, samples per pixel)
+        :raises InvalidRowCountError: if more rows are written then the
+                height of the image
+        """
+        num_rows = rows.shape[0]
+        if self._row + num_rows > self._height:
+            raise InvalidRowCountError('Writing ' + str(num_rows) +
+                                       ' rows would exceed image height of '
+                                       + str(self._height))
+        self._file.write(np.ascontiguousarray(rows,
+                                              dtype=np.uint8).tobytes())
+        self._row += num_rows
+
+    def _get_ifd(self, ifd_offset):
+        """Creates image file directory describing image
+        :param ifd_offset: offset in file where IFD will be written
+        :returns: bytes of IFD followed by any values that do not fit
+                  in an IFD entry
+        """
+        short = 3
+        rational = 5
+        long_type = 4
+        if self._mode == 'L':
+            photometric = 1
+        else:
+            photometric = 2
+
+        entries = [(256, long_type, [self._width]),
+                   (257, long_type, [self._height]),
+                   (258, short, [8] * self._samples),
+                   (259, short, [1]),
+                   (262, short, [photometric]),
+                   (273, long_type, [8]),
+                   (277, short, [self._samples]),
+                   (278, long_type, [self._height]),
+                   (279, long_type, [self._stride * self._height]),
+                   (282, rational, [1, 1]),
+                   (283, rational, [1, 1]),
+                   (284, short, [1]),
+                   (296, short, [1])]
+        if self._mode == 'RGBA':
+            # unassociated alpha
+            entries.append((338, short, [2]))
+
+        extra_offset = ifd_offset + 2 + (12 * len(entries)) + 4
+        ifd = struct.pack('<H', len(entries))
+        extra = b''
+        for tag, tag_type, values in entries:
+            if tag_type == short:
+                data = struct.pack('<' + 'H' * len(values), *values)
+                count = len(values)
+            else:
+                data = struct.pack('<' + 'I' * len(values), *values)
+                if tag_type == rational:
+                    count = len(values) // 2
+                else:
+                    count = len(values)
+            if len(data) <= 4:
+                ifd += struct.pack('<HHI', tag, tag_type, count)
+                ifd += data + b'\x00' * (4 - len(data))
+            else:
+                ifd += struct.pack('<HHII', tag, tag_type, count,
+                                   extra_offset + len(extra))
+                extra += data
+        return ifd + struct.pack('<I', 0) + extra
+
+    def _finish(self):
+        """Writes image file directory and its offset in the header
+        """
+        ifd_offset = self._file.tell()
+        if ifd_offset % 2 == 1:
+            self._file.write(b'\x00')
+            ifd_offset += 1
+        self._file.write(self._get_ifd(ifd_offset))
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', ifd_offset))
+
+
+def get_image_row_writer(image_file, width, height, mode='L'):
+    """Gets writer that writes image incrementally a set of rows at a
+       time. The format is chosen from the suffix of `image_file`
+    :param image_file: Path to write image to, must end with .png, .tif,
+                       or .tiff
+    :param width: width of image in pixels
+    :param height: height of image in pixels
+    :param mode: Pillow mode of image
+    :raises UnsupportedImageFormatError: if suffix of `image_file` is not
+            supported
+    :returns: `PNGRowWriter` or `TIFFRowWriter`
+    """
+    lc_file = image_file.lower()
+    if lc_file.endswith('.png'):
+        return PNGRowWriter(image_file, width, height, mode=mode)
+    if lc_file.endswith(TIFF_SUFFIXES):
+        return TIFFRowWriter(image_file, width, height, mode=mode)
+    raise UnsupportedImageFormatError('Unable to write ' + image_file +
+                                      ' incrementally only .png and .tif '
+                                      'images are supported')
+
+
+def _get_mode_for_array(data):
+    """Gets Pillow mode matching shape of NumPy array
+    :raises UnsupportedImageFormatError: if shape of `data` is not supported
+    :returns: L, RGB or RGBA
+    """
+    if len(data.shape) == 2:
+        return 'L'
+    if len(data.shape) == 3 and data.shape[2] in SAMPLES_PER_PIXEL_TO_MODE:
+        return SAMPLES_PER_PIXEL_TO_MODE[data.shape[2]]
+    raise UnsupportedImageFormatError('Unable to write array of shape ' +
+                                      str(data.shape))
+
+
+def _write_array_rows(writer, data, rows_per_write):
+    """Writes `data` to `writer` `rows_per_write` rows at a time and
+       closes `writer`. If writing fails `writer` is aborted
+    """
+    try:
+        for offset in range(0, data.shape[0], rows_per_write):
+            writer.write_rows(data[offset:offset + rows_per_write])
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def write_array_to_image(data, image_file, rows_per_write=512):
+    """Writes NumPy array to image `rows_per_write` rows at a time so
+       `data` can be a `numpy.memmap` larger then available memory
+    :param data: NumPy array of type uint8 with shape (height, width) for
+                 grayscale image or (height, width, 3 or 4) for RGB or
+                 RGBA image
+    :param image_file: Path to write image to, must have suffix supported
+                       by `get_image_row_writer`
+    :param rows_per_write: number of rows to write at a time
+    :raises UnsupportedImageFormatError: if suffix of `image_file` or shape
+            of `data` is not supported
+    """
+    mode = _get_mode_for_array(data)
+    writer = get_image_row_writer(image_file, data.shape[1], data.shape[0],
+                                  mode=mode)
+    _write_array_rows(writer, data, rows_per_write)
+
+
+def _save_npy(data, npy_file):
+    """Writes NumPy array to `npy_file` in .npy format
+    """
+    f = open(npy_file, 'wb')
+    try:
+        np.save(f, data)
+    finally:
+        f.close()
+
+
+class OutputProfile(object):
+    """Selects format and compression used to write an image regardless
+       of the suffix of the path written to
+    """
+    DEFAULT = 'default'
+    PNG = 'png'
+    TIFF = 'tiff'
+    TIFF_LZW = 'tiff-lzw'
+    NPY = 'npy'
+    PROFILES = [DEFAULT, PNG, TIFF, TIFF_LZW, NPY]
+    PROFILE_SUFFIXES = {PNG: ('.png',),
+                        TIFF: TIFF_SUFFIXES,
+                        TIFF_LZW: TIFF_SUFFIXES,
+                        NPY: ('.npy',)}
+
+    def __init__(self, profile=DEFAULT, compress_level=6, workers=1):
+        """Constructor
+        :param profile: One of `PROFILES`.
+                        `DEFAULT` picks format from suffix of path with
+                        default compression of Pillow.
+                        `PNG` is PNG compressed with `compress_level`.
+                        `TIFF` is uncompressed TIFF.
+                        `TIFF_LZW` is LZW compressed TIFF.
+                        `NPY` is NumPy .npy file of the raw pixels
+        :param compress_level: zlib compression level 0-9 for `PNG` profile
+        :param workers: if greater then 1, PNG images written
+                        incrementally are compressed with
+                        `ParallelPNGRowWriter` using this many threads
+        :raises ValueError: if `profile` is not in `PROFILES`
+        """
+        if profile not in OutputProfile.PROFILES:
+            raise ValueError('Invalid output profile: ' + str(profile))
+        self._profile = profile
+        self._compress_level = compress_level
+        self._workers = workers
+
+    def get_profile(self):
+        """Gets name of profile
+        """
+        return self._profile
+
+    def get_compress_level(self):
+        """Gets zlib compression level used by `PNG` profile
+        """
+        return self._compress_level
+
+    def get_workers(self):
+        """Gets number of threads used to compress PNG images
+        """
+        return self._workers
+
+    def check_image_file(self, image_file):
+        """Checks suffix of `image_file` does not denote a format other
+           then the one written by this profile so, for example, a
+           NumPy .npy file is never written to a path ending in .png.
+           Paths without a known suffix can be written by any profile
+        :param image_file: Path image will be written to
+        :raises ValueError: if suffix of `image_file` denotes a format
+                            other then the one written by this profile
+        """
+        if self._profile == OutputProfile.DEFAULT:
+            return
+        lc_file = image_file.lower()
+        for suffixes in OutputProfile.PROFILE_SUFFIXES.values():
+            if lc_file.endswith(suffixes):
+                break
+        else:
+            return
+        if not lc_file.endswith(
+                OutputProfile.PROFILE_SUFFIXES[self._profile]):
+            raise ValueError('Output profile ' + self._profile +
+                             ' cannot write ' + image_file + ' since '
+                             'its suffix denotes a different format')
+
+    def _get_png_row_writer(self, image_file, width, height, mode,
+                            compress_level):
+        """Gets `ParallelPNGRowWriter` if more then one worker was
+           requested otherwise `PNGRowWriter`
+        """
+        if self._workers > 1:
+            return ParallelPNGRowWriter(image_file, width, height, mode=mode,
+                                        compress_level=compress_level,
+                                        workers=self._workers)
+        return PNGRowWriter(image_file, width, height, mode=mode,
+                            compress_level=compress_level)
+
+    def _is_parallel_png(self, image_file):
+        """Denotes if `image_file` will be written with
+           `ParallelPNGRowWriter`
+        """
+        if self._workers <= 1:
+            return False
+        if self._profile == OutputProfile.PNG:
+            return True
+        return (self._profile == OutputProfile.DEFAULT and
+                image_file.lower().endswith('.png'))
+
+    def get_row_writer(self, image_file, width, height, mode='L'):
+        """Gets writer that writes image with this profile incrementally
+           a set of rows at a time
+        :raises ValueError: if `image_file` fails `check_image_file`
+        :raises UnsupportedImageFormatError: if this profile, or for
+                `DEFAULT` profile the suffix of `image_file`, cannot be
+                written incrementally
+        :returns: `PNGRowWriter`, `ParallelPNGRowWriter` or
+                  `TIFFRowWriter`
+        """
+        self.check_image_file(image_file)
+        if self._profile == OutputProfile.PNG:
+            return self._get_png_row_writer(image_file, width, height,
+                                            mode, self._compress_level)
+        if self._profile == OutputProfile.DEFAULT:
+            if image_file.lower().endswith('.png'):
+                return self._get_png_row_writer(image_file, width, height,
+                                                mode, 6)
+            return get_image_row_writer(image_file, width, height, mode=mode)
+        if self._profile == OutputProfile.TIFF:
+            return TIFFRowWriter(image_file, width, height, mode=mode)
+        raise UnsupportedImageFormatError('Unable to write ' + image_file +
+                                          ' incrementally with output '
+                                          'profile ' + self._profile)
+
+    def write_array(self, data, image_file, rows_per_write=512):
+        """Writes NumPy array to `image_file`. Profiles that can be
+           written incrementally are written `rows_per_write` rows at a
+           time so `data` can be a `numpy.memmap` larger then available
+           memory
+        :param data: NumPy array of type uint8 with shape (height, width)
+                     for grayscale image or (height, width, 3 or 4) for
+                     RGB or RGBA image
+        :param image_file: Path to write image to. The image is written
+                           to a temporary file which is renamed to
+                           `image_file` once complete
+        :param rows_per_write: number of rows to write at a time
+        :raises ValueError: if `image_file` fails `check_image_file`
+        """
+        self.check_image_file(image_file)
+        if self._profile == OutputProfile.NPY:
+            _write_to_temp_file(image_file,
+                                lambda temp_file: _save_npy(data,
+                                                            temp_file))
+            return
+
+        if self._profile == OutputProfile.TIFF_LZW:
+            img = Image.fromarray(np.asarray(data))
+            save_image(img, image_file, 'TIFF', compression='tiff_lzw')
+            img.close()
+            return
+
+        if (self._profile == OutputProfile.DEFAULT and
+                not isinstance(data, np.memmap) and
+                not self._is_parallel_png(image_file)):
+            save_image(Image.fromarray(data), image_file)
+            return
+
+        mode = _get_mode_for_array(data)
+        try:
+            writer = self.get_row_writer(image_file, data.shape[1],
+                                         data.shape[0], mode=mode)
+        except UnsupportedImageFormatError as e:
+            logger.warning(str(e) + '. Loading entire image in memory '
+                                    'to save')
+            save_image(Image.fromarray(np.array(data)), image_file)
+            return
+        _write_array_rows(writer, data, rows_per_write)
@@ -33,6 +33,12 @@ def _parse_arguments(desc, args):
                                        'file')
 
     core.add_standard_parameters(parser)
+    parser.add_argument("--partial", action='store_true',
+                        help='Merge the tiles generated so far for merge '
+                             'task <taskid> in ' +
+                             CHMJobCreator.MERGE_CONFIG_FILE_NAME +
+                             ' into a partially merged image. This can '
+                             'be run while CHM tasks are still running')
 
     return parser.parse_args(args, namespace=parsed_arguments)
 
@@ -40,6 +46,11 @@ def _parse_arguments(desc, args):
 def _run_merge_job(theargs):
     """Runs all jobs for task
     """
+    if theargs.partial is True:
+        logger.debug('Running partial merge for merge task ' +
+                     theargs.taskid)
+        return _run_single_merge_job(theargs, theargs.taskid)
+
     cfac = CHMConfigFromConfigFactory(theargs.jobdir)
     chmconfig = cfac.get_chmconfig(skip_loading_config=True,
                                    skip_loading_mergeconfig=False)
@@ -70,6 +81,44 @@ def _run_jobs(chmconfig, theargs, taskid):
     return core.wait_for_children_to_exit(process_list)
 
 
+def _get_overlay_args(config, taskid, jobdir, out_file):
+    """Gets arguments for mergetiles.py to create overlay of merged
+       probability map on input image. Jobs created before overlay
+       settings were added to the merge config get no overlay
+    :param config: merge configparser config
+    :param taskid: merge task id
+    :param jobdir: CHM job directory
+    :param out_file: path to probability map merge task creates
+    :returns: string of arguments prefixed with a space or empty string
+              if no overlay should be created
+    """
+    if not config.has_option(taskid,
+                             CHMJobCreator.MERGE_OUTPUT_OVERLAY_IMAGE):
+        return ''
+    if not config.has_option(taskid, CHMJobCreator.MERGE_OVERLAY_THRESHPC):
+        logger.debug('No overlay settings in merge config, skipping '
+                     'overlay')
+        return ''
+
+    overlay_file = config.get(taskid,
+                              CHMJobCreator.MERGE_OUTPUT_OVERLAY_IMAGE)
+    if not overlay_file.startswith('/'):
+        overlay_file = os.path.join(jobdir, CHMJobCreator.RUN_DIR,
+                                    overlay_file)
+
+    base_image = os.path.join(config.get(taskid,
+                                         CHMJobCreator.CONFIG_IMAGES),
+                              os.path.basename(out_file))
+    return (' --overlay ' + overlay_file +
+            ' --overlaybaseimage ' + base_image +
+            ' --overlaythreshpc ' +
+            config.get(taskid, CHMJobCreator.MERGE_OVERLAY_THRESHPC) +
+            ' --overlaycolor ' +
+            config.get(taskid, CHMJobCreator.MERGE_OVERLAY_COLOR) +
+            ' --overlayopacity ' +
+            config.get(taskid, CHMJobCreator.MERGE_OVERLAY_OPACITY))
+
+
 def _run_single_merge_job(theargs, taskid):
     """runs CHM Job
     :param theargs: list of arguments obtained from _parse_arguments()
@@ -102,8 +151,18 @@ def _run_single_merge_job(theargs, taskid):
 
         logger.debug('Creating directory ' + out_dir)
         os.makedirs(out_dir, mode=0o775)
+        incremental_dir = os.path.join(theargs.jobdir, CHMJobCreator.RUN_DIR,
+                                       CHMJobCreator.TMP_DIR)
+        if theargs.partial is True:
+            mode_args = ' --partial'
+        else:
+            mode_args = _get_overlay_args(config, taskid, theargs.jobdir,
+                                          out_file)
         cmd = (thebin + ' ' +
-               input_dir + ' ' + out_file + ' --suffix png --log DEBUG')
+               input_dir + ' ' + out_file + ' --suffix png --jobdir ' +
+               theargs.jobdir + ' --scratchdir ' + out_dir +
+               ' --incrementaldir ' + incremental_dir + mode_args +
+               ' --log DEBUG')
         exitcode, out, err = core.run_external_command(cmd, out_dir)
 
         sys.stdout.write(out)
@@ -132,12 +191,23 @@ def main(arglist):
               Runs Merge tiles for <taskid> specified on command
               line.
 
+              If {partial} is set, <taskid> is a merge task in
+              {mergeconfig} and the tiles generated so far for that
+              task are merged into a partially merged image under
+              <jobdir>/{rundir}/{tmp}. This can be run while CHM tasks
+              are still running so the final merge only has to merge
+              the remaining tiles.
+
 
               Example Usage:
 
               mergetilerunner.py 1 /foo/chmjob --scratchdir /scratch
 
-              """.format(version=chmutil.__version__)
+              """.format(version=chmutil.__version__,
+                         partial='--partial',
+                         mergeconfig=CHMJobCreator.MERGE_CONFIG_FILE_NAME,
+                         rundir=CHMJobCreator.RUN_DIR,
+                         tmp=CHMJobCreator.TMP_DIR)
 
     theargs = _parse_arguments(desc, arglist[1:])
     theargs.program = arglist[0]
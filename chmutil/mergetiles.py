@@ -4,17 +4,41 @@ import sys
 import os
 import argparse
 import logging
+import uuid
+import errno
+import socket
+import time
 import chmutil
+import numpy as np
 from PIL import Image
 from chmutil.core import Parameters
+from chmutil.core import CHMJobCreator
+from chmutil.core import CHMArgGenerator
+from chmutil.core import CHMTaskManifest
+from chmutil.core import CHMConfigFromConfigFactory
 from chmutil import core
 from chmutil.image import SimpleImageMerger
+from chmutil.image import ProbabilityMapOverlayGenerator
+from chmutil.image import InvalidImageError
+from chmutil.image import OVERLAY_COLORS
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import get_image_row_reader
+from chmutil.imagestream import OutputProfile
 
 LOG_FORMAT = "%(asctime)-15s %(levelname)s (%(process)d) %(name)s %(message)s"
 
 # create logger
 logger = logging.getLogger('chmutil.mergetiles')
 
+INCREMENTAL_CANVAS_SUFFIX = '.canvas.npy'
+INCREMENTAL_MERGED_SUFFIX = '.merged.list'
+INCREMENTAL_LOCK_SUFFIX = '.lock'
+
+# Seconds after which a lock file that does not contain a host name
+# and process id is considered left by a merge that died before
+# writing them
+INCREMENTAL_LOCK_UNREADABLE_AGE = 60
+
 
 def _parse_arguments(desc, args):
     """Parses command line arguments using argparse.
@@ -34,6 +58,94 @@ def _parse_arguments(desc, args):
     parser.add_argument("--suffix", default='png',
                         help='Only attempt to merge image files with'
                              'this suffix. (Default png)')
+    parser.add_argument("--jobdir",
+                        help='CHM job directory containing ' +
+                             CHMJobCreator.CONFIG_FILE_NAME +
+                             ' file. If set, only the tiles each CHM task '
+                             'was asked to generate are copied from its '
+                             'output image instead of merging the '
+                             'full image')
+    parser.add_argument("--bandheight", type=int, default=0,
+                        help='If set to a value greater then 0, merge '
+                             'images this many rows at a time writing '
+                             'each set of rows to <output> as it is '
+                             'merged. This bounds memory use by the '
+                             'band height instead of the image size. '
+                             'Only supported for .png and .tif '
+                             'output. (default 0 which means merge '
+                             'entire image in memory)')
+    parser.add_argument("--workers", type=int, default=1,
+                        help='Number of threads to use to decode image '
+                             'tiles and to compress PNG output. At most '
+                             'this many decoded tiles are held in memory '
+                             'waiting to be merged. (default 1)')
+    parser.add_argument("--scratchdir",
+                        help='Directory to hold a memory mapped merge '
+                             'canvas when the merged image has more '
+                             'then --maxinmemorypixels pixels. If unset, '
+                             'the canvas is always held in memory')
+    parser.add_argument("--maxinmemorypixels", type=int,
+                        default=500000000,
+                        help='If --scratchdir is set and the merged image '
+                             'has more then this many pixels, tiles are '
+                             'merged into a file backed canvas under '
+                             '--scratchdir which is then written to '
+                             '<output> in strips. (default 500000000)')
+    parser.add_argument("--incrementaldir",
+                        help='Directory holding partially merged image and '
+                             'list of tiles already merged into it. If '
+                             'set with --partial, any new tiles are merged '
+                             'into the partially merged image. If set '
+                             'without --partial, only tiles not yet merged '
+                             'are merged, <output> is written and the '
+                             'partially merged image is removed')
+    parser.add_argument("--partial", action='store_true',
+                        help='Merge tiles found so far into partially '
+                             'merged image in --incrementaldir without '
+                             'writing <output>. Used to merge tiles while '
+                             'CHM tasks are still running')
+    parser.add_argument("--outputprofile", default=OutputProfile.DEFAULT,
+                        choices=OutputProfile.PROFILES,
+                        help='Format and compression used to write '
+                             '<output> and --overlay images. '
+                             '{default} picks format from suffix of '
+                             'path, {png} is PNG with --compresslevel '
+                             'compression, {tiff} is uncompressed TIFF, '
+                             '{tifflzw} is LZW compressed TIFF and {npy} '
+                             'is a NumPy .npy file. The path is used as '
+                             'given but it is an error if its suffix is '
+                             '.png, .tif, .tiff or .npy and does not '
+                             'match the profile. '
+                             '(default {default})'
+                             ''.format(default=OutputProfile.DEFAULT,
+                                       png=OutputProfile.PNG,
+                                       tiff=OutputProfile.TIFF,
+                                       tifflzw=OutputProfile.TIFF_LZW,
+                                       npy=OutputProfile.NPY))
+    parser.add_argument("--compresslevel", type=int, default=6,
+                        choices=range(0, 10), metavar='[0-9]',
+                        help='zlib compression level used by '
+                             '--outputprofile ' + OutputProfile.PNG +
+                             '. 0 is no compression, 1 is fastest and 9 '
+                             'is smallest (default 6)')
+    parser.add_argument("--overlay",
+                        help='If set, write an overlay of the merged '
+                             'image on --overlaybaseimage to this path '
+                             'using the merged image already in memory')
+    parser.add_argument("--overlaybaseimage",
+                        help='Base image to overlay merged image on. '
+                             'Required if --overlay is set')
+    parser.add_argument("--overlaythreshpc", type=int, default=30,
+                        help='Percent cut off for thresholding merged '
+                             'image for overlay with valid range 0-100 '
+                             '(default 30)')
+    parser.add_argument("--overlaycolor",
+                        choices=sorted(OVERLAY_COLORS.keys()),
+                        default='blue',
+                        help='Color to use for overlay (default blue)')
+    parser.add_argument("--overlayopacity", type=int, default=70,
+                        help='Sets level of opacity of overlay. 0 is '
+                             'transparent and 255 is opaque. (default 70)')
     parser.add_argument("--log", dest="loglevel", choices=['DEBUG',
                         'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="Set the logging level (default WARNING)",
@@ -44,21 +156,466 @@ def _parse_arguments(desc, args):
     return parser.parse_args(args, namespace=parsed_arguments)
 
 
-def _merge_image_tiles(img_dir, dest_file, suffix):
+def _get_tile_boxes(jobdir, img_dir, im_list):
+    """Using CHM task configuration in `jobdir` find the tiles
+       each image in `im_list` holds
+    :param jobdir: CHM job directory
+    :param img_dir: Directory containing CHM task output images
+    :param im_list: list of paths to images in `img_dir`
+    :returns: dict where key is path to image and value is list
+              of (left, upper, right, lower) tuples denoting valid regions
+              of image. If no images are in `im_list` an empty dict
+              is returned
+    """
+    if len(im_list) == 0:
+        return {}
+
+    cfac = CHMConfigFromConfigFactory(jobdir)
+    chmconfig = cfac.get_chmconfig()
+    config = chmconfig.get_config()
+    arg_gen = CHMArgGenerator(chmconfig)
+    run_dir = os.path.join(jobdir, CHMJobCreator.RUN_DIR)
+
+    img = Image.open(im_list[0])
+    (width, height) = img.size
+    img.close()
+
+    im_set = set(im_list)
+    tile_boxes = {}
+    if isinstance(config, CHMTaskManifest):
+        task_list = config.get_task_ids_for_image(os.path.basename(img_dir))
+    else:
+        task_list = config.sections()
+    for s in task_list:
+        out_file = config.get(s, CHMJobCreator.CONFIG_OUTPUT_IMAGE)
+        if not out_file.startswith('/'):
+            out_file = os.path.join(run_dir, out_file)
+        if os.path.normpath(os.path.dirname(out_file)) != img_dir:
+            continue
+        if out_file not in im_set:
+            logger.warning('Output of task ' + s + ' not found: ' +
+                           out_file)
+            continue
+        args = config.get(s, CHMJobCreator.CONFIG_ARGS)
+        tile_boxes[out_file] = arg_gen.get_tile_boxes_from_args(args, width,
+                                                                height)
+    logger.info('Found tiles for ' + str(len(tile_boxes)) + ' of ' +
+                str(len(im_list)) + ' images')
+    return tile_boxes
+
+
+def _get_canvas_file(im_list, scratchdir, max_in_memory_pixels):
+    """Decides if merge canvas should be memory mapped to a file
+    :param im_list: list of paths to images to merge
+    :param scratchdir: directory to put canvas file in, if None
+                       canvas is always held in memory
+    :param max_in_memory_pixels: largest number of pixels to hold in memory
+    :returns: path to canvas file under `scratchdir` or None if canvas
+              should be held in memory
+    """
+    if scratchdir is None or len(im_list) == 0:
+        return None
+    img = Image.open(im_list[0])
+    (width, height) = img.size
+    img.close()
+    if width * height <= max_in_memory_pixels:
+        return None
+    logger.info('Image has ' + str(width * height) + ' pixels which '
+                'exceeds ' + str(max_in_memory_pixels) +
+                ' using memory mapped canvas')
+    return os.path.join(scratchdir, 'canvas.' + uuid.uuid4().hex + '.raw')
+
+
+def _open_overlay_streams(overlay, width, height, output_profile):
+    """Opens base image of `overlay` for reading and overlay image
+       for writing a set of rows at a time
+    :param overlay: tuple (path to base image, path to write overlay to,
+                    `ProbabilityMapOverlayGenerator`)
+    :param width: width of probability map
+    :param height: height of probability map
+    :param output_profile: `OutputProfile` used to write overlay
+    :raises InvalidImageError: if base image size does not match `width`
+                               and `height`
+    :raises UnsupportedImageFormatError: if overlay image cannot be
+                                         written incrementally
+    :returns: tuple (base image row reader, overlay image row writer)
+    """
+    (base_image_file, overlay_file, generator) = overlay
+    reader = get_image_row_reader(base_image_file)
+    try:
+        if reader.get_size() != (width, height):
+            raise InvalidImageError('Base image ' + base_image_file +
+                                    ' size ' + str(reader.get_size()) +
+                                    ' does not match probability map '
+                                    'size ' + str((width, height)))
+        writer = output_profile.get_row_writer(overlay_file, width, height,
+                                               mode='RGBA')
+    except Exception:
+        reader.close()
+        raise
+    return reader, writer
+
+
+def _write_overlay_rows(generator, reader, writer, rows):
+    """Creates overlay for next set of rows of probability map
+    :param generator: `ProbabilityMapOverlayGenerator`
+    :param reader: base image row reader
+    :param writer: overlay image row writer
+    :param rows: 2D NumPy uint8 array of probability map rows
+    """
+    base = reader.read_rows(rows.shape[0])
+    probmap = Image.fromarray(np.ascontiguousarray(rows))
+    res = generator.create_overlay(base, probmap)
+    writer.write_rows(np.asarray(res))
+    res.close()
+    probmap.close()
+    base.close()
+
+
+def _write_overlay(merged, overlay, output_profile, rows_per_write=512):
+    """Writes overlay of `merged` probability map on base image
+       `rows_per_write` rows at a time. If overlay image cannot be written
+       incrementally the entire overlay is created in memory
+    :param merged: 2D NumPy uint8 array of probability map
+    :param overlay: tuple (path to base image, path to write overlay to,
+                    `ProbabilityMapOverlayGenerator`)
+    :param output_profile: `OutputProfile` used to write overlay
+    """
+    (base_image_file, overlay_file, generator) = overlay
+    logger.info('Writing overlay to ' + overlay_file)
+    (height, width) = merged.shape
+    try:
+        (reader, writer) = _open_overlay_streams(overlay, width, height,
+                                                 output_profile)
+    except UnsupportedImageFormatError as e:
+        logger.warning(str(e) + '. Creating entire overlay in memory')
+        base = Image.open(base_image_file)
+        probmap = Image.fromarray(np.asarray(merged))
+        res = generator.create_overlay(base, probmap)
+        output_profile.write_array(np.asarray(res), overlay_file)
+        res.close()
+        probmap.close()
+        base.close()
+        return
+
+    try:
+        for offset in range(0, height, rows_per_write):
+            _write_overlay_rows(generator, reader, writer,
+                                merged[offset:offset + rows_per_write])
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        reader.close()
+
+
+def _merge_image_tiles_in_bands(sim, im_list, dest_file, band_height,
+                                tile_boxes, overlay, output_profile):
+    """Merges image tiles a band at a time writing each band to
+       `dest_file` and, if `overlay` is set, the overlay of the band
+       to the overlay image
+    :raises UnsupportedImageFormatError: if `dest_file` or overlay image
+            cannot be written incrementally
+    :returns: 0 upon success or 1 if there were no images to merge
+    """
+    streams = None
+    band_callback = None
+    merged = False
+    if overlay is not None and len(im_list) > 0:
+        img = Image.open(im_list[0])
+        (width, height) = img.size
+        img.close()
+        streams = _open_overlay_streams(overlay, width, height,
+                                        output_profile)
+        band_callback = (lambda band_box, band:
+                         _write_overlay_rows(overlay[2], streams[0],
+                                             streams[1], band))
+    try:
+        if sim.merge_images_to_file(im_list, dest_file, band_height,
+                                    tile_boxes=tile_boxes,
+                                    band_callback=band_callback,
+                                    output_profile=output_profile) is False:
+            logger.error('No images were merged')
+            return 1
+        merged = True
+        logger.info('Wrote results to ' + dest_file)
+        return 0
+    finally:
+        if streams is not None:
+            streams[0].close()
+            if merged is True:
+                streams[1].close()
+            else:
+                logger.warning('Overlay ' + overlay[1] + ' was not written')
+                streams[1].abort()
+
+
+def _get_incremental_files(incremental_dir, dest_file):
+    """Gets paths of files holding incremental merge state for `dest_file`
+    :returns: tuple (path to partially merged canvas, path to list of
+              merged tiles, path to lock file)
+    """
+    prefix = os.path.join(incremental_dir, os.path.basename(dest_file))
+    return (prefix + INCREMENTAL_CANVAS_SUFFIX,
+            prefix + INCREMENTAL_MERGED_SUFFIX,
+            prefix + INCREMENTAL_LOCK_SUFFIX)
+
+
+def _get_lock_owner(lock_file):
+    """Reads host name and process id written to `lock_file` by
+       `_acquire_lock`
+    :returns: tuple (host name, process id) or None if `lock_file`
+              cannot be read or parsed
+    """
+    try:
+        f = open(lock_file, 'r')
+        try:
+            entry = f.read().split()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+    if len(entry) != 2 or not entry[1].isdigit():
+        return None
+    return entry[0], int(entry[1])
+
+
+def _is_process_running(pid):
+    """Denotes if process with id `pid` is running on this host
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+    return True
+
+
+def _is_lock_stale(lock_file):
+    """Denotes if `lock_file` was left by a merge that is no longer
+       running. This is the case if the lock was created on this host
+       by a process that has exited or if the lock has no host name
+       and process id and is older then
+       `INCREMENTAL_LOCK_UNREADABLE_AGE` seconds. Locks created on other
+       hosts are never considered stale
+    """
+    owner = _get_lock_owner(lock_file)
+    if owner is None:
+        try:
+            age = time.time() - os.path.getmtime(lock_file)
+        except OSError:
+            return False
+        return age > INCREMENTAL_LOCK_UNREADABLE_AGE
+    (host, pid) = owner
+    if host != socket.gethostname():
+        return False
+    return not _is_process_running(pid)
+
+
+def _acquire_lock(lock_file):
+    """Atomically creates `lock_file` holding the host name and process
+       id of this process. If `lock_file` exists but is stale, see
+       `_is_lock_stale`, it is removed and creation is tried once more
+    :returns: True if lock was acquired or False if `lock_file` is held
+              by another merge
+    """
+    for attempt in range(0, 2):
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            if attempt > 0 or not _is_lock_stale(lock_file):
+                return False
+            logger.warning('Removing stale lock ' + lock_file +
+                           ' left by merge that is no longer running')
+            try:
+                os.remove(lock_file)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            continue
+        os.write(fd, (socket.gethostname() + ' ' +
+                      str(os.getpid())).encode())
+        os.close(fd)
+        return True
+    return False
+
+
+def _get_merged_tiles(merged_file):
+    """Reads list of tiles already merged
+    :param merged_file: file with a line of <path>\t<modification time>
+                        for each merged tile
+    :returns: dict where key is path to tile and value is modification
+              time of tile as string when it was merged
+    """
+    merged_tiles = {}
+    if not os.path.isfile(merged_file):
+        return merged_tiles
+    f = open(merged_file, 'r')
+    for line in f:
+        entry = line.rstrip('\n').split('\t')
+        if len(entry) == 2:
+            merged_tiles[entry[0]] = entry[1]
+    f.close()
+    return merged_tiles
+
+
+def _open_incremental_canvas(canvas_file, merged_file, image_file):
+    """Opens partially merged canvas creating a new one if it does
+       not exist or does not match size of `image_file`
+    :returns: `numpy.memmap` of canvas
+    """
+    img = Image.open(image_file)
+    (width, height) = img.size
+    img.close()
+    if os.path.isfile(canvas_file):
+        canvas = np.lib.format.open_memmap(canvas_file, mode='r+')
+        if canvas.shape == (height, width) and canvas.dtype == np.uint8:
+            return canvas
+        logger.warning('Canvas ' + canvas_file + ' does not match size '
+                       'of tiles, starting over')
+        del canvas
+
+    if os.path.isfile(merged_file):
+        os.remove(merged_file)
+    logger.info('Creating canvas ' + canvas_file)
+    return np.lib.format.open_memmap(canvas_file, mode='w+',
+                                     dtype=np.uint8,
+                                     shape=(height, width))
+
+
+def _merge_image_tiles_incrementally(sim, im_list, dest_file, tile_boxes,
+                                     incremental_dir, partial, overlay,
+                                     output_profile):
+    """Merges tiles in `im_list` not already merged into partially
+       merged canvas in `incremental_dir`. If `partial` is False the
+       canvas is then written to `dest_file` and removed
+    :returns: 0 upon success, 1 if there are no tiles to merge or 3
+              if another merge of `dest_file` holds the lock
+    """
+    (canvas_file, merged_file,
+     lock_file) = _get_incremental_files(incremental_dir, dest_file)
+    if len(im_list) == 0:
+        if partial is True:
+            logger.info('No tiles to merge yet')
+            return 0
+        logger.error('No images were merged')
+        return 1
+
+    if _acquire_lock(lock_file) is False:
+        logger.error('Another merge holds lock ' + lock_file +
+                     ' if no merge is running on the host named in this '
+                     'file remove it')
+        return 3
+    try:
+        canvas = _open_incremental_canvas(canvas_file, merged_file,
+                                          im_list[0])
+        merged_tiles = _get_merged_tiles(merged_file)
+        new_tiles = []
+        for entry in im_list:
+            mtime = repr(os.path.getmtime(entry))
+            if merged_tiles.get(entry) != mtime:
+                new_tiles.append((entry, mtime))
+
+        logger.info(str(len(new_tiles)) + ' of ' + str(len(im_list)) +
+                    ' tiles need to be merged into ' + canvas_file)
+        if len(new_tiles) > 0:
+            sim.merge_images_into_array([e[0] for e in new_tiles],
+                                        tile_boxes=tile_boxes,
+                                        canvas=canvas)
+            canvas.flush()
+            f = open(merged_file, 'a')
+            for entry, mtime in new_tiles:
+                f.write(entry + '\t' + mtime + '\n')
+            f.close()
+
+        if partial is True:
+            return 0
+
+        logger.info('Writing results to ' + dest_file)
+        output_profile.write_array(canvas, dest_file)
+        if overlay is not None:
+            _write_overlay(canvas, overlay, output_profile)
+        del canvas
+        logger.debug('Removing ' + canvas_file + ' and ' + merged_file)
+        os.remove(canvas_file)
+        os.remove(merged_file)
+        return 0
+    finally:
+        os.remove(lock_file)
+
+
+def _merge_image_tiles(img_dir, dest_file, suffix, jobdir=None,
+                       band_height=0, workers=1, scratchdir=None,
+                       max_in_memory_pixels=500000000, overlay=None,
+                       incremental_dir=None, partial=False,
+                       output_profile=None):
     """Merges image tiles
+    :param overlay: If set, tuple (path to base image, path to write
+                    overlay to, `ProbabilityMapOverlayGenerator`) used to
+                    create overlay of merged image on base image
+    :param incremental_dir: If set, directory holding partially merged
+                            image. See `_merge_image_tiles_incrementally`
+    :param partial: If True, only merge tiles into partially merged
+                    image in `incremental_dir`
+    :param output_profile: `OutputProfile` used to write merged image and
+                           overlay. If None the default profile is used
     """
+    if output_profile is None:
+        output_profile = OutputProfile()
+
+    if partial is True:
+        if incremental_dir is None:
+            logger.error('--incrementaldir must be set with --partial')
+            return 1
+        if os.path.isfile(dest_file):
+            logger.info(dest_file + ' exists, skipping partial merge')
+            return 0
+
     logger.info('Merging images in ' + img_dir)
-    sim = SimpleImageMerger()
+    sim = SimpleImageMerger(workers=workers)
     im_list = core.get_image_path_list(img_dir, suffix)
-    merged = sim.merge_images(im_list)
+    tile_boxes = None
+    if jobdir is not None:
+        tile_boxes = _get_tile_boxes(jobdir, img_dir, im_list)
 
-    if merged is None:
-        logger.error('No images were merged')
-        return 1
+    if incremental_dir is not None:
+        canvas_file = _get_incremental_files(incremental_dir, dest_file)[0]
+        if partial is True or os.path.isfile(canvas_file):
+            return _merge_image_tiles_incrementally(sim, im_list, dest_file,
+                                                    tile_boxes,
+                                                    incremental_dir,
+                                                    partial, overlay,
+                                                    output_profile)
+
+    if band_height > 0:
+        try:
+            return _merge_image_tiles_in_bands(sim, im_list, dest_file,
+                                               band_height, tile_boxes,
+                                               overlay, output_profile)
+        except UnsupportedImageFormatError as e:
+            logger.warning(str(e) + '. Merging entire image in memory')
 
-    logger.info('Writing results to ' + dest_file)
-    merged.save(dest_file)
-    return 0
+    canvas_file = _get_canvas_file(im_list, scratchdir,
+                                   max_in_memory_pixels)
+    try:
+        merged = sim.merge_images_into_array(im_list, tile_boxes=tile_boxes,
+                                             canvas_file=canvas_file)
+        if merged is None:
+            logger.error('No images were merged')
+            return 1
+
+        logger.info('Writing results to ' + dest_file)
+        output_profile.write_array(merged, dest_file)
+        if overlay is not None:
+            _write_overlay(merged, overlay, output_profile)
+        return 0
+    finally:
+        if canvas_file is not None and os.path.isfile(canvas_file):
+            logger.debug('Removing canvas file ' + canvas_file)
+            os.remove(canvas_file)
 
 
 def main(arglist):
@@ -90,9 +647,54 @@ def main(arglist):
                      str(theargs.maxpixels))
         Image.MAX_IMAGE_PIXELS = theargs.maxpixels
 
+        jobdir = None
+        if theargs.jobdir is not None:
+            jobdir = os.path.abspath(theargs.jobdir)
+
+        scratchdir = None
+        if theargs.scratchdir is not None:
+            scratchdir = os.path.abspath(theargs.scratchdir)
+
+        incremental_dir = None
+        if theargs.incrementaldir is not None:
+            incremental_dir = os.path.abspath(theargs.incrementaldir)
+
+        overlay = None
+        if theargs.overlay is not None:
+            if theargs.overlaybaseimage is None:
+                logger.error('--overlaybaseimage must be set with '
+                             '--overlay')
+                return 1
+            generator = ProbabilityMapOverlayGenerator(
+                threshold_percent=theargs.overlaythreshpc,
+                color=OVERLAY_COLORS[theargs.overlaycolor],
+                opacity=theargs.overlayopacity)
+            overlay = (os.path.abspath(theargs.overlaybaseimage),
+                       os.path.abspath(theargs.overlay), generator)
+
+        output_profile = OutputProfile(theargs.outputprofile,
+                                       compress_level=theargs.compresslevel,
+                                       workers=theargs.workers)
+        try:
+            output_profile.check_image_file(theargs.output)
+            if overlay is not None:
+                output_profile.check_image_file(overlay[1])
+        except ValueError as e:
+            logger.error(str(e))
+            return 1
+
         return _merge_image_tiles(os.path.abspath(theargs.imagedir),
                                   os.path.abspath(theargs.output),
-                                  theargs.suffix)
+                                  theargs.suffix, jobdir=jobdir,
+                                  band_height=theargs.bandheight,
+                                  workers=theargs.workers,
+                                  scratchdir=scratchdir,
+                                  max_in_memory_pixels=theargs.
+                                  maxinmemorypixels,
+                                  overlay=overlay,
+                                  incremental_dir=incremental_dir,
+                                  partial=theargs.partial,
+                                  output_profile=output_profile)
     except Exception:
         logger.exception('Caught exception')
         return 2
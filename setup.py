@@ -12,12 +12,14 @@ with open('HISTORY.rst') as history_file:
 requirements = [
     "argparse",
     "configparser",
+    "numpy",
     "Pillow"
 ]
 
 test_requirements = [
     "argparse",
     "configparser",
+    "numpy",
     "Pillow",
     "mock"
 ]
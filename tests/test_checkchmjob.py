@@ -44,7 +44,10 @@ def create_successful_job(a_tmp_dir):
                                           [images, model,
                                            out,
                                            '--tilesize',
-                                           '520x520'])
+                                           '520x520',
+                                           '--imagestatscache',
+                                           os.path.join(a_tmp_dir,
+                                                        'stats.json')])
     pargs.program = 'foo'
     pargs.version = '0.1.2'
     pargs.rawargs = 'hi how are you'
@@ -129,6 +129,46 @@ class TestCHMArgGenerator(unittest.TestCase):
         self.assertEqual(tlist, [['-t 1,1'], ['-t 1,2'],
                                  ['-t 2,1'], ['-t 2,2']])
 
+    def test_get_tile_box_no_overlap(self):
+        opts = CHMConfig('/foo', 'model', 'outdir', '100x200', '0x0')
+        gen = CHMArgGenerator(opts)
+        self.assertEqual(gen.get_tile_box(1, 1, 250, 300), (0, 0, 100, 200))
+        self.assertEqual(gen.get_tile_box(2, 1, 250, 300),
+                         (100, 0, 200, 200))
+        self.assertEqual(gen.get_tile_box(3, 2, 250, 300),
+                         (200, 200, 250, 300))
+
+    def test_get_tile_box_with_overlap(self):
+        opts = CHMConfig('/foo', 'model', 'outdir', '100x200', '20x50')
+        gen = CHMArgGenerator(opts)
+        self.assertEqual(gen.get_tile_box(1, 1, 150, 250), (0, 0, 60, 100))
+        self.assertEqual(gen.get_tile_box(3, 3, 150, 250),
+                         (120, 200, 150, 250))
+
+    def test_get_tile_boxes_from_args(self):
+        opts = CHMConfig('/foo', 'model', 'outdir', '100x200', '0x0')
+        gen = CHMArgGenerator(opts)
+        self.assertEqual(gen.get_tile_boxes_from_args(None, 150, 250), [])
+        im_stats = ImageStats('f', 150, 250, 'PNG')
+        tlist = gen.get_args(im_stats)
+        boxes = []
+        for t in tlist:
+            boxes.extend(gen.get_tile_boxes_from_args(' '.join(t), 150, 250))
+        self.assertEqual(boxes, [(0, 0, 100, 200), (0, 200, 100, 250),
+                                 (100, 0, 150, 200), (100, 200, 150, 250)])
+
+    def test_get_tile_grid_is_cached(self):
+        opts = CHMConfig('/foo', 'model', 'outdir', '100x200', '10x20',
+                         number_tiles_per_task=3)
+        gen = CHMArgGenerator(opts)
+        grid = gen.get_tile_grid(500, 600)
+        self.assertTrue(gen.get_tile_grid(500, 600) is grid)
+        self.assertFalse(gen.get_tile_grid(600, 500) is grid)
+        self.assertEqual(grid.get_number_of_tiles_tuple(), (7, 4))
+        self.assertEqual(grid.get_number_of_tasks(), 10)
+        self.assertEqual(gen.get_args(ImageStats('f', 500, 600, 'PNG')),
+                         list(grid.get_args()))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -54,6 +54,9 @@ class TestCHMConfig(unittest.TestCase):
         self.assertEqual(opts.get_max_chm_memory_in_gb(), 10)
         self.assertEqual(opts.get_max_merge_memory_in_gb(), 10)
         self.assertEqual(opts.get_account(), '')
+        self.assertEqual(opts.get_overlay_threshpc(), 30)
+        self.assertEqual(opts.get_overlay_color(), 'blue')
+        self.assertEqual(opts.get_overlay_opacity(), 70)
 
         opts = CHMConfig('images', 'model', 'out', '500x600', '20x30',
                          number_tiles_per_task=122,
@@ -68,6 +71,9 @@ class TestCHMConfig(unittest.TestCase):
                          max_image_pixels=10,
                          max_chm_memory_in_gb=5,
                          max_merge_memory_in_gb=7,
+                         overlay_threshpc=40,
+                         overlay_color='red',
+                         overlay_opacity=100,
                          account='yo12')
         self.assertEqual(opts.get_images(), 'images')
         self.assertEqual(opts.get_model(), 'model')
@@ -109,6 +115,9 @@ class TestCHMConfig(unittest.TestCase):
                                       CHMJobCreator.MERGE_STDOUT_DIR))
         self.assertEqual(opts.get_max_chm_memory_in_gb(), 5)
         self.assertEqual(opts.get_max_merge_memory_in_gb(), 7)
+        self.assertEqual(opts.get_overlay_threshpc(), 40)
+        self.assertEqual(opts.get_overlay_color(), 'red')
+        self.assertEqual(opts.get_overlay_opacity(), 100)
 
         opts.set_config('bye')
         self.assertEqual(opts.get_config(), 'bye')
@@ -201,6 +201,19 @@ class TestCHMJobCreator(unittest.TestCase):
                                         CHMJobCreator.CONFIG_TASKS_PER_NODE),
                              '1')
 
+            mconfig = configparser.ConfigParser()
+            mconfig.read(os.path.join(temp_dir,
+                                      CHMJobCreator.MERGE_CONFIG_FILE_NAME))
+            self.assertEqual(mconfig.get('1', CHMJobCreator.
+                                         MERGE_OUTPUT_OVERLAY_IMAGE),
+                             os.path.join(CHMJobCreator.OVERLAYMAPS_DIR,
+                                          'foo1.png'))
+            self.assertEqual(mconfig.get('1', CHMJobCreator.
+                                         MERGE_OVERLAY_THRESHPC), '30')
+            self.assertEqual(mconfig.get('1', CHMJobCreator.
+                                         MERGE_OVERLAY_COLOR), 'blue')
+            self.assertEqual(mconfig.get('1', CHMJobCreator.
+                                         MERGE_OVERLAY_OPACITY), '70')
         finally:
             shutil.rmtree(temp_dir)
 
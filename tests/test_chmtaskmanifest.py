@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_chmtaskmanifest
+----------------------------------
+
+Tests for `CHMTaskManifest in core`
+"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import configparser
+from configparser import NoSectionError
+from configparser import NoOptionError
+
+from PIL import Image
+
+from chmutil import core
+from chmutil.core import CHMJobCreator
+from chmutil.core import CHMConfig
+from chmutil.core import CHMTaskManifest
+from chmutil.core import LoadConfigError
+
+
+def _create_job(job_dir, image_dir, task_manifest):
+    """Creates CHM job in `job_dir` for images in `image_dir`
+    """
+    os.makedirs(job_dir, mode=0o775)
+    opts = CHMConfig(image_dir, 'model', job_dir, '200x100', '20x10',
+                     number_tiles_per_task=4, task_manifest=task_manifest)
+    creator = CHMJobCreator(opts)
+    return creator.create_job()
+
+
+class TestCHMTaskManifest(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def _get_config(self, tiles_per_task='3'):
+        config = configparser.ConfigParser()
+        config.set('', CHMJobCreator.CONFIG_TILE_SIZE, '100x100')
+        config.set('', CHMJobCreator.CONFIG_OVERLAP_SIZE, '0x0')
+        config.set('', CHMJobCreator.CONFIG_TILES_PER_TASK, tiles_per_task)
+        config.set('', CHMJobCreator.CONFIG_MODEL, '/model')
+        config.set('', CHMJobCreator.CONFIG_DISABLE_HISTEQ_IMAGES, 'True')
+        config.set('', CHMJobCreator.CONFIG_TASKS_PER_NODE, '2')
+        return config
+
+    def test_empty_table(self):
+        manifest = CHMTaskManifest(self._get_config(), [])
+        self.assertEqual(manifest.get_number_of_tasks(), 0)
+        self.assertEqual(manifest.sections(), [])
+        self.assertFalse(manifest.has_section('1'))
+        self.assertEqual(manifest.get_task_ids_for_image('a.png'), [])
+
+    def test_get_task(self):
+        # a.png is 2x2 tiles or 2 tasks, b.png is 3x1 tiles or 1 task
+        table = [(1, 200, 200, 'a.png'), (3, 300, 100, 'b.png')]
+        manifest = CHMTaskManifest(self._get_config(), table)
+        self.assertEqual(manifest.get_image_table(), table)
+        self.assertEqual(manifest.get_number_of_tasks(), 3)
+        self.assertEqual(manifest.sections(), ['1', '2', '3'])
+        self.assertEqual(manifest.get_task(1),
+                         ('a.png', '-t 1,1 -t 1,2 -t 2,1',
+                          os.path.join('tiles', 'a.png', '001.a.png')))
+        self.assertEqual(manifest.get_task('2'),
+                         ('a.png', '-t 2,2',
+                          os.path.join('tiles', 'a.png', '002.a.png')))
+        self.assertEqual(manifest.get_task('3'),
+                         ('b.png', '-t 1,1 -t 2,1 -t 3,1',
+                          os.path.join('tiles', 'b.png', '001.b.png')))
+        self.assertEqual(manifest.get_task_ids_for_image('a.png'),
+                         ['1', '2'])
+        self.assertEqual(manifest.get_task_ids_for_image('b.png'), ['3'])
+
+        for bad in ['0', '4', '01', 'x', None]:
+            self.assertFalse(manifest.has_section(bad))
+            try:
+                manifest.get_task(bad)
+                self.fail('expected NoSectionError')
+            except NoSectionError:
+                pass
+            self.assertRaises(NoSectionError, manifest.get, bad,
+                              CHMJobCreator.CONFIG_MODEL)
+
+    def test_configparser_methods(self):
+        manifest = CHMTaskManifest(self._get_config(),
+                                   [(1, 200, 200, 'a.png')])
+        default = CHMJobCreator.CONFIG_DEFAULT
+        self.assertEqual(manifest.defaults()[CHMJobCreator.CONFIG_MODEL],
+                         '/model')
+        self.assertEqual(manifest.get(default, CHMJobCreator.CONFIG_MODEL),
+                         '/model')
+        self.assertEqual(manifest.get('2', CHMJobCreator.CONFIG_MODEL),
+                         '/model')
+        self.assertEqual(manifest.get('2', CHMJobCreator.CONFIG_INPUT_IMAGE),
+                         'a.png')
+        self.assertEqual(manifest.getint('1',
+                                         CHMJobCreator.CONFIG_TASKS_PER_NODE),
+                         2)
+        self.assertEqual(manifest.getboolean('1', CHMJobCreator.
+                                             CONFIG_DISABLE_HISTEQ_IMAGES),
+                         True)
+        self.assertRaises(ValueError, manifest.getboolean, '1',
+                          CHMJobCreator.CONFIG_MODEL)
+        self.assertRaises(NoOptionError, manifest.get, '1', 'foo')
+        self.assertTrue(manifest.has_option('1', CHMJobCreator.CONFIG_ARGS))
+        self.assertTrue(manifest.has_option('1', CHMJobCreator.CONFIG_MODEL))
+        self.assertTrue(manifest.has_option(default,
+                                            CHMJobCreator.CONFIG_MODEL))
+        self.assertFalse(manifest.has_option('1', 'foo'))
+        self.assertFalse(manifest.has_option('3', CHMJobCreator.CONFIG_ARGS))
+
+        manifest.set(default, CHMJobCreator.CONFIG_MODEL, '/other')
+        self.assertEqual(manifest.get('1', CHMJobCreator.CONFIG_MODEL),
+                         '/other')
+        self.assertRaises(NoSectionError, manifest.set, '1',
+                          CHMJobCreator.CONFIG_MODEL, '/x')
+
+    def test_manifest_job_matches_legacy_job(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(image_dir, mode=0o775)
+            for (name, size) in [('a.png', (400, 300)), ('b.png', (50, 20)),
+                                 ('c.png', (1000, 555)),
+                                 ('d.png', (400, 300))]:
+                Image.new('L', size).save(os.path.join(image_dir, name),
+                                          'PNG')
+            legacy_dir = os.path.join(temp_dir, 'legacy')
+            legacy_opts = _create_job(legacy_dir, image_dir, False)
+            job_dir = os.path.join(temp_dir, 'manifest')
+            opts = _create_job(job_dir, image_dir, True)
+            self.assertTrue(isinstance(opts.get_config(), CHMTaskManifest))
+            self.assertTrue(os.path.isfile(os.path.join(job_dir,
+                                                        CHMJobCreator.
+                                                        TASK_MANIFEST_FILE_NAME
+                                                        )))
+
+            legacy = core.load_chm_task_config(legacy_opts.get_job_config())
+            self.assertTrue(isinstance(legacy, configparser.ConfigParser))
+            manifest = core.load_chm_task_config(opts.get_job_config())
+            self.assertTrue(isinstance(manifest, CHMTaskManifest))
+
+            self.assertEqual(manifest.sections(), legacy.sections())
+            self.assertEqual(manifest.get_number_of_tasks(),
+                             len(legacy.sections()))
+            for s in legacy.sections():
+                for option in [CHMJobCreator.CONFIG_INPUT_IMAGE,
+                               CHMJobCreator.CONFIG_ARGS,
+                               CHMJobCreator.CONFIG_OUTPUT_IMAGE,
+                               CHMJobCreator.CONFIG_MODEL,
+                               CHMJobCreator.CONFIG_IMAGES,
+                               CHMJobCreator.CONFIG_TILE_SIZE]:
+                    self.assertEqual(manifest.get(s, option),
+                                     legacy.get(s, option))
+
+            # job loads through factory as well
+            cfac = core.CHMConfigFromConfigFactory(job_dir)
+            chmconfig = cfac.get_chmconfig()
+            self.assertEqual(chmconfig.get_config().sections(),
+                             legacy.sections())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_chm_task_config_errors(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cfile = os.path.join(temp_dir, CHMJobCreator.CONFIG_FILE_NAME)
+            try:
+                core.load_chm_task_config(cfile)
+                self.fail('expected LoadConfigError')
+            except LoadConfigError as e:
+                self.assertEqual(str(e), cfile + ' configuration file '
+                                                 'does not exist')
+
+            config = self._get_config()
+            config.set('', CHMJobCreator.CONFIG_TASK_MANIFEST, 'foo')
+            with open(cfile, 'w') as f:
+                config.write(f)
+            mfile = os.path.join(temp_dir, 'foo')
+            try:
+                core.load_chm_task_config(cfile)
+                self.fail('expected LoadConfigError')
+            except LoadConfigError as e:
+                self.assertEqual(str(e), mfile + ' task manifest does not '
+                                                 'exist')
+
+            with open(mfile, 'w') as f:
+                f.write(CHMTaskManifest.HEADER + '\n1\t100\t100\tx y.png\n')
+            manifest = core.load_chm_task_config(cfile)
+            self.assertEqual(manifest.get_image_table(),
+                             [(1, 100, 100, 'x y.png')])
+            self.assertEqual(manifest.sections(), ['1'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
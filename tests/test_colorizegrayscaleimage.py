@@ -9,7 +9,7 @@ Tests for `ColorizeGrayScaleImage in image`
 """
 
 import unittest
-
+import numpy as np
 
 from PIL import Image
 
@@ -49,6 +49,56 @@ class TestColorizeGrayscaleImage(unittest.TestCase):
         colorizer = ColorizeGrayscaleImage()
         res = colorizer.colorize_image(im)
         self.assertEqual(res.getpixel((1, 1)), (255, 0, 0, 150))
+        self.assertEqual(res.getpixel((2, 2)), (50, 0, 0, 150))
+        self.assertEqual(res.getpixel((0, 0)), (0, 0, 0, 0))
+
+    def test_colorize_image_matches_per_band(self):
+        im = Image.new('L', (16, 16))
+        im.putdata(list(range(256)))
+        for color in [(1, 0, 0), (0, 1, 1), (0.5, 0, 0.5), (2, 1, 0)]:
+            for opacity in [0, 70, 255]:
+                colorizer = ColorizeGrayscaleImage(color=color,
+                                                   opacity=opacity)
+                res = colorizer.colorize_image(im)
+                self.assertEqual(res.mode, 'RGBA')
+                self.assertEqual(res.size, (16, 16))
+                bands = []
+                for band in range(3):
+                    bands.append(Image.eval(im, lambda px:
+                                            min(255, int(px*color[band]))))
+                bands.append(Image.eval(im, lambda px: 0 if px == 0
+                                        else opacity))
+                expected = Image.merge('RGBA', bands)
+                self.assertEqual(res.tobytes(), expected.tobytes())
+                res.close()
+                expected.close()
+
+    def test_colorize_image_not_mode_l(self):
+        im = Image.new('RGB', (2, 1))
+        im.putpixel((1, 0), (255, 255, 255))
+        colorizer = ColorizeGrayscaleImage()
+        res = colorizer.colorize_image(im)
+        self.assertEqual(res.mode, 'RGBA')
+        self.assertEqual(res.getpixel((0, 0)), (0, 0, 0, 0))
+        self.assertEqual(res.getpixel((1, 0)), (255, 0, 0, 150))
+
+        res = colorizer.colorize_image(im, palette=True)
+        self.assertEqual(res.mode, 'P')
+        self.assertEqual(res.getpixel((1, 0)), 255)
+
+    def test_colorize_image_palette(self):
+        im = Image.new('L', (16, 16))
+        im.putdata(list(range(256)))
+        colorizer = ColorizeGrayscaleImage(color=(0, 0, 1), opacity=70)
+        res = colorizer.colorize_image(im, palette=True)
+        self.assertEqual(res.mode, 'P')
+        self.assertEqual(res.getpixel((3, 0)), 3)
+        self.assertEqual(im.mode, 'L')
+        expected = colorizer.colorize_image(im)
+        rgba = res.convert('RGBA')
+        self.assertEqual(rgba.tobytes(), expected.tobytes())
+        self.assertEqual(np.asarray(rgba)[0, 0].tolist(), [0, 0, 0, 0])
+        self.assertEqual(np.asarray(rgba)[0, 5].tolist(), [0, 0, 5, 70])
 
 
 if __name__ == '__main__':
@@ -160,6 +160,16 @@ class TestCoreFunctions(unittest.TestCase):
             self.assertEqual(len(res), 1)
             self.assertTrue(twofile in res)
 
+            # hidden files are skipped
+            hiddenfile = os.path.join(temp_dir, '.hidden.png')
+            open(hiddenfile, 'a').close()
+            res = core.get_image_path_list(temp_dir, '.png')
+            self.assertEqual(res, [twofile])
+            res = core.get_image_path_list(temp_dir, None)
+            self.assertEqual(len(res), 2)
+            self.assertTrue(threefile not in res)
+            self.assertTrue(hiddenfile not in res)
+
             # try a 1,000 files for fun
             for v in range(0, 999):
                 af = os.path.join(temp_dir, str(v) + '.png')
@@ -267,6 +277,42 @@ class TestCoreFunctions(unittest.TestCase):
         self.assertEqual(core.get_first_sequence_of_numbers_in_string(val),
                          23)
 
+    def test_parse_tile_args(self):
+        self.assertEqual(core.parse_tile_args(None), [])
+        self.assertEqual(core.parse_tile_args(''), [])
+        self.assertEqual(core.parse_tile_args('-t 1,2'), [(1, 2)])
+        self.assertEqual(core.parse_tile_args('-t 1,1 -t 1,2  -t 10,3'),
+                         [(1, 1), (1, 2), (10, 3)])
+        try:
+            core.parse_tile_args('-t 1')
+            self.fail('Expected ValueError')
+        except ValueError as e:
+            self.assertEqual(str(e), 'Unable to parse tile flag: -t 1')
+
+    def test_get_default_image_stats_cache_file(self):
+        orig = os.environ.get('XDG_CACHE_HOME')
+        try:
+            os.environ['XDG_CACHE_HOME'] = '/foo/cache'
+            res = core.get_default_image_stats_cache_file('/a/images')
+            self.assertEqual(os.path.dirname(res), '/foo/cache/chmutil')
+            self.assertTrue(os.path.basename(res).startswith('imagestats.'))
+            self.assertTrue(res.endswith('.json'))
+            self.assertNotEqual(res, core.
+                                get_default_image_stats_cache_file('/b'))
+            self.assertEqual(res, core.
+                             get_default_image_stats_cache_file('/a/images/'))
+
+            del os.environ['XDG_CACHE_HOME']
+            res = core.get_default_image_stats_cache_file('/a/images')
+            self.assertEqual(os.path.dirname(res),
+                             os.path.join(os.path.expanduser('~'),
+                                          '.cache', 'chmutil'))
+        finally:
+            if orig is None:
+                os.environ.pop('XDG_CACHE_HOME', None)
+            else:
+                os.environ['XDG_CACHE_HOME'] = orig
+
 
 if __name__ == '__main__':
     unittest.main()
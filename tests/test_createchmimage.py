@@ -10,9 +10,17 @@ Tests for `createchmimage.py`
 
 import unittest
 import os
+import sys
 import tempfile
 import shutil
+import numpy as np
 from PIL import Image
+from PIL import ImageOps
+from PIL import ImageFilter
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from chmutil import createchmimage
 from chmutil.createchmimage import NoInputImageFoundError
@@ -32,6 +40,10 @@ class TestCreateCHMImage(unittest.TestCase):
         self.assertEqual(pargs.output, 'out.png')
         self.assertEqual(pargs.downsample, 0)
         self.assertEqual(pargs.loglevel, 'WARNING')
+        self.assertEqual(pargs.workers, 1)
+        self.assertEqual(pargs.downsamplefirst, False)
+        self.assertEqual(pargs.equalizestack, False)
+        self.assertEqual(pargs.bandheight, 0)
 
     def test_main(self):
         temp_dir = tempfile.mkdtemp()
@@ -73,6 +85,404 @@ class TestCreateCHMImage(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_open_downsampled_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            data = np.zeros((101, 203, 3), dtype=np.uint8)
+            data[:, :, 0] = np.arange(203)[np.newaxis, :]
+            data[:, :, 1] = np.arange(101)[:, np.newaxis]
+            jpg_file = os.path.join(temp_dir, 'foo.jpg')
+            Image.fromarray(data).save(jpg_file, quality=95)
+            png_file = os.path.join(temp_dir, 'foo.png')
+            Image.fromarray(data).save(png_file)
+            pal_file = os.path.join(temp_dir, 'pal.png')
+            Image.fromarray(data).convert('P').save(pal_file)
+
+            for image_file in [jpg_file, png_file, pal_file]:
+                for ds in [2, 3, 4, 6, 8, 16]:
+                    img = Image.open(image_file)
+                    expected = ImageOps.grayscale(img).resize((203 // ds,
+                                                               101 // ds))
+                    img.close()
+                    res = createchmimage._open_downsampled_image(image_file,
+                                                                 ds)
+                    res = ImageOps.grayscale(res)
+                    self.assertEqual(res.size, expected.size)
+                    diff = np.abs(np.asarray(res).astype(int) -
+                                  np.asarray(expected).astype(int))
+                    self.assertTrue(diff.mean() < 4)
+
+            # image smaller then downsampling factor fails same as resize
+            try:
+                createchmimage._open_downsampled_image(jpg_file, 128)
+                self.fail('Expected ValueError')
+            except ValueError as e:
+                self.assertEqual(str(e), 'height and width must be > 0')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_reduce_image(self):
+        class NoReduceImage(object):
+            """Image of Pillow versions before 7 without reduce method
+            """
+            def __init__(self, img):
+                self._img = img
+
+            def crop(self, box):
+                return self._img.crop(box)
+
+        rstate = np.random.RandomState(8)
+        img = Image.fromarray(rstate.randint(0, 256, size=(31, 47))
+                              .astype(np.uint8))
+        for factor in [1, 2, 3, 5]:
+            target = (47 // factor, 31 // factor)
+            expected = createchmimage._reduce_image(img, factor, target)
+            res = createchmimage._reduce_image(NoReduceImage(img), factor,
+                                               target)
+            self.assertEqual(res.size, target)
+            diff = np.abs(np.asarray(res).astype(int) -
+                          np.asarray(expected).astype(int))
+            self.assertTrue(diff.max() <= 1)
+
+    def test_convert_image_downsample_first(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            input = os.path.join(temp_dir, 'input.jpg')
+            Image.new('RGB', (800, 600), color=(50, 100, 150)).save(input)
+            output = os.path.join(temp_dir, 'output')
+            pargs = createchmimage._parse_arguments('hi', [input, output,
+                                                           '--downsample',
+                                                           '8',
+                                                           '--equalize',
+                                                           '--gaussianblur',
+                                                           '--downsample'
+                                                           'first'])
+            res = createchmimage._convert_image(input, output, pargs)
+            self.assertEqual(res, 0)
+            img = Image.open(output + '.png')
+            self.assertEqual(img.mode, 'L')
+            self.assertEqual(img.size, (100, 75))
+            img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_equalize_lut(self):
+        self.assertEqual(createchmimage._get_equalize_lut([0] * 256),
+                         list(range(256)))
+        rstate = np.random.RandomState(5)
+        images = [Image.new('L', (10, 10), color=7),
+                  Image.fromarray(np.array([[0, 255]] * 5, dtype=np.uint8)),
+                  Image.fromarray(rstate.randint(0, 256, size=(30, 40))
+                                  .astype(np.uint8)),
+                  Image.fromarray(rstate.randint(20, 90, size=(30, 40))
+                                  .astype(np.uint8))]
+        for img in images:
+            lut = createchmimage._get_equalize_lut(img.histogram())
+            self.assertEqual(len(lut), 256)
+            self.assertEqual(img.point(lut).tobytes(),
+                             ImageOps.equalize(img).tobytes())
+
+    def test_get_autocontrast_lut(self):
+        rstate = np.random.RandomState(7)
+        images = [Image.new('L', (10, 10), color=7),
+                  Image.fromarray(np.array([[3, 200]] * 5, dtype=np.uint8)),
+                  Image.fromarray(rstate.randint(20, 90, size=(30, 40))
+                                  .astype(np.uint8))]
+        for img in images:
+            lut = createchmimage._get_autocontrast_lut(img.histogram())
+            self.assertEqual(img.point(lut).tobytes(),
+                             ImageOps.autocontrast(img).tobytes())
+
+    def test_get_blur_halo(self):
+        self.assertEqual(createchmimage._get_blur_halo(1), 3)
+        self.assertEqual(createchmimage._get_blur_halo(2), 6)
+        self.assertEqual(createchmimage._get_blur_halo(3), 9)
+        self.assertEqual(createchmimage._get_blur_halo(10), 30)
+
+        # banded blur with halo matches blur of whole image
+        rstate = np.random.RandomState(8)
+        data = rstate.randint(0, 256, size=(97, 23)).astype(np.uint8)
+        for radius in [1, 2, 5]:
+            blur = ImageFilter.GaussianBlur(radius)
+            expected = np.asarray(Image.fromarray(data).filter(blur))
+            halo = createchmimage._get_blur_halo(radius)
+            for band_height in [1, 10, 40]:
+                bands = []
+                for upper in range(0, 97, band_height):
+                    lower = min(97, upper + band_height)
+                    halo_upper = max(0, upper - halo)
+                    rows = data[halo_upper:min(97, lower + halo)]
+                    res = np.asarray(Image.fromarray(rows).filter(blur))
+                    bands.append(res[upper - halo_upper:lower - halo_upper])
+                self.assertEqual(np.concatenate(bands).tolist(),
+                                 expected.tolist())
+
+    def test_row_window(self):
+        data = np.arange(0, 20, dtype=np.uint8).reshape((10, 2))
+        window = createchmimage._RowWindow(iter([data[0:3], data[3:4],
+                                                 data[4:10]]))
+        self.assertEqual(window.get_rows(0, 2).tolist(), data[0:2].tolist())
+        self.assertEqual(window.get_rows(1, 5).tolist(), data[1:5].tolist())
+        self.assertEqual(window.get_rows(4, 4).tolist(), [])
+        self.assertEqual(window.get_rows(4, 10).tolist(),
+                         data[4:10].tolist())
+        self.assertEqual(window.get_rows(9, 10).tolist(),
+                         data[9:10].tolist())
+
+    def test_convert_image_in_bands(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(9)
+            coarse = rstate.randint(0, 200, size=(20, 12, 3))
+            data = np.repeat(np.repeat(coarse, 7, axis=0), 9, axis=1)
+            data = data[:131, :101] + rstate.randint(0, 40,
+                                                     size=(131, 101, 3))
+            input = os.path.join(temp_dir, 'input.png')
+            Image.fromarray(data.astype(np.uint8)).save(input)
+            expected_file = os.path.join(temp_dir, 'expected.png')
+            out_file = os.path.join(temp_dir, 'out.png')
+            for flags in [[], ['--equalize'], ['--autocontrast'],
+                          ['--equalize', '--autocontrast', '--gaussianblur'],
+                          ['--gaussianblur'],
+                          ['--gaussianblur', '--downsample', '1'],
+                          ['--gaussianblur', '--downsample', '3'],
+                          ['--equalize', '--downsample', '4']]:
+                pargs = createchmimage._parse_arguments('', [input,
+                                                             expected_file] +
+                                                        flags)
+                createchmimage._convert_image(input, expected_file, pargs)
+                expected = np.asarray(Image.open(expected_file))
+                for band_height in ['1', '16', '200']:
+                    pargs = createchmimage._parse_arguments(
+                        '', [input, out_file, '--bandheight',
+                             band_height] + flags)
+                    self.assertEqual(createchmimage._convert_image(input,
+                                                                   out_file,
+                                                                   pargs), 0)
+                    res = np.asarray(Image.open(out_file))
+                    self.assertEqual(res.shape, expected.shape)
+                    diff = np.abs(res.astype(int) - expected.astype(int))
+                    if '--downsample' in flags:
+                        self.assertTrue(diff.max() <= 1)
+                    else:
+                        self.assertEqual(diff.max(), 0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_convert_image_in_bands_truncated_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(2)
+            data = rstate.randint(0, 256, size=(100, 100)).astype(np.uint8)
+            input = os.path.join(temp_dir, 'input.png')
+            Image.fromarray(data).save(input)
+            with open(input, 'rb') as f:
+                png_data = f.read()
+            with open(input, 'wb') as f:
+                f.write(png_data[:len(png_data) // 2])
+            out_file = os.path.join(temp_dir, 'out.png')
+            pargs = createchmimage._parse_arguments('', [input, out_file,
+                                                         '--bandheight',
+                                                         '10'])
+            try:
+                createchmimage._convert_image(input, out_file, pargs)
+                self.fail('Expected IOError')
+            except IOError as e:
+                self.assertEqual(str(e), 'PNG image data is truncated')
+            self.assertEqual(os.listdir(temp_dir), ['input.png'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_convert_image_in_bands_no_image(self):
+        pargs = createchmimage._parse_arguments('', ['/foo', '/out',
+                                                     '--bandheight', '10'])
+        try:
+            createchmimage._convert_image('/foo', '/out', pargs)
+            self.fail('Expected NoInputImageFoundError')
+        except NoInputImageFoundError as e:
+            self.assertEqual(str(e), 'Image /foo not found')
+
+    def test_main_directory_mode_equalizestack(self):
+        temp_dir = tempfile.mkdtemp()
+        orig_stdout = sys.stdout
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(image_dir)
+            rstate = np.random.RandomState(6)
+            dark = rstate.randint(0, 100, size=(20, 30)).astype(np.uint8)
+            bright = rstate.randint(100, 256, size=(20, 30)).astype(np.uint8)
+            Image.fromarray(dark).save(os.path.join(image_dir, 'a.png'))
+            Image.fromarray(bright).save(os.path.join(image_dir, 'b.png'))
+
+            both = np.concatenate((dark, bright))
+            lut = createchmimage._get_equalize_lut(
+                Image.fromarray(both).histogram())
+            for workers in ['1', '2']:
+                out_dir = os.path.join(temp_dir, 'out' + workers)
+                sys.stdout = StringIO()
+                res = createchmimage.main(['createchmimage.py', image_dir,
+                                           out_dir, '--equalizestack',
+                                           '--workers', workers])
+                sys.stdout = orig_stdout
+                self.assertEqual(res, 0)
+                for name, data in [('a', dark), ('b', bright)]:
+                    out_img = Image.open(os.path.join(out_dir,
+                                                      name + '.png'))
+                    self.assertEqual(out_img.tobytes(),
+                                     Image.fromarray(data).point(lut)
+                                     .tobytes())
+                    out_img.close()
+
+            # dark image uses low half of range instead of all of it
+            out_img = Image.open(os.path.join(out_dir, 'a.png'))
+            self.assertTrue(np.asarray(out_img).max() < 160)
+            out_img.close()
+
+            # lookup table is unchanged so images are up to date
+            lut_file = os.path.join(out_dir,
+                                    createchmimage.STACK_EQUALIZE_LUT_FILE)
+            self.assertEqual(createchmimage._read_stack_equalize_lut(
+                lut_file), lut)
+            args = ['createchmimage.py', image_dir, out_dir,
+                    '--equalizestack']
+            sys.stdout = StringIO()
+            self.assertEqual(createchmimage.main(args), 0)
+            output = sys.stdout.getvalue()
+            sys.stdout = orig_stdout
+            self.assertTrue(output.startswith('Converted 0 images, skipped '
+                                              '2 up to date'))
+
+            # new image changes lookup table so every image is converted
+            Image.fromarray(bright).save(os.path.join(image_dir, 'c.png'))
+            sys.stdout = StringIO()
+            self.assertEqual(createchmimage.main(args), 0)
+            output = sys.stdout.getvalue()
+            sys.stdout = orig_stdout
+            self.assertTrue(output.startswith('Converted 3 images, skipped '
+                                              '0 up to date'))
+            lut = createchmimage._get_equalize_lut(
+                Image.fromarray(np.concatenate((both, bright))).histogram())
+            self.assertEqual(createchmimage._read_stack_equalize_lut(
+                lut_file), lut)
+            out_img = Image.open(os.path.join(out_dir, 'a.png'))
+            self.assertEqual(out_img.tobytes(),
+                             Image.fromarray(dark).point(lut).tobytes())
+            out_img.close()
+
+            # unreadable lookup table file converts every image
+            with open(lut_file, 'w') as f:
+                f.write('{')
+            sys.stdout = StringIO()
+            self.assertEqual(createchmimage.main(args), 0)
+            output = sys.stdout.getvalue()
+            sys.stdout = orig_stdout
+            self.assertTrue(output.startswith('Converted 3 images, skipped '
+                                              '0 up to date'))
+
+            # single image is same as --equalize
+            single = os.path.join(temp_dir, 'single.png')
+            createchmimage.main(['createchmimage.py',
+                                 os.path.join(image_dir, 'a.png'),
+                                 single, '--equalizestack'])
+            out_img = Image.open(single)
+            self.assertEqual(out_img.tobytes(),
+                             ImageOps.equalize(Image.fromarray(dark))
+                             .tobytes())
+            out_img.close()
+        finally:
+            sys.stdout = orig_stdout
+            shutil.rmtree(temp_dir)
+
+    def test_get_images_to_convert(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            dest_dir = os.path.join(temp_dir, 'out')
+            os.makedirs(os.path.join(image_dir, 'subdir'))
+            os.makedirs(dest_dir)
+            for name in ['c.tif', 'a.png', 'b.jpg', 'd.png.tmp']:
+                open(os.path.join(image_dir, name), 'a').close()
+            # left by interrupted conversion
+            open(os.path.join(dest_dir, 'c.png.tmp'), 'a').close()
+            res = createchmimage._get_images_to_convert(image_dir, dest_dir)
+            self.assertEqual(res, ([(os.path.join(image_dir, 'a.png'),
+                                     os.path.join(dest_dir, 'a.png')),
+                                    (os.path.join(image_dir, 'b.jpg'),
+                                     os.path.join(dest_dir, 'b.png')),
+                                    (os.path.join(image_dir, 'c.tif'),
+                                     os.path.join(dest_dir, 'c.png'))], 0))
+
+            # a.png up to date, b.png older then image
+            for name, mtime in [('a.png', 2000), ('b.png', 500)]:
+                open(os.path.join(dest_dir, name), 'a').close()
+                os.utime(os.path.join(dest_dir, name), (mtime, mtime))
+            for name in ['c.tif', 'a.png', 'b.jpg']:
+                os.utime(os.path.join(image_dir, name), (1000, 1000))
+            res = createchmimage._get_images_to_convert(image_dir, dest_dir)
+            self.assertEqual(res, ([(os.path.join(image_dir, 'b.jpg'),
+                                     os.path.join(dest_dir, 'b.png')),
+                                    (os.path.join(image_dir, 'c.tif'),
+                                     os.path.join(dest_dir, 'c.png'))], 1))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_directory_mode(self):
+        temp_dir = tempfile.mkdtemp()
+        orig_stdout = sys.stdout
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(image_dir)
+            for name in ['a', 'b', 'c']:
+                img = Image.new('RGB', (40, 20), color=(10, 20, 30))
+                img.putpixel((1, 1), (200, 100, 50))
+                img.save(os.path.join(image_dir, name + '.tif'))
+
+            for workers in ['1', '2']:
+                out_dir = os.path.join(temp_dir, 'out' + workers)
+                sys.stdout = StringIO()
+                res = createchmimage.main(['createchmimage.py', image_dir,
+                                           out_dir, '--downsample', '2',
+                                           '--equalize', '--workers',
+                                           workers])
+                output = sys.stdout.getvalue()
+                sys.stdout = orig_stdout
+                self.assertEqual(res, 0)
+                self.assertTrue(output.startswith('Converted 3 images, '
+                                                  'skipped 0 up to date '
+                                                  'and 0 failed in '))
+                self.assertTrue('images/sec' in output)
+
+                expected_file = os.path.join(temp_dir, 'expected.png')
+                createchmimage.main(['createchmimage.py',
+                                     os.path.join(image_dir, 'a.tif'),
+                                     expected_file, '--downsample', '2',
+                                     '--equalize'])
+                expected = Image.open(expected_file)
+                for name in ['a', 'b', 'c']:
+                    out_img = Image.open(os.path.join(out_dir,
+                                                      name + '.png'))
+                    self.assertEqual(out_img.mode, 'L')
+                    self.assertEqual(out_img.size, (20, 10))
+                    self.assertEqual(out_img.tobytes(), expected.tobytes())
+                    out_img.close()
+                expected.close()
+
+                # second run skips everything, failures are reported
+                open(os.path.join(image_dir, 'd.tif'), 'w').close()
+                sys.stdout = StringIO()
+                res = createchmimage.main(['createchmimage.py', image_dir,
+                                           out_dir, '--workers', workers])
+                output = sys.stdout.getvalue()
+                sys.stdout = orig_stdout
+                self.assertEqual(res, 1)
+                self.assertTrue(output.startswith('Converted 0 images, '
+                                                  'skipped 3 up to date '
+                                                  'and 1 failed in '))
+                os.remove(os.path.join(image_dir, 'd.tif'))
+        finally:
+            sys.stdout = orig_stdout
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,11 +10,31 @@ Tests for `createchmjob.py`
 
 import unittest
 import os
+import sys
 import tempfile
 import shutil
+import logging
+import json
 from PIL import Image
 
 from chmutil import createchmjob
+from chmutil import createchmimage
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps log records at warning level or above
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, level=logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
 
 
 class TestCreateCHMJob(unittest.TestCase):
@@ -43,6 +63,23 @@ class TestCreateCHMJob(unittest.TestCase):
         self.assertEqual(pargs.cluster, 'rocce')
         self.assertEqual(pargs.walltime, '12:00:00')
         self.assertEqual(pargs.jobname, 'chmjob')
+        self.assertEqual(pargs.overlaythreshpc, 30)
+        self.assertEqual(pargs.overlaycolor, 'blue')
+        self.assertEqual(pargs.overlayopacity, 70)
+        self.assertEqual(pargs.imagestatscache, None)
+        self.assertEqual(pargs.refreshimagestats, False)
+        self.assertEqual(pargs.legacytasklist, False)
+
+    def test_get_imagestats_cache(self):
+        pargs = createchmjob._parse_arguments('hi', ['/images', '2', '3'])
+        self.assertEqual(createchmjob._get_imagestats_cache(pargs),
+                         createchmjob.core.
+                         get_default_image_stats_cache_file('/images'))
+        pargs = createchmjob._parse_arguments('hi', ['/images', '2', '3',
+                                                     '--imagestatscache',
+                                                     '/foo/x.json'])
+        self.assertEqual(createchmjob._get_imagestats_cache(pargs),
+                         '/foo/x.json')
 
     def test_create_chm_job_where_not_able_to_create_job(self):
         temp_dir = tempfile.mkdtemp()
@@ -78,18 +115,77 @@ class TestCreateCHMJob(unittest.TestCase):
             open(p_mat, 'a').close()
 
             out = os.path.join(temp_dir, 'out')
+            cache = os.path.join(temp_dir, 'cache', 'stats.json')
 
             pargs = createchmjob._parse_arguments('hi',
                                                   [images, model,
                                                    out,
                                                    '--tilesize',
-                                                   '520x520'])
+                                                   '520x520',
+                                                   '--imagestatscache',
+                                                   cache])
+            pargs.program = 'foo'
+            pargs.version = '0.1.2'
+            pargs.rawargs = 'hi how are you'
+            val = createchmjob._create_chm_job(pargs)
+            self.assertEqual(val, 0)
+            self.assertTrue(os.path.isfile(cache))
+            self.assertTrue(os.path.isfile(os.path.join(out, 'base.chm.'
+                                                             'tasks.'
+                                                             'manifest')))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_create_chm_job_on_equalizestack_output(self):
+        temp_dir = tempfile.mkdtemp()
+        orig_stdout = sys.stdout
+        handler = RecordingHandler()
+        core_logger = logging.getLogger('chmutil.core')
+        try:
+            raw = os.path.join(temp_dir, 'raw')
+            os.makedirs(raw, mode=0o755)
+            for name, color in [('a', 20), ('b', 200)]:
+                myimg = Image.new('L', (600, 500), color)
+                myimg.save(os.path.join(raw, name + '.png'), 'PNG')
+
+            images = os.path.join(temp_dir, 'images')
+            sys.stdout = StringIO()
+            val = createchmimage.main(['createchmimage.py', raw, images,
+                                       '--equalizestack'])
+            sys.stdout = orig_stdout
+            self.assertEqual(val, 0)
+            self.assertTrue(os.path.isfile(
+                os.path.join(images,
+                             createchmimage.STACK_EQUALIZE_LUT_FILE)))
+
+            model = os.path.join(temp_dir, 'model')
+            os.makedirs(model, mode=0o755)
+            open(os.path.join(model, 'param.mat'), 'a').close()
+
+            out = os.path.join(temp_dir, 'out')
+            cache = os.path.join(temp_dir, 'cache', 'stats.json')
+            pargs = createchmjob._parse_arguments('hi',
+                                                  [images, model, out,
+                                                   '--tilesize',
+                                                   '520x520',
+                                                   '--imagestatscache',
+                                                   cache])
             pargs.program = 'foo'
             pargs.version = '0.1.2'
             pargs.rawargs = 'hi how are you'
+            core_logger.addHandler(handler)
             val = createchmjob._create_chm_job(pargs)
+            core_logger.removeHandler(handler)
             self.assertEqual(val, 0)
+            self.assertEqual(handler.records, [])
+            with open(cache, 'r') as f:
+                stats = json.load(f)
+            self.assertEqual(sorted(stats.keys()),
+                             [os.path.join(images, 'a.png'),
+                              os.path.join(images, 'b.png')])
         finally:
+            sys.stdout = orig_stdout
+            core_logger.removeHandler(handler)
             shutil.rmtree(temp_dir)
 
 
@@ -10,12 +10,19 @@ Tests for `createprobmapoverlay.py`
 
 import unittest
 import os
+import sys
 import tempfile
 import shutil
+import numpy as np
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 from PIL import Image
 
 from chmutil import createprobmapoverlay
 from chmutil.createprobmapoverlay import NoInputImageFoundError
+from chmutil.image import InvalidImageError
 
 
 class TestCreateProbmapOverlay(unittest.TestCase):
@@ -36,6 +43,10 @@ class TestCreateProbmapOverlay(unittest.TestCase):
         self.assertEqual(pargs.overlaycolor, 'blue')
         self.assertEqual(pargs.threshpc, 30)
         self.assertEqual(pargs.opacity, 70)
+        self.assertEqual(pargs.outputprofile, 'default')
+        self.assertEqual(pargs.compresslevel, 6)
+        self.assertEqual(pargs.workers, 1)
+        self.assertEqual(pargs.maxmemory, None)
 
     def test_get_pixel_coloring_tuple(self):
         res = createprobmapoverlay._get_pixel_coloring_tuple('red')
@@ -62,21 +73,11 @@ class TestCreateProbmapOverlay(unittest.TestCase):
         res = createprobmapoverlay._get_pixel_coloring_tuple('invalid')
         self.assertEqual(res, (0, 0, 1))
 
-    def test_get_thresholded_probmap(self):
-        temp_dir = tempfile.mkdtemp()
-        try:
-            im = Image.new('L', (10, 10))
-            im.putpixel((5, 5), 100)
-            probmap = os.path.join(temp_dir, 'probmap.png')
-            im.save(probmap, 'PNG')
-            im.close()
-            pmap = createprobmapoverlay._get_thresholded_probmap(probmap, 30)
-            self.assertEqual(pmap.getpixel((5, 5)), 255)
-            self.assertEqual(pmap.getpixel((5, 4)), 0)
-            pmap.close()
-
-        finally:
-            shutil.rmtree(temp_dir)
+    def test_get_band_height(self):
+        self.assertEqual(createprobmapoverlay._get_band_height(1024, 24), 1024)
+        self.assertEqual(createprobmapoverlay._get_band_height(2048, 24), 512)
+        self.assertEqual(createprobmapoverlay._get_band_height(10 ** 9, 1),
+                         1)
 
     def test_convert_image_no_image_file(self):
         temp_dir = tempfile.mkdtemp()
@@ -128,6 +129,260 @@ class TestCreateProbmapOverlay(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_main_with_output_profiles(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_file = os.path.join(temp_dir, 'image.png')
+            im = Image.new('L', (10, 10))
+            im.save(img_file, 'PNG')
+
+            prob_file = os.path.join(temp_dir, 'probmap.png')
+            im.putpixel((5, 5), 100)
+            im.save(prob_file, 'PNG')
+            im.close()
+            expected_file = os.path.join(temp_dir, 'expected.png')
+            self.assertEqual(createprobmapoverlay.main(['hi.py', img_file,
+                                                        prob_file,
+                                                        expected_file]), 0)
+            expected = Image.open(expected_file)
+            for profile in ['png', 'tiff', 'tiff-lzw']:
+                out_file = os.path.join(temp_dir, 'out')
+                res = createprobmapoverlay.main(['hi.py', img_file, prob_file,
+                                                 out_file, '--outputprofile',
+                                                 profile, '--compresslevel',
+                                                 '1'])
+                self.assertEqual(res, 0)
+                out_img = Image.open(out_file)
+                self.assertEqual(out_img.tobytes(), expected.tobytes())
+                out_img.close()
+                os.remove(out_file)
+
+            out_file = os.path.join(temp_dir, 'out.npy')
+            res = createprobmapoverlay.main(['hi.py', img_file, prob_file,
+                                             out_file, '--outputprofile',
+                                             'npy'])
+            self.assertEqual(res, 0)
+            self.assertEqual(np.load(out_file).tobytes(), expected.tobytes())
+
+            out_file = os.path.join(temp_dir, 'par')
+            res = createprobmapoverlay.main(['hi.py', img_file, prob_file,
+                                             out_file, '--workers', '2'])
+            self.assertEqual(res, 0)
+            out_img = Image.open(out_file + '.png')
+            self.assertEqual(out_img.tobytes(), expected.tobytes())
+            out_img.close()
+            expected.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_maxmemory(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(3)
+            prob_file = os.path.join(temp_dir, 'probmap.png')
+            Image.fromarray(rstate.randint(0, 256, size=(100, 60))
+                            .astype(np.uint8)).save(prob_file)
+            rgb = rstate.randint(0, 256, size=(100, 60, 3)).astype(np.uint8)
+            for mode in ['L', 'RGB']:
+                img_file = os.path.join(temp_dir, 'image.png')
+                if mode == 'L':
+                    Image.fromarray(rgb[:, :, 0].copy()).save(img_file)
+                else:
+                    Image.fromarray(rgb).save(img_file)
+
+                expected_file = os.path.join(temp_dir, 'expected.png')
+                self.assertEqual(createprobmapoverlay.main(['hi.py',
+                                                            img_file,
+                                                            prob_file,
+                                                            expected_file]),
+                                 0)
+                expected = Image.open(expected_file)
+
+                # band height is a single row
+                out_file = os.path.join(temp_dir, 'out')
+                res = createprobmapoverlay.main(['hi.py', img_file,
+                                                 prob_file, out_file,
+                                                 '--maxmemory', '0'])
+                self.assertEqual(res, 0)
+                out_img = Image.open(out_file + '.png')
+                self.assertEqual(out_img.tobytes(), expected.tobytes())
+                out_img.close()
+
+                for profile in ['png', 'tiff', 'npy']:
+                    res = createprobmapoverlay.main(['hi.py', img_file,
+                                                     prob_file, out_file,
+                                                     '--maxmemory', '1',
+                                                     '--outputprofile',
+                                                     profile])
+                    self.assertEqual(res, 0)
+                    if profile == 'npy':
+                        data = np.load(out_file)
+                    else:
+                        out_img = Image.open(out_file)
+                        data = np.asarray(out_img)
+                        out_img.close()
+                    self.assertEqual(data.tobytes(), expected.tobytes())
+                    os.remove(out_file)
+                expected.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_convert_image_in_bands_size_mismatch(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_file = os.path.join(temp_dir, 'image.png')
+            Image.new('L', (10, 10)).save(img_file)
+            prob_file = os.path.join(temp_dir, 'probmap.png')
+            Image.new('L', (10, 11)).save(prob_file)
+            try:
+                createprobmapoverlay.main(['hi.py', img_file, prob_file,
+                                           os.path.join(temp_dir, 'out'),
+                                           '--maxmemory', '1'])
+                self.fail('Expected InvalidImageError')
+            except InvalidImageError as e:
+                self.assertEqual(str(e), 'Base image size (10, 10) does '
+                                         'not match probability map size '
+                                         '(10, 11)')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_convert_image_in_bands_truncated_probmap(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_file = os.path.join(temp_dir, 'image.png')
+            Image.new('L', (100, 100)).save(img_file)
+            prob_file = os.path.join(temp_dir, 'probmap.png')
+            rstate = np.random.RandomState(3)
+            data = rstate.randint(0, 256, size=(100, 100)).astype(np.uint8)
+            Image.fromarray(data).save(prob_file)
+            with open(prob_file, 'rb') as f:
+                png_data = f.read()
+            with open(prob_file, 'wb') as f:
+                f.write(png_data[:len(png_data) // 2])
+            try:
+                createprobmapoverlay.main(['hi.py', img_file, prob_file,
+                                           os.path.join(temp_dir, 'out'),
+                                           '--maxmemory', '0'])
+                self.fail('Expected IOError')
+            except IOError as e:
+                self.assertEqual(str(e), 'PNG image data is truncated')
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['image.png', 'probmap.png'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_batch_pairs(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            probmap_dir = os.path.join(temp_dir, 'probmaps')
+            os.makedirs(os.path.join(image_dir, 'subdir'))
+            os.makedirs(os.path.join(probmap_dir, 'subdir'))
+            for name in ['a.tif', 'b.png', 'c.png']:
+                open(os.path.join(image_dir, name), 'a').close()
+            for name in ['b.png', 'a.png', 'd.png', 'c.png.tmp']:
+                open(os.path.join(probmap_dir, name), 'a').close()
+
+            profile = createprobmapoverlay.OutputProfile()
+            res = createprobmapoverlay._get_batch_pairs(image_dir,
+                                                        probmap_dir,
+                                                        '/out', profile)
+            self.assertEqual(res, [(os.path.join(image_dir, 'a.tif'),
+                                    os.path.join(probmap_dir, 'a.png'),
+                                    '/out/a.png'),
+                                   (os.path.join(image_dir, 'b.png'),
+                                    os.path.join(probmap_dir, 'b.png'),
+                                    '/out/b.png')])
+
+            open(os.path.join(probmap_dir, 'c'), 'a').close()
+            profile = createprobmapoverlay.OutputProfile('default')
+            res = createprobmapoverlay._get_batch_pairs(image_dir,
+                                                        probmap_dir,
+                                                        '/out', profile)
+            self.assertEqual(res[-1][2], '/out/c.png')
+            profile = createprobmapoverlay.OutputProfile('tiff')
+            res = createprobmapoverlay._get_batch_pairs(image_dir,
+                                                        probmap_dir,
+                                                        '/out', profile)
+            self.assertEqual([pair[2] for pair in res],
+                             ['/out/a.tif', '/out/b.tif', '/out/c.tif'])
+            profile = createprobmapoverlay.OutputProfile('npy')
+            res = createprobmapoverlay._get_batch_pairs(image_dir,
+                                                        probmap_dir,
+                                                        '/out', profile)
+            self.assertEqual(res[0][2], '/out/a.npy')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_batch_mode(self):
+        temp_dir = tempfile.mkdtemp()
+        orig_stdout = sys.stdout
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            probmap_dir = os.path.join(temp_dir, 'probmaps')
+            os.makedirs(image_dir)
+            os.makedirs(probmap_dir)
+            rstate = np.random.RandomState(4)
+            for name in ['a', 'b', 'c']:
+                Image.fromarray(rstate.randint(0, 256, size=(20, 30))
+                                .astype(np.uint8)).save(
+                    os.path.join(image_dir, name + '.png'))
+                Image.fromarray(rstate.randint(0, 256, size=(20, 30))
+                                .astype(np.uint8)).save(
+                    os.path.join(probmap_dir, name + '.png'))
+
+            for workers in ['1', '2']:
+                out_dir = os.path.join(temp_dir, 'out' + workers)
+                os.makedirs(out_dir)
+                open(os.path.join(out_dir, 'c.png'), 'a').close()
+                # left by an interrupted run so overlay is created
+                open(os.path.join(out_dir, 'b.png.tmp'), 'a').close()
+                sys.stdout = StringIO()
+                res = createprobmapoverlay.main(['hi.py', image_dir,
+                                                 probmap_dir, out_dir,
+                                                 '--workers', workers])
+                output = sys.stdout.getvalue()
+                sys.stdout = orig_stdout
+                self.assertEqual(res, 0)
+                self.assertTrue(output.startswith('Created 2 overlays, '
+                                                  'skipped 1 existing and '
+                                                  '0 failed in '))
+                self.assertTrue('images/sec' in output)
+                self.assertEqual(os.path.getsize(os.path.join(out_dir,
+                                                              'c.png')), 0)
+                self.assertEqual(sorted(os.listdir(out_dir)),
+                                 ['a.png', 'b.png', 'c.png'])
+                for name in ['a', 'b']:
+                    expected_file = os.path.join(temp_dir, 'expected.png')
+                    createprobmapoverlay.main(['hi.py',
+                                               os.path.join(image_dir,
+                                                            name + '.png'),
+                                               os.path.join(probmap_dir,
+                                                            name + '.png'),
+                                               expected_file])
+                    expected = Image.open(expected_file)
+                    out_img = Image.open(os.path.join(out_dir,
+                                                      name + '.png'))
+                    self.assertEqual(out_img.tobytes(), expected.tobytes())
+                    out_img.close()
+                    expected.close()
+
+            # output directory is created and failures are reported
+            open(os.path.join(probmap_dir, 'a.png'), 'w').close()
+            out_dir = os.path.join(temp_dir, 'newout')
+            sys.stdout = StringIO()
+            res = createprobmapoverlay.main(['hi.py', image_dir,
+                                             probmap_dir, out_dir])
+            output = sys.stdout.getvalue()
+            sys.stdout = orig_stdout
+            self.assertEqual(res, 1)
+            self.assertTrue(output.startswith('Created 2 overlays, skipped '
+                                              '0 existing and 1 failed in '))
+            self.assertTrue(os.path.isfile(os.path.join(out_dir, 'b.png')))
+        finally:
+            sys.stdout = orig_stdout
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
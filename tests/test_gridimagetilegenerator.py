@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_gridimagetilegenerator
+----------------------------------
+
+Tests for `GridImageTileGenerator in image`
+"""
+
+import unittest
+import numpy as np
+from PIL import Image
+from chmutil.image import GridImageTileGenerator
+from chmutil.image import InvalidImageError
+from chmutil.core import OverlapTooLargeForTileSizeError
+
+
+class TestGridImageTileGenerator(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_overlap_too_large(self):
+        try:
+            GridImageTileGenerator(tilewidth=10, tileheight=10,
+                                   overlapwidth=5)
+            self.fail('expected exception')
+        except OverlapTooLargeForTileSizeError as e:
+            self.assertEqual(str(e), 'Overlap width too large for tile')
+
+        try:
+            GridImageTileGenerator(tilewidth=10, tileheight=10,
+                                   overlapheight=6)
+            self.fail('expected exception')
+        except OverlapTooLargeForTileSizeError as e:
+            self.assertEqual(str(e), 'Overlap height too large for tile')
+
+    def test_image_is_none(self):
+        gen = GridImageTileGenerator()
+        try:
+            for res in gen.get_image_tiles(None):
+                self.fail('expected exception')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Image is None')
+
+    def test_get_tile_boxes_no_overlap(self):
+        gen = GridImageTileGenerator(tilewidth=4, tileheight=3)
+        res = list(gen.get_tile_boxes(6, 3))
+        self.assertEqual(res, [((0, 0, 4, 3), (0, 0, 4, 3)),
+                               ((4, 0, 6, 3), (4, 0, 6, 3))])
+
+    def test_get_tile_boxes_with_overlap(self):
+        gen = GridImageTileGenerator(tilewidth=6, tileheight=5,
+                                     overlapwidth=1, overlapheight=1)
+        res = list(gen.get_tile_boxes(10, 5))
+        self.assertEqual(res, [((0, 0, 5, 4), (0, 0, 4, 3)),
+                               ((3, 0, 9, 4), (4, 0, 8, 3)),
+                               ((7, 0, 10, 4), (8, 0, 10, 3)),
+                               ((0, 2, 5, 5), (0, 3, 4, 5)),
+                               ((3, 2, 9, 5), (4, 3, 8, 5)),
+                               ((7, 2, 10, 5), (8, 3, 10, 5))])
+
+    def test_tiles_are_views_that_cover_image(self):
+        data = np.arange(35 * 22, dtype=np.uint32).reshape(22, 35)
+        im = Image.fromarray(data.astype(np.uint8))
+        gen = GridImageTileGenerator(tilewidth=12, tileheight=9,
+                                     overlapwidth=2, overlapheight=1)
+        covered = np.zeros(data.shape, dtype=np.int32)
+        counter = 0
+        for tile in gen.get_image_tiles(data):
+            counter += 1
+            (left, upper, right, lower) = tile.get_box()
+            view = tile.get_array()
+            self.assertTrue(np.shares_memory(view, data))
+            self.assertTrue(np.array_equal(view,
+                                           data[upper:lower, left:right]))
+            (tl, tu, tr, tb) = tile.get_valid_box_in_tile()
+            (vl, vu, vr, vb) = tile.get_valid_box()
+            self.assertTrue(np.array_equal(view[tu:tb, tl:tr],
+                                           data[vu:vb, vl:vr]))
+            covered[vu:vb, vl:vr] += 1
+        self.assertEqual(counter, 20)
+        self.assertTrue(np.all(covered == 1))
+
+        # Pillow images are decoded once and tiled the same way
+        tiles = list(gen.get_image_tiles(im))
+        self.assertEqual(len(tiles), 20)
+        self.assertTrue(tiles[0].get_array().base is
+                        tiles[1].get_array().base)
+        self.assertEqual(tiles[-1].get_image().size, (5, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
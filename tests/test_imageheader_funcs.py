@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_imageheader_funcs
+----------------------------------
+
+Tests for functions in `imageheader` module
+"""
+
+import unittest
+import os
+import struct
+import tempfile
+import shutil
+
+from PIL import Image
+from chmutil import imageheader
+from chmutil.imageheader import InvalidImageHeaderError
+
+
+def _write_tiff(tiff_file, order, width, height, bigtiff=False,
+                width_type=3):
+    """Writes header and first IFD of a TIFF with the IFD placed after
+       padding so it is not within the first bytes of the file
+    """
+    ifd_offset = 1000
+    if bigtiff:
+        header = struct.pack(order + '2sHHHQ', b'II' if order == '<'
+                             else b'MM', 43, 8, 0, ifd_offset)
+        entry_fmt = 'HHQ'
+        count_fmt = 'Q'
+    else:
+        header = struct.pack(order + '2sHI', b'II' if order == '<'
+                             else b'MM', 42, ifd_offset)
+        entry_fmt = 'HHI'
+        count_fmt = 'H'
+    value_size = 8 if bigtiff else 4
+    entries = [(254, 4, 0), (256, width_type, width), (257, 4, height)]
+    ifd = struct.pack(order + count_fmt, len(entries))
+    for (tag, field_type, value) in entries:
+        fmt = {3: 'H', 4: 'I', 16: 'Q', 2: '4s'}[field_type]
+        data = struct.pack(order + fmt, value)
+        ifd += (struct.pack(order + entry_fmt, tag, field_type, 1) +
+                data + b'\x00' * (value_size - len(data)))
+    with open(tiff_file, 'wb') as f:
+        f.write(header + b'\x00' * (ifd_offset - len(header)) + ifd)
+
+
+class TestImageHeaderFunctions(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_png_tiff_jpeg_match_pillow(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im = Image.new('RGB', (123, 45))
+            exif = Image.Exif()
+            exif[270] = 'x' * 2000
+            files = [('a.png', 'PNG', {}),
+                     ('b.tif', 'TIFF', {}),
+                     ('c.tif', 'TIFF', {'compression': 'tiff_lzw'}),
+                     ('d.jpg', 'JPEG', {}),
+                     ('e.jpg', 'JPEG', {'progressive': True,
+                                        'exif': exif.tobytes()})]
+            for (name, fmt, kwargs) in files:
+                fp = os.path.join(temp_dir, name)
+                im.save(fp, fmt, **kwargs)
+                self.assertEqual(imageheader.read_image_header(fp),
+                                 (123, 45, fmt))
+                pil_im = Image.open(fp)
+                self.assertEqual(imageheader.get_image_size_and_format(fp),
+                                 (pil_im.size[0], pil_im.size[1],
+                                  pil_im.format))
+                pil_im.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_tiff_variants(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fp = os.path.join(temp_dir, 'a.tif')
+            _write_tiff(fp, '>', 300, 70000)
+            self.assertEqual(imageheader.read_image_header(fp),
+                             (300, 70000, 'TIFF'))
+            _write_tiff(fp, '<', 100000, 5, width_type=4)
+            self.assertEqual(imageheader.read_image_header(fp),
+                             (100000, 5, 'TIFF'))
+            _write_tiff(fp, '<', 2 ** 33, 7, bigtiff=True, width_type=16)
+            self.assertEqual(imageheader.read_image_header(fp),
+                             (2 ** 33, 7, 'TIFF'))
+            _write_tiff(fp, '>', 11, 12, bigtiff=True)
+            self.assertEqual(imageheader.read_image_header(fp),
+                             (11, 12, 'TIFF'))
+            _write_tiff(fp, '<', b'AAAA', 12, width_type=2)
+            try:
+                imageheader.read_image_header(fp)
+                self.fail('expected InvalidImageHeaderError')
+            except InvalidImageHeaderError as e:
+                self.assertEqual(str(e), 'Unsupported type 2 for tag 256')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_other_format_uses_pillow(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fp = os.path.join(temp_dir, 'a.gif')
+            Image.new('L', (10, 20)).save(fp, 'GIF')
+            self.assertEqual(imageheader.read_image_header(fp), None)
+            self.assertEqual(imageheader.get_image_size_and_format(fp),
+                             (10, 20, 'GIF'))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_truncated_or_invalid_files(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fp = os.path.join(temp_dir, 'a.png')
+            open(fp, 'a').close()
+            self.assertEqual(imageheader.read_image_header(fp), None)
+
+            for data in [imageheader.PNG_SIGNATURE + b'\x00\x00',
+                         b'II*\x00\x08\x00\x00\x00\x05',
+                         b'II+\x00\x08',
+                         b'\xff\xd8\xff\xe0\x00\x10',
+                         b'\xff\xd8\xff\xd9']:
+                with open(fp, 'wb') as f:
+                    f.write(data)
+                self.assertRaises(InvalidImageHeaderError,
+                                  imageheader.read_image_header, fp)
+                # Pillow is used as fallback and fails too
+                self.assertRaises(IOError,
+                                  imageheader.get_image_size_and_format, fp)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_image_too_large(self):
+        temp_dir = tempfile.mkdtemp()
+        orig = Image.MAX_IMAGE_PIXELS
+        try:
+            fp = os.path.join(temp_dir, 'a.png')
+            Image.new('L', (10, 20)).save(fp, 'PNG')
+            # like Pillow only images over twice the limit are rejected
+            Image.MAX_IMAGE_PIXELS = 100
+            self.assertEqual(imageheader.get_image_size_and_format(fp),
+                             (10, 20, 'PNG'))
+            Image.MAX_IMAGE_PIXELS = 99
+            try:
+                imageheader.get_image_size_and_format(fp)
+                self.fail('expected InvalidImageHeaderError')
+            except InvalidImageHeaderError as e:
+                self.assertEqual(str(e), 'Image size (200 pixels) exceeds '
+                                         'limit of 198 pixels')
+            Image.MAX_IMAGE_PIXELS = None
+            self.assertEqual(imageheader.get_image_size_and_format(fp),
+                             (10, 20, 'PNG'))
+        finally:
+            Image.MAX_IMAGE_PIXELS = orig
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
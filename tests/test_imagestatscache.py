@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_imagestatscache
+----------------------------------
+
+Tests for `ImageStatsCache in core`
+"""
+
+import tempfile
+import shutil
+import os
+import unittest
+
+from chmutil.core import ImageStats
+from chmutil.core import ImageStatsCache
+
+
+class TestImageStatsCache(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_load_no_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(temp_dir, 'foo.json')
+            cache = ImageStatsCache(cache_file)
+            self.assertEqual(cache.get_cache_file(), cache_file)
+            cache.load()
+            self.assertEqual(cache.get_image_stats('/a.png', 1, 2.0), None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_invalid_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(temp_dir, 'foo.json')
+            with open(cache_file, 'w') as f:
+                f.write('{not json')
+            cache = ImageStatsCache(cache_file)
+            cache.load()
+            self.assertEqual(cache.get_image_stats('/a.png', 1, 2.0), None)
+
+            with open(cache_file, 'w') as f:
+                f.write('[1, 2]')
+            cache.load()
+            self.assertEqual(cache.get_image_stats('/a.png', 1, 2.0), None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_set_get_save_and_load(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(temp_dir, 'sub', 'foo.json')
+            cache = ImageStatsCache(cache_file)
+            cache.set_image_stats(ImageStats('/a.png', 10, 20, 'PNG'),
+                                  100, 1484000000.123456)
+            cache.set_image_stats(ImageStats('/b.tif', 30, 40, 'TIFF'),
+                                  200, 5.0)
+
+            iis = cache.get_image_stats('/a.png', 100, 1484000000.123456)
+            self.assertEqual(iis.get_file_path(), '/a.png')
+            self.assertEqual(iis.get_width(), 10)
+            self.assertEqual(iis.get_height(), 20)
+            self.assertEqual(iis.get_format(), 'PNG')
+
+            # size or mtime mismatch
+            self.assertEqual(cache.get_image_stats('/a.png', 101,
+                                                   1484000000.123456), None)
+            self.assertEqual(cache.get_image_stats('/a.png', 100,
+                                                   1484000000.0), None)
+
+            cache.save(path_list=['/a.png', '/c.png'])
+            self.assertEqual(os.listdir(os.path.dirname(cache_file)),
+                             ['foo.json'])
+
+            cache = ImageStatsCache(cache_file)
+            cache.load()
+            iis = cache.get_image_stats('/a.png', 100, 1484000000.123456)
+            self.assertEqual(iis.get_width(), 10)
+            self.assertEqual(cache.get_image_stats('/b.tif', 200, 5.0), None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,10 +11,12 @@ Tests for `chmutil` module.
 import tempfile
 import shutil
 import os
+import json
 import unittest
 
 from PIL import Image
 from chmutil.core import ImageStatsFromDirectoryFactory
+from chmutil.core import get_image_path_list
 
 
 class TestImageStatsFromDirectoryFactory(unittest.TestCase):
@@ -99,6 +101,126 @@ class TestImageStatsFromDirectoryFactory(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_images_and_bad_files_in_directory_order(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for x in range(1, 21):
+                if x % 5 == 0:
+                    open(os.path.join(temp_dir, str(x) + '.png'),
+                         'a').close()
+                    continue
+                pngfile = os.path.join(temp_dir, str(x) + '.png')
+                myimg = Image.new('L', (x, 2 * x))
+                myimg.save(pngfile, 'PNG')
+
+            expected = [fp for fp in get_image_path_list(temp_dir, None)
+                        if os.path.getsize(fp) > 0]
+            for workers in [1, 4, 32]:
+                fac = ImageStatsFromDirectoryFactory(temp_dir,
+                                                     workers=workers)
+                res = fac.get_input_image_stats()
+                self.assertEqual([iis.get_file_path() for iis in res],
+                                 expected)
+                for iis in res:
+                    x = int(os.path.basename(iis.get_file_path())[:-4])
+                    self.assertEqual(iis.get_width(), x)
+                    self.assertEqual(iis.get_height(), 2 * x)
+                    self.assertEqual(iis.get_format(), 'PNG')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_cache_only_reopens_new_or_changed_images(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            images = os.path.join(temp_dir, 'images')
+            os.makedirs(images)
+            for name in ['a.png', 'b.png']:
+                Image.new('L', (10, 20)).save(os.path.join(images, name),
+                                              'PNG')
+            cache = os.path.join(temp_dir, 'cache', 'stats.json')
+            fac = ImageStatsFromDirectoryFactory(images, cache_file=cache)
+            res = fac.get_input_image_stats()
+            self.assertEqual(len(res), 2)
+            self.assertTrue(os.path.isfile(cache))
+
+            # alter cached widths so we can tell when cache is used
+            with open(cache, 'r') as f:
+                entries = json.load(f)
+            self.assertEqual(len(entries), 2)
+            for key in entries:
+                entries[key][2] = 99
+            with open(cache, 'w') as f:
+                json.dump(entries, f)
+
+            # change mtime of b.png and add c.png
+            b_file = os.path.join(images, 'b.png')
+            st = os.stat(b_file)
+            os.utime(b_file, (st.st_atime, st.st_mtime + 10))
+            Image.new('L', (30, 40)).save(os.path.join(images, 'c.png'),
+                                          'PNG')
+            res = fac.get_input_image_stats()
+            widths = dict((os.path.basename(iis.get_file_path()),
+                           iis.get_width()) for iis in res)
+            self.assertEqual(widths, {'a.png': 99, 'b.png': 10,
+                                      'c.png': 30})
+
+            # removed images are dropped from cache
+            os.unlink(os.path.join(images, 'c.png'))
+            fac.get_input_image_stats()
+            with open(cache, 'r') as f:
+                self.assertEqual(len(json.load(f)), 2)
+
+            # refresh reopens every image
+            fac = ImageStatsFromDirectoryFactory(images, cache_file=cache,
+                                                 refresh_cache=True)
+            res = fac.get_input_image_stats()
+            self.assertEqual([iis.get_width() for iis in res], [10, 10])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_cached_images_over_size_limit_are_skipped(self):
+        temp_dir = tempfile.mkdtemp()
+        orig = Image.MAX_IMAGE_PIXELS
+        try:
+            images = os.path.join(temp_dir, 'images')
+            os.makedirs(images)
+            Image.new('L', (10, 20)).save(os.path.join(images, 'a.png'),
+                                          'PNG')
+            Image.new('L', (5, 5)).save(os.path.join(images, 'b.png'),
+                                        'PNG')
+            cache = os.path.join(temp_dir, 'stats.json')
+            fac = ImageStatsFromDirectoryFactory(images, cache_file=cache)
+            self.assertEqual(len(fac.get_input_image_stats()), 2)
+
+            # a.png has 200 pixels which is over twice the limit
+            fac = ImageStatsFromDirectoryFactory(images, cache_file=cache,
+                                                 max_image_pixels=99)
+            res = fac.get_input_image_stats()
+            self.assertEqual([os.path.basename(iis.get_file_path())
+                              for iis in res], ['b.png'])
+
+            fac = ImageStatsFromDirectoryFactory(images, cache_file=cache,
+                                                 max_image_pixels=100)
+            self.assertEqual(len(fac.get_input_image_stats()), 2)
+        finally:
+            Image.MAX_IMAGE_PIXELS = orig
+            shutil.rmtree(temp_dir)
+
+    def test_cache_not_writable(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            Image.new('L', (10, 20)).save(os.path.join(temp_dir, 'a.png'),
+                                          'PNG')
+            afile = os.path.join(temp_dir, 'notadir')
+            open(afile, 'a').close()
+            fac = ImageStatsFromDirectoryFactory(temp_dir,
+                                                 cache_file=os.path.
+                                                 join(afile, 'x.json'))
+            res = fac.get_input_image_stats()
+            self.assertEqual(len(res), 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_imagestream_funcs
+----------------------------------
+
+Tests for functions and `PillowRowReader` in `imagestream` module
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+from PIL import Image
+from chmutil import imagestream
+from chmutil.imagestream import PNGRowReader
+from chmutil.imagestream import PillowRowReader
+from chmutil.imagestream import PNGRowWriter
+from chmutil.imagestream import TIFFRowWriter
+from chmutil.imagestream import UnsupportedImageFormatError
+
+
+class TestImageStreamFunctions(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_get_image_row_reader(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            data = np.arange(0, 60, dtype=np.uint8).reshape(6, 10)
+            png = os.path.join(temp_dir, 'foo.png')
+            Image.fromarray(data).save(png)
+            tif = os.path.join(temp_dir, 'foo.tif')
+            Image.fromarray(data).save(tif)
+
+            reader = imagestream.get_image_row_reader(png)
+            self.assertTrue(isinstance(reader, PNGRowReader))
+            reader.close()
+
+            reader = imagestream.get_image_row_reader(tif)
+            self.assertTrue(isinstance(reader, PillowRowReader))
+            self.assertEqual(reader.get_size(), (10, 6))
+            self.assertEqual(reader.get_mode(), 'L')
+            band = reader.read_rows(4)
+            self.assertTrue(np.array_equal(np.asarray(band), data[0:4]))
+            band = reader.read_rows(4)
+            self.assertTrue(np.array_equal(np.asarray(band), data[4:6]))
+            self.assertEqual(reader.read_rows(4), None)
+            reader.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_image_row_writer(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            writer = imagestream.get_image_row_writer(
+                os.path.join(temp_dir, 'foo.PNG'), 1, 1)
+            self.assertTrue(isinstance(writer, PNGRowWriter))
+            writer.write_rows(np.zeros((1, 1), dtype=np.uint8))
+            writer.close()
+
+            for suffix in ['.tif', '.tiff']:
+                writer = imagestream.get_image_row_writer(
+                    os.path.join(temp_dir, 'foo' + suffix), 1, 1)
+                self.assertTrue(isinstance(writer, TIFFRowWriter))
+                writer.write_rows(np.zeros((1, 1), dtype=np.uint8))
+                writer.close()
+
+            try:
+                imagestream.get_image_row_writer('/foo.jpg', 1, 1)
+                self.fail('Expected UnsupportedImageFormatError')
+            except UnsupportedImageFormatError as e:
+                self.assertEqual(str(e), 'Unable to write /foo.jpg '
+                                         'incrementally only .png and '
+                                         '.tif images are supported')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_write_array_to_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            data = np.arange(0, 7 * 5, dtype=np.uint8).reshape((7, 5))
+            for suffix in ['.png', '.tif']:
+                out_file = os.path.join(temp_dir, 'foo' + suffix)
+                imagestream.write_array_to_image(data, out_file,
+                                                 rows_per_write=3)
+                img = Image.open(out_file)
+                self.assertEqual(img.mode, 'L')
+                self.assertEqual(img.tobytes(), data.tobytes())
+                img.close()
+
+            rgb = np.zeros((4, 3, 3), dtype=np.uint8)
+            rgb[1, 2] = (1, 2, 3)
+            out_file = os.path.join(temp_dir, 'rgb.png')
+            imagestream.write_array_to_image(rgb, out_file)
+            img = Image.open(out_file)
+            self.assertEqual(img.mode, 'RGB')
+            self.assertEqual(img.getpixel((2, 1)), (1, 2, 3))
+            img.close()
+
+            try:
+                imagestream.write_array_to_image(np.zeros((2, 2, 2),
+                                                          dtype=np.uint8),
+                                                 out_file)
+                self.fail('Expected UnsupportedImageFormatError')
+            except UnsupportedImageFormatError as e:
+                self.assertEqual(str(e), 'Unable to write array of shape '
+                                         '(2, 2, 2)')
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
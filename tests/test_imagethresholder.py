@@ -9,7 +9,10 @@ Tests for `ImageThresholder in image`
 """
 
 import unittest
-
+import os
+import tempfile
+import shutil
+import numpy as np
 
 from PIL import Image
 
@@ -64,6 +67,103 @@ class TestImageThresholder(unittest.TestCase):
         self.assertEqual(res.getpixel((5, 7)), 255)
         res.close()
 
+    def test_threshold_image_matches_eval(self):
+        img = Image.new('L', (256, 1))
+        img.putdata(list(range(256)))
+        for pc in [0, 30, 50, 100]:
+            im = ImageThresholder(threshold_percent=pc)
+            cutoff = im.get_pixel_intensity_cutoff()
+            res = im.threshold_image(img)
+            self.assertEqual(res.mode, 'L')
+            self.assertEqual(list(res.getdata()),
+                             list(Image.eval(img, lambda px: 0 if px < cutoff
+                                             else 255).getdata()))
+            res.close()
+
+        # non 8-bit grayscale images still work
+        img = Image.new('RGB', (2, 1), color=(10, 200, 80))
+        res = ImageThresholder(threshold_percent=30).threshold_image(img)
+        self.assertEqual(res.getpixel((0, 0)), (0, 255, 255))
+
+    def test_threshold_array(self):
+        im = ImageThresholder(threshold_percent=30)
+        try:
+            im.threshold_array(None)
+            self.fail('Expected InvalidImageError')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Image is None')
+
+        try:
+            im.threshold_array(np.zeros((1, 1), dtype=np.float32))
+            self.fail('Expected InvalidImageError')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Only uint8 arrays can be thresholded '
+                                     'not float32')
+
+        data = np.array([[0, 75, 76], [255, 1, 100]], dtype=np.uint8)
+        res = im.threshold_array(data)
+        self.assertEqual(res.tolist(), [[0, 0, 255], [255, 0, 255]])
+        self.assertEqual(data.tolist(), [[0, 75, 76], [255, 1, 100]])
+
+        data = np.arange(0, 256, dtype=np.uint8).reshape((16, 16))
+        for pc in [0, 30, 50, 100]:
+            im = ImageThresholder(threshold_percent=pc)
+            cutoff = im.get_pixel_intensity_cutoff()
+            self.assertEqual(im.threshold_array(data.T).T.ravel().tolist(),
+                             [0 if px < cutoff else 255
+                              for px in range(256)])
+
+        im = ImageThresholder(threshold_percent=30)
+        data = np.array([[0, 75, 76], [255, 1, 100]], dtype=np.uint8)
+        # threshold in place
+        res = im.threshold_array(data, out=data)
+        self.assertTrue(res is data)
+        self.assertEqual(data.tolist(), [[0, 0, 255], [255, 0, 255]])
+
+    def test_threshold_many(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            src_dir = os.path.join(temp_dir, 'src')
+            os.makedirs(src_dir)
+            image_files = []
+            for x in range(0, 3):
+                img = Image.new('L', (4, 3), color=0)
+                img.putpixel((x, 1), 70 + x * 5)
+                image_file = os.path.join(src_dir, str(x) + '.png')
+                img.save(image_file)
+                image_files.append(image_file)
+            img = Image.new('RGB', (4, 3), color=(0, 0, 0))
+            img.putpixel((3, 2), (255, 255, 255))
+            image_file = os.path.join(src_dir, 'rgb.png')
+            img.save(image_file)
+            image_files.append(image_file)
+
+            im = ImageThresholder(threshold_percent=30)
+            for workers in [1, 2]:
+                dest_dir = os.path.join(temp_dir, str(workers))
+                os.makedirs(dest_dir)
+                res = im.threshold_many(image_files, dest_dir,
+                                        workers=workers)
+                self.assertEqual(res,
+                                 [os.path.join(dest_dir,
+                                               os.path.basename(f))
+                                  for f in image_files])
+                expected = [(0, 0), (1, 0), (2, 255), (3, 2)]
+                for dest_file, (x, value) in zip(res[:3], expected):
+                    out_img = Image.open(dest_file)
+                    self.assertEqual(out_img.mode, 'L')
+                    self.assertEqual(out_img.getpixel((x, 1)), value)
+                    self.assertEqual(out_img.getpixel((0, 0)), 0)
+                    out_img.close()
+                out_img = Image.open(res[3])
+                self.assertEqual(out_img.mode, 'L')
+                self.assertEqual(out_img.getpixel((3, 2)), 255)
+                out_img.close()
+
+            self.assertEqual(im.threshold_many([], temp_dir, workers=2), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
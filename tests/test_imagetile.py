@@ -9,6 +9,7 @@ Tests for `ImageTile in image`
 """
 
 import unittest
+import numpy as np
 from PIL import Image
 from chmutil.image import ImageTile
 
@@ -30,6 +31,29 @@ class TestImageTile(unittest.TestCase):
         tile = ImageTile(im, box=(4, 5, 6, 7))
         self.assertEqual(tile.get_box(), (4, 5, 6, 7))
         self.assertEqual(tile.get_image(), im)
+        self.assertEqual(tile.get_valid_box(), (4, 5, 6, 7))
+        self.assertEqual(tile.get_valid_box_in_tile(), (0, 0, 2, 2))
+        self.assertEqual(tile.get_array().shape, (10, 10))
+
+    def test_no_dict(self):
+        tile = ImageTile(None)
+        try:
+            tile.foo = 1
+            self.fail('expected AttributeError')
+        except AttributeError:
+            pass
+
+    def test_tile_from_array(self):
+        data = np.arange(100, dtype=np.uint8).reshape(10, 10)
+        view = data[2:6, 3:9]
+        tile = ImageTile(None, box=(3, 2, 9, 6), valid_box=(4, 3, 8, 5),
+                         data=view)
+        self.assertTrue(tile.get_array() is view)
+        self.assertEqual(tile.get_valid_box(), (4, 3, 8, 5))
+        self.assertEqual(tile.get_valid_box_in_tile(), (1, 1, 5, 3))
+        im = tile.get_image()
+        self.assertEqual(im.size, (6, 4))
+        self.assertEqual(im.getpixel((0, 0)), 23)
 
 
 if __name__ == '__main__':
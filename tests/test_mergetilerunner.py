@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_mergetilerunner
+----------------------------------
+
+Tests for `mergetilerunner.py`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import stat
+import configparser
+
+from chmutil import mergetilerunner
+from chmutil.core import CHMJobCreator
+
+
+class TestMergeTileRunner(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_parse_arguments(self):
+        pargs = mergetilerunner._parse_arguments('hi', ['1', 'jobdir'])
+        self.assertEqual(pargs.taskid, '1')
+        self.assertEqual(pargs.jobdir, 'jobdir')
+        self.assertEqual(pargs.partial, False)
+
+    def test_get_overlay_args(self):
+        config = configparser.ConfigParser()
+        config.set('', CHMJobCreator.CONFIG_IMAGES, '/images')
+        config.add_section('1')
+
+        # no overlay image
+        self.assertEqual(mergetilerunner._get_overlay_args(config, '1',
+                                                           '/job',
+                                                           '/x/foo.png'), '')
+
+        # no overlay settings, job created by older version
+        config.set('1', CHMJobCreator.MERGE_OUTPUT_OVERLAY_IMAGE,
+                   os.path.join(CHMJobCreator.OVERLAYMAPS_DIR, 'foo.png'))
+        self.assertEqual(mergetilerunner._get_overlay_args(config, '1',
+                                                           '/job',
+                                                           '/x/foo.png'), '')
+
+        config.set('', CHMJobCreator.MERGE_OVERLAY_THRESHPC, '40')
+        config.set('', CHMJobCreator.MERGE_OVERLAY_COLOR, 'red')
+        config.set('', CHMJobCreator.MERGE_OVERLAY_OPACITY, '80')
+        overlay = os.path.join('/job', CHMJobCreator.RUN_DIR,
+                               CHMJobCreator.OVERLAYMAPS_DIR, 'foo.png')
+        self.assertEqual(mergetilerunner._get_overlay_args(config, '1',
+                                                           '/job',
+                                                           '/x/foo.png'),
+                         ' --overlay ' + overlay +
+                         ' --overlaybaseimage /images/foo.png'
+                         ' --overlaythreshpc 40 --overlaycolor red'
+                         ' --overlayopacity 80')
+
+        config.set('1', CHMJobCreator.MERGE_OUTPUT_OVERLAY_IMAGE,
+                   '/o/foo.png')
+        res = mergetilerunner._get_overlay_args(config, '1', '/job',
+                                                '/x/foo.png')
+        self.assertTrue(res.startswith(' --overlay /o/foo.png '))
+
+    def test_main_partial(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            fakecmd = os.path.join(temp_dir, 'mergetiles.py')
+            argsfile = os.path.join(temp_dir, 'args.txt')
+            f = open(fakecmd, 'w')
+            f.write('#!/usr/bin/env python\n\n')
+            f.write('import sys\n')
+            f.write('f = open("' + argsfile + '", "w")\n')
+            f.write('f.write(" ".join(sys.argv[1:]))\n')
+            f.write('f.close()\n')
+            f.close()
+            os.chmod(fakecmd, stat.S_IRWXU)
+
+            config = configparser.ConfigParser()
+            config.set('', CHMJobCreator.MERGE_MERGETILES_BIN, fakecmd)
+            config.set('', CHMJobCreator.CONFIG_IMAGES, '/images')
+            config.set('', CHMJobCreator.MERGE_OVERLAY_THRESHPC, '30')
+            config.add_section('1')
+            config.set('1', CHMJobCreator.MERGE_INPUT_IMAGE_DIR,
+                       os.path.join(CHMJobCreator.TILES_DIR, 'foo.png'))
+            config.set('1', CHMJobCreator.MERGE_OUTPUT_IMAGE,
+                       os.path.join(CHMJobCreator.PROBMAPS_DIR, 'foo.png'))
+            config.set('1', CHMJobCreator.MERGE_OUTPUT_OVERLAY_IMAGE,
+                       os.path.join(CHMJobCreator.OVERLAYMAPS_DIR,
+                                    'foo.png'))
+            f = open(os.path.join(temp_dir,
+                                  CHMJobCreator.MERGE_CONFIG_FILE_NAME), 'w')
+            config.write(f)
+            f.close()
+
+            # no batched merge config is needed for partial merge
+            self.assertEqual(mergetilerunner.main(['yo.py', '1', temp_dir,
+                                                   '--scratchdir', temp_dir,
+                                                   '--partial']), 0)
+            f = open(argsfile, 'r')
+            args = f.read().split(' ')
+            f.close()
+            run_dir = os.path.join(temp_dir, CHMJobCreator.RUN_DIR)
+            self.assertEqual(args[0], os.path.join(run_dir,
+                                                   CHMJobCreator.TILES_DIR,
+                                                   'foo.png'))
+            self.assertEqual(args[1], os.path.join(run_dir,
+                                                   CHMJobCreator.PROBMAPS_DIR,
+                                                   'foo.png'))
+            self.assertTrue('--partial' in args)
+            self.assertFalse('--overlay' in args)
+            self.assertEqual(args[args.index('--incrementaldir') + 1],
+                             os.path.join(run_dir, CHMJobCreator.TMP_DIR))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,11 +10,18 @@ Tests for `mergetiles.py`
 
 import unittest
 import os
+import sys
+import socket
+import subprocess
 import tempfile
 import shutil
+import numpy as np
 from PIL import Image
 
 from chmutil import mergetiles
+from chmutil import createprobmapoverlay
+from chmutil.core import CHMConfig
+from chmutil.core import CHMJobCreator
 
 
 class TestMergeTiles(unittest.TestCase):
@@ -32,6 +39,20 @@ class TestMergeTiles(unittest.TestCase):
         self.assertEqual(pargs.maxpixels, 768000000)
         self.assertEqual(pargs.suffix, 'png')
         self.assertEqual(pargs.loglevel, 'WARNING')
+        self.assertEqual(pargs.jobdir, None)
+        self.assertEqual(pargs.bandheight, 0)
+        self.assertEqual(pargs.workers, 1)
+        self.assertEqual(pargs.scratchdir, None)
+        self.assertEqual(pargs.maxinmemorypixels, 500000000)
+        self.assertEqual(pargs.overlay, None)
+        self.assertEqual(pargs.overlaybaseimage, None)
+        self.assertEqual(pargs.overlaythreshpc, 30)
+        self.assertEqual(pargs.overlaycolor, 'blue')
+        self.assertEqual(pargs.overlayopacity, 70)
+        self.assertEqual(pargs.incrementaldir, None)
+        self.assertEqual(pargs.partial, False)
+        self.assertEqual(pargs.outputprofile, 'default')
+        self.assertEqual(pargs.compresslevel, 6)
 
     def test_main_invalid_input(self):
         temp_dir = tempfile.mkdtemp()
@@ -101,6 +122,440 @@ class TestMergeTiles(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def _create_job(self, temp_dir, size_tuple):
+        """Creates CHM job with a single image `a.png` using
+           100x100 tiles two tiles per task
+        """
+        image_dir = os.path.join(temp_dir, 'images')
+        os.makedirs(image_dir, mode=0o755)
+        Image.new('L', size_tuple).save(os.path.join(image_dir, 'a.png'),
+                                        'PNG')
+        opts = CHMConfig(image_dir, 'model', temp_dir, '100x100', '0x0',
+                         number_tiles_per_task=2)
+        creator = CHMJobCreator(opts)
+        creator.create_job()
+        return os.path.join(temp_dir, CHMJobCreator.RUN_DIR,
+                            CHMJobCreator.TILES_DIR, 'a.png')
+
+    def test_get_tile_boxes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = self._create_job(temp_dir, (150, 200))
+            self.assertEqual(mergetiles._get_tile_boxes(temp_dir, img_dir,
+                                                        []), {})
+            im_list = []
+            # task 2 output is missing
+            for name in ['001.a.png', 'extra.png']:
+                img = Image.new('L', (150, 200))
+                im_list.append(os.path.join(img_dir, name))
+                img.save(im_list[-1], 'PNG')
+            res = mergetiles._get_tile_boxes(temp_dir, img_dir, im_list)
+            self.assertEqual(res, {im_list[0]: [(0, 0, 100, 100),
+                                                (0, 100, 100, 200)]})
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_jobdir(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = self._create_job(temp_dir, (150, 200))
+
+            # every task writes junk outside of its tiles
+            img = Image.new('L', (150, 200), color=1)
+            img.putpixel((10, 10), 200)
+            img.save(os.path.join(img_dir, '001.a.png'), 'PNG')
+
+            img = Image.new('L', (150, 200), color=2)
+            img.putpixel((120, 150), 100)
+            img.save(os.path.join(img_dir, '002.a.png'), 'PNG')
+
+            out_img = os.path.join(temp_dir, 'out.png')
+            self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                              '--jobdir', temp_dir]), 0)
+            merged_img = Image.open(out_img)
+            self.assertEqual(merged_img.getpixel((10, 10)), 200)
+            self.assertEqual(merged_img.getpixel((120, 150)), 100)
+            self.assertEqual(merged_img.getpixel((0, 0)), 1)
+            self.assertEqual(merged_img.getpixel((99, 199)), 1)
+            self.assertEqual(merged_img.getpixel((100, 0)), 2)
+            merged_img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_bandheight(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+
+            myimg = Image.new('L', (50, 60))
+            myimg.putpixel((10, 10), 255)
+            myimg.save(os.path.join(img_dir, '1.png'), 'PNG')
+
+            myimg = Image.new('L', (50, 60))
+            myimg.putpixel((20, 55), 100)
+            myimg.save(os.path.join(img_dir, '2.png'), 'PNG')
+
+            # png and tif are written a band at a time, jpg falls
+            # back to merging in memory
+            for out_name in ['out.png', 'out.tif', 'out.jpg']:
+                out_img = os.path.join(temp_dir, out_name)
+                self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                                  '--bandheight', '7']), 0)
+                merged_img = Image.open(out_img)
+                self.assertEqual(merged_img.size, (50, 60))
+                if out_name != 'out.jpg':
+                    self.assertEqual(merged_img.getpixel((10, 10)), 255)
+                    self.assertEqual(merged_img.getpixel((20, 55)), 100)
+                    self.assertEqual(merged_img.getpixel((0, 0)), 0)
+                merged_img.close()
+
+            empty_dir = os.path.join(temp_dir, 'empty')
+            os.makedirs(empty_dir, mode=0o755)
+            self.assertEqual(mergetiles.main(['yo.py', empty_dir,
+                                              out_img, '--bandheight',
+                                              '7']), 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_workers(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+            for x in range(0, 10):
+                myimg = Image.new('L', (50, 60))
+                myimg.putpixel((x, x), 10 + x)
+                myimg.save(os.path.join(img_dir, str(x) + '.png'), 'PNG')
+
+            for bandheight in ['0', '7']:
+                out_img = os.path.join(temp_dir, 'out.png')
+                self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                                  '--workers', '3',
+                                                  '--bandheight',
+                                                  bandheight]), 0)
+                merged_img = Image.open(out_img)
+                for x in range(0, 10):
+                    self.assertEqual(merged_img.getpixel((x, x)), 10 + x)
+                merged_img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_canvas_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_path = os.path.join(temp_dir, 'foo.png')
+            Image.new('L', (10, 5)).save(img_path, 'PNG')
+            self.assertEqual(mergetiles._get_canvas_file([img_path], None,
+                                                         1), None)
+            self.assertEqual(mergetiles._get_canvas_file([], temp_dir, 1),
+                             None)
+            self.assertEqual(mergetiles._get_canvas_file([img_path],
+                                                         temp_dir, 50), None)
+            res = mergetiles._get_canvas_file([img_path], temp_dir, 49)
+            self.assertEqual(os.path.dirname(res), temp_dir)
+            self.assertTrue(os.path.basename(res).startswith('canvas.'))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_scratchdir(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+            scratch_dir = os.path.join(temp_dir, 'scratch')
+            os.makedirs(scratch_dir, mode=0o755)
+            for x in range(0, 3):
+                myimg = Image.new('L', (50, 60))
+                myimg.putpixel((x, x), 10 + x)
+                myimg.save(os.path.join(img_dir, str(x) + '.png'), 'PNG')
+
+            for out_name in ['out.png', 'out.tif', 'out.bmp']:
+                out_img = os.path.join(temp_dir, out_name)
+                self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                                  '--scratchdir',
+                                                  scratch_dir,
+                                                  '--maxinmemorypixels',
+                                                  '10']), 0)
+                merged_img = Image.open(out_img)
+                self.assertEqual(merged_img.size, (50, 60))
+                for x in range(0, 3):
+                    self.assertEqual(merged_img.getpixel((x, x)), 10 + x)
+                merged_img.close()
+                self.assertEqual(os.listdir(scratch_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_overlay_without_base_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(mergetiles.main(['yo.py', temp_dir,
+                                              os.path.join(temp_dir,
+                                                           'out.png'),
+                                              '--overlay',
+                                              os.path.join(temp_dir,
+                                                           'o.png')]), 1)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_overlay(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+            scratch_dir = os.path.join(temp_dir, 'scratch')
+            os.makedirs(scratch_dir, mode=0o755)
+            for x in range(0, 3):
+                myimg = Image.new('L', (50, 60))
+                myimg.putpixel((x, x), 100 * x)
+                myimg.save(os.path.join(img_dir, str(x) + '.png'), 'PNG')
+            base_img = os.path.join(temp_dir, 'base.png')
+            Image.new('L', (50, 60), color=40).save(base_img, 'PNG')
+
+            out_img = os.path.join(temp_dir, 'out.png')
+            expected_img = os.path.join(temp_dir, 'expected.png')
+            self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img]), 0)
+            self.assertEqual(createprobmapoverlay.main(['yo.py', base_img,
+                                                        out_img,
+                                                        expected_img,
+                                                        '--overlaycolor',
+                                                        'red']), 0)
+            expected = Image.open(expected_img)
+            extra_args = [[], ['--bandheight', '7'],
+                          ['--scratchdir', scratch_dir,
+                           '--maxinmemorypixels', '10']]
+            for suffix in ['.png', '.tif', '.bmp']:
+                for args in extra_args:
+                    overlay_img = os.path.join(temp_dir, 'overlay' + suffix)
+                    self.assertEqual(mergetiles.main(['yo.py', img_dir,
+                                                      out_img, '--overlay',
+                                                      overlay_img,
+                                                      '--overlaybaseimage',
+                                                      base_img,
+                                                      '--overlaycolor',
+                                                      'red'] + args), 0)
+                    res = Image.open(overlay_img).convert(mode='RGBA')
+                    self.assertEqual(res.tobytes(), expected.tobytes())
+                    res.close()
+                    os.remove(overlay_img)
+            expected.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_merged_tiles(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            merged_file = os.path.join(temp_dir, 'merged.list')
+            self.assertEqual(mergetiles._get_merged_tiles(merged_file), {})
+            f = open(merged_file, 'w')
+            f.write('/a/1.png\t1.5\n\n/a/2.png\t2.0\n')
+            f.close()
+            self.assertEqual(mergetiles._get_merged_tiles(merged_file),
+                             {'/a/1.png': '1.5', '/a/2.png': '2.0'})
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_acquire_lock(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            lock_file = os.path.join(temp_dir, 'foo.lock')
+            self.assertEqual(mergetiles._acquire_lock(lock_file), True)
+            self.assertEqual(mergetiles._acquire_lock(lock_file), False)
+            with open(lock_file, 'r') as f:
+                self.assertEqual(f.read(), socket.gethostname() + ' ' +
+                                 str(os.getpid()))
+            try:
+                mergetiles._acquire_lock(os.path.join(temp_dir, 'x', 'y'))
+                self.fail('Expected OSError')
+            except OSError:
+                pass
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_acquire_stale_lock(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+            proc.wait()
+            lock_file = os.path.join(temp_dir, 'foo.lock')
+
+            # lock of process on another host is never stale
+            with open(lock_file, 'w') as f:
+                f.write('someotherhost.invalid ' + str(proc.pid))
+            self.assertEqual(mergetiles._acquire_lock(lock_file), False)
+
+            # lock without host and pid is stale once it is old
+            with open(lock_file, 'w') as f:
+                f.write('')
+            self.assertEqual(mergetiles._acquire_lock(lock_file), False)
+            os.utime(lock_file, (1, 1))
+            self.assertEqual(mergetiles._acquire_lock(lock_file), True)
+
+            # lock of process on this host that exited is stale
+            with open(lock_file, 'w') as f:
+                f.write(socket.gethostname() + ' ' + str(proc.pid))
+            self.assertEqual(mergetiles._acquire_lock(lock_file), True)
+            self.assertEqual(mergetiles._get_lock_owner(lock_file),
+                             (socket.gethostname(), os.getpid()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_partial_invalid(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            out_img = os.path.join(temp_dir, 'out.png')
+            self.assertEqual(mergetiles.main(['yo.py', temp_dir, out_img,
+                                              '--partial']), 1)
+
+            # no tiles yet
+            self.assertEqual(mergetiles.main(['yo.py', temp_dir, out_img,
+                                              '--partial',
+                                              '--incrementaldir',
+                                              temp_dir]), 0)
+            self.assertEqual(os.listdir(temp_dir), [])
+
+            # output already exists
+            Image.new('L', (2, 2)).save(out_img, 'PNG')
+            self.assertEqual(mergetiles.main(['yo.py', temp_dir, out_img,
+                                              '--partial',
+                                              '--incrementaldir',
+                                              temp_dir]), 0)
+            self.assertEqual(os.listdir(temp_dir), ['out.png'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_incremental(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+            inc_dir = os.path.join(temp_dir, 'inc')
+            os.makedirs(inc_dir, mode=0o755)
+            out_img = os.path.join(temp_dir, 'out.png')
+            (canvas_file, merged_file,
+             lock_file) = mergetiles._get_incremental_files(inc_dir, out_img)
+
+            args = ['yo.py', img_dir, out_img, '--incrementaldir', inc_dir]
+            for x in range(0, 2):
+                myimg = Image.new('L', (50, 60))
+                myimg.putpixel((x, x), 10 + x)
+                myimg.save(os.path.join(img_dir, str(x) + '.png'), 'PNG')
+            self.assertEqual(mergetiles.main(args + ['--partial']), 0)
+            self.assertFalse(os.path.isfile(out_img))
+            self.assertFalse(os.path.isfile(lock_file))
+            self.assertEqual(len(mergetiles._get_merged_tiles(merged_file)),
+                             2)
+
+            # lock held by another merge
+            open(lock_file, 'w').close()
+            self.assertEqual(mergetiles.main(args + ['--partial']), 3)
+            os.remove(lock_file)
+
+            # lock left by merge that died is taken over
+            proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+            proc.wait()
+            with open(lock_file, 'w') as f:
+                f.write(socket.gethostname() + ' ' + str(proc.pid))
+            self.assertEqual(mergetiles.main(args + ['--partial']), 0)
+            self.assertFalse(os.path.isfile(lock_file))
+
+            myimg = Image.new('L', (50, 60))
+            myimg.putpixel((2, 2), 12)
+            myimg.save(os.path.join(img_dir, '2.png'), 'PNG')
+            self.assertEqual(mergetiles.main(args + ['--partial']), 0)
+            self.assertEqual(len(mergetiles._get_merged_tiles(merged_file)),
+                             3)
+
+            # tile that is rewritten after it was merged is merged again
+            myimg = Image.new('L', (50, 60))
+            myimg.putpixel((3, 3), 13)
+            myimg.save(os.path.join(img_dir, '3.png'), 'PNG')
+            os.utime(os.path.join(img_dir, '0.png'), (1, 1))
+            self.assertEqual(mergetiles.main(args), 0)
+            self.assertEqual(os.listdir(inc_dir), [])
+            merged_img = Image.open(out_img)
+            for x in range(0, 4):
+                self.assertEqual(merged_img.getpixel((x, x)), 10 + x)
+            merged_img.close()
+
+            # no partial canvas so a regular merge is done
+            os.remove(out_img)
+            self.assertEqual(mergetiles.main(args), 0)
+            self.assertEqual(os.listdir(inc_dir), [])
+            self.assertTrue(os.path.isfile(out_img))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_output_profiles(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            img_dir = os.path.join(temp_dir, 'images')
+            os.makedirs(img_dir, mode=0o755)
+            scratch_dir = os.path.join(temp_dir, 'scratch')
+            os.makedirs(scratch_dir, mode=0o755)
+            for x in range(0, 3):
+                myimg = Image.new('L', (20, 30))
+                myimg.putpixel((x, x), 100 * x)
+                myimg.save(os.path.join(img_dir, str(x) + '.png'), 'PNG')
+            base_img = os.path.join(temp_dir, 'base.png')
+            Image.new('L', (20, 30), color=40).save(base_img, 'PNG')
+
+            out_img = os.path.join(temp_dir, 'expected.png')
+            overlay_img = os.path.join(temp_dir, 'expectedoverlay.png')
+            self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                              '--overlay', overlay_img,
+                                              '--overlaybaseimage',
+                                              base_img]), 0)
+            expected = np.asarray(Image.open(out_img))
+            expected_overlay = np.asarray(Image.open(overlay_img))
+
+            formats = {'png': 'PNG', 'tiff': 'TIFF', 'tiff-lzw': 'TIFF'}
+            extra_args = [[], ['--bandheight', '7'],
+                          ['--scratchdir', scratch_dir,
+                           '--maxinmemorypixels', '10']]
+            suffixes = {'png': '.png', 'tiff': '.tif', 'tiff-lzw': '.tiff',
+                        'npy': '.npy'}
+            for profile in ['png', 'tiff', 'tiff-lzw', 'npy']:
+                for args in extra_args:
+                    out_img = os.path.join(temp_dir,
+                                           'out' + suffixes[profile])
+                    overlay_img = os.path.join(temp_dir, 'overlay')
+                    self.assertEqual(mergetiles.main(['yo.py', img_dir,
+                                                      out_img,
+                                                      '--outputprofile',
+                                                      profile,
+                                                      '--compresslevel',
+                                                      '1', '--overlay',
+                                                      overlay_img,
+                                                      '--overlaybaseimage',
+                                                      base_img] + args), 0)
+                    for path, exp in [(out_img, expected),
+                                      (overlay_img, expected_overlay)]:
+                        if profile == 'npy':
+                            res = np.load(path)
+                        else:
+                            img = Image.open(path)
+                            self.assertEqual(img.format, formats[profile])
+                            res = np.asarray(img)
+                            img.close()
+                        self.assertEqual(res.tolist(), exp.tolist())
+                        os.remove(path)
+
+            # suffix of output denotes a format other then profile
+            out_img = os.path.join(temp_dir, 'out.png')
+            self.assertEqual(mergetiles.main(['yo.py', img_dir, out_img,
+                                              '--outputprofile', 'npy']), 1)
+            npy_img = os.path.join(temp_dir, 'out.npy')
+            self.assertEqual(mergetiles.main(['yo.py', img_dir, npy_img,
+                                              '--outputprofile', 'npy',
+                                              '--overlay', out_img,
+                                              '--overlaybaseimage',
+                                              base_img]), 1)
+            self.assertFalse(os.path.isfile(out_img))
+            self.assertFalse(os.path.isfile(npy_img))
+        finally:
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
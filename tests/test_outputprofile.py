@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_outputprofile
+----------------------------------
+
+Tests for `OutputProfile in imagestream`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+from PIL import Image
+from chmutil.imagestream import OutputProfile
+from chmutil.imagestream import PNGRowWriter
+from chmutil.imagestream import ParallelPNGRowWriter
+from chmutil.imagestream import TIFFRowWriter
+from chmutil.imagestream import UnsupportedImageFormatError
+
+
+class TestOutputProfile(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_constructor(self):
+        profile = OutputProfile()
+        self.assertEqual(profile.get_profile(), OutputProfile.DEFAULT)
+        self.assertEqual(profile.get_compress_level(), 6)
+
+        profile = OutputProfile(OutputProfile.PNG, compress_level=1)
+        self.assertEqual(profile.get_profile(), OutputProfile.PNG)
+        self.assertEqual(profile.get_compress_level(), 1)
+        self.assertEqual(profile.get_workers(), 1)
+
+        profile = OutputProfile(OutputProfile.PNG, workers=4)
+        self.assertEqual(profile.get_workers(), 4)
+
+        try:
+            OutputProfile('foo')
+            self.fail('Expected ValueError')
+        except ValueError as e:
+            self.assertEqual(str(e), 'Invalid output profile: foo')
+
+    def test_get_row_writer(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(temp_dir, 'foo.png')
+            writer = OutputProfile().get_row_writer(out_file, 1, 1)
+            self.assertTrue(isinstance(writer, PNGRowWriter))
+            writer.write_rows(np.zeros((1, 1), dtype=np.uint8))
+            writer.close()
+
+            out_file = os.path.join(temp_dir, 'foo')
+            writer = OutputProfile(OutputProfile.PNG).get_row_writer(out_file,
+                                                                     1, 1)
+            self.assertTrue(isinstance(writer, PNGRowWriter))
+            self.assertFalse(isinstance(writer, ParallelPNGRowWriter))
+            writer.write_rows(np.zeros((1, 1), dtype=np.uint8))
+            writer.close()
+
+            out_file = os.path.join(temp_dir, 'foo.png')
+            for name in [OutputProfile.DEFAULT, OutputProfile.PNG]:
+                profile = OutputProfile(name, workers=2)
+                writer = profile.get_row_writer(out_file, 1, 1)
+                self.assertTrue(isinstance(writer, ParallelPNGRowWriter))
+                writer.write_rows(np.ones((1, 1), dtype=np.uint8))
+                writer.close()
+                img = Image.open(out_file)
+                self.assertEqual(img.getpixel((0, 0)), 1)
+                img.close()
+
+            out_file = os.path.join(temp_dir, 'foo.tif')
+            profile = OutputProfile(OutputProfile.TIFF)
+            writer = profile.get_row_writer(out_file, 1, 1)
+            self.assertTrue(isinstance(writer, TIFFRowWriter))
+            writer.write_rows(np.zeros((1, 1), dtype=np.uint8))
+            writer.close()
+
+            for name in [OutputProfile.TIFF_LZW, OutputProfile.NPY]:
+                try:
+                    OutputProfile(name).get_row_writer('/foo', 1, 1)
+                    self.fail('Expected UnsupportedImageFormatError')
+                except UnsupportedImageFormatError as e:
+                    self.assertEqual(str(e), 'Unable to write /foo '
+                                             'incrementally with output '
+                                             'profile ' + name)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_write_array(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            data = np.arange(0, 6 * 7, dtype=np.uint8).reshape((6, 7))
+            memmap_file = os.path.join(temp_dir, 'canvas.raw')
+            mdata = np.memmap(memmap_file, dtype=np.uint8, mode='w+',
+                              shape=data.shape)
+            mdata[:] = data
+
+            expected_formats = {OutputProfile.DEFAULT: 'PNG',
+                                OutputProfile.PNG: 'PNG',
+                                OutputProfile.TIFF: 'TIFF',
+                                OutputProfile.TIFF_LZW: 'TIFF'}
+            for name in expected_formats:
+                for arr in [data, mdata]:
+                    out_file = os.path.join(temp_dir, 'out')
+                    if name == OutputProfile.DEFAULT:
+                        out_file += '.png'
+                    OutputProfile(name, compress_level=0).write_array(
+                        arr, out_file, rows_per_write=4)
+                    img = Image.open(out_file)
+                    self.assertEqual(img.format, expected_formats[name])
+                    self.assertEqual(img.tobytes(), data.tobytes())
+                    img.close()
+                    os.remove(out_file)
+
+            out_file = os.path.join(temp_dir, 'out.tif')
+            OutputProfile(OutputProfile.TIFF_LZW).write_array(data, out_file)
+            img = Image.open(out_file)
+            self.assertEqual(img.info['compression'], 'tiff_lzw')
+            img.close()
+
+            # default profile with suffix that cannot be streamed
+            out_file = os.path.join(temp_dir, 'out.bmp')
+            OutputProfile().write_array(mdata, out_file)
+            img = Image.open(out_file)
+            self.assertEqual(img.format, 'BMP')
+            self.assertEqual(img.tobytes(), data.tobytes())
+            img.close()
+
+            out_file = os.path.join(temp_dir, 'out.npy')
+            OutputProfile(OutputProfile.NPY).write_array(mdata, out_file)
+            self.assertEqual(np.load(out_file).tolist(), data.tolist())
+            del mdata
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['canvas.raw', 'out.bmp', 'out.npy',
+                              'out.tif'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_check_image_file(self):
+        OutputProfile().check_image_file('/foo.npy')
+        OutputProfile(OutputProfile.NPY).check_image_file('/foo')
+        OutputProfile(OutputProfile.NPY).check_image_file('/foo.NPY')
+        OutputProfile(OutputProfile.TIFF_LZW).check_image_file('/foo.tiff')
+        OutputProfile(OutputProfile.PNG).check_image_file('/foo.bmp')
+        for name, image_file in [(OutputProfile.NPY, '/foo.png'),
+                                 (OutputProfile.TIFF, '/foo.npy'),
+                                 (OutputProfile.PNG, '/foo.TIF')]:
+            profile = OutputProfile(name)
+            try:
+                profile.check_image_file(image_file)
+                self.fail('Expected ValueError')
+            except ValueError as e:
+                self.assertEqual(str(e), 'Output profile ' + name +
+                                 ' cannot write ' + image_file +
+                                 ' since its suffix denotes a different '
+                                 'format')
+            self.assertRaises(ValueError, profile.write_array,
+                              np.zeros((1, 1), dtype=np.uint8), image_file)
+            self.assertRaises(ValueError, profile.get_row_writer,
+                              image_file, 1, 1)
+
+    def test_write_array_failure_leaves_no_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(temp_dir, 'out.png')
+            data = np.zeros((2, 2, 5), dtype=np.uint8)
+            for name in [OutputProfile.DEFAULT, OutputProfile.PNG]:
+                self.assertRaises(Exception,
+                                  OutputProfile(name).write_array, data,
+                                  out_file)
+                self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
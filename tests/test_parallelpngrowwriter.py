@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_parallelpngrowwriter
+----------------------------------
+
+Tests for `ParallelPNGRowWriter in imagestream`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import struct
+import zlib
+import numpy as np
+
+from PIL import Image
+from chmutil import imagestream
+from chmutil.imagestream import ParallelPNGRowWriter
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import InvalidRowCountError
+
+
+def get_idat_data(png_file):
+    """Gets concatenated data of IDAT chunks in PNG verifying crc
+       of each chunk
+    """
+    f = open(png_file, 'rb')
+    data = f.read()
+    f.close()
+    offset = 8
+    idat = []
+    while offset < len(data):
+        (length, chunk_type) = struct.unpack('>I4s',
+                                             data[offset:offset + 8])
+        chunk = data[offset + 8:offset + 8 + length]
+        crc = struct.unpack('>I', data[offset + 8 + length:
+                                       offset + 12 + length])[0]
+        assert crc == zlib.crc32(chunk_type + chunk) & 0xffffffff
+        if chunk_type == b'IDAT':
+            idat.append(chunk)
+        offset += length + 12
+    return b''.join(idat)
+
+
+class TestParallelPNGRowWriter(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_unsupported_mode(self):
+        try:
+            ParallelPNGRowWriter('/foo.png', 10, 10, mode='I')
+            self.fail('Expected UnsupportedImageFormatError')
+        except UnsupportedImageFormatError as e:
+            self.assertEqual(str(e), 'Mode I not supported')
+
+    def test_round_trip_with_pillow(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(1)
+            gray = rstate.randint(0, 256, size=(101, 57)).astype(np.uint8)
+            gray[gray < 128] = 0
+            images = {'L': gray,
+                      'RGB': np.dstack([gray, gray[::-1], gray]),
+                      'RGBA': np.dstack([gray, gray, gray[::-1], gray])}
+            out_file = os.path.join(temp_dir, 'foo.png')
+            for mode in images:
+                data = images[mode]
+                for workers in [1, 3]:
+                    for level in [0, 1, 6, 9]:
+                        writer = ParallelPNGRowWriter(out_file, 57, 101,
+                                                      mode=mode,
+                                                      compress_level=level,
+                                                      workers=workers,
+                                                      strip_size=1000)
+                        for offset in range(0, 101, 10):
+                            writer.write_rows(data[offset:offset + 10])
+                        writer.close()
+
+                        img = Image.open(out_file)
+                        self.assertEqual(img.mode, mode)
+                        self.assertEqual(np.asarray(img).tolist(),
+                                         data.tolist())
+                        img.close()
+
+                        # zlib verifies header and adler32 checksum
+                        raw = zlib.decompress(get_idat_data(out_file))
+                        self.assertEqual(len(raw), 101 * (data[0].size + 1))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_zlib_without_preset_dictionary(self):
+        temp_dir = tempfile.mkdtemp()
+        orig = imagestream.ZLIB_SUPPORTS_ZDICT
+        try:
+            self.assertEqual(imagestream._zlib_supports_zdict(),
+                             imagestream.ZLIB_SUPPORTS_ZDICT)
+            # as on Python 2 where compressobj has no zdict argument
+            imagestream.ZLIB_SUPPORTS_ZDICT = False
+            rstate = np.random.RandomState(3)
+            data = rstate.randint(0, 4, size=(80, 60)).astype(np.uint8)
+            out_file = os.path.join(temp_dir, 'foo.png')
+            for workers in [1, 3]:
+                writer = ParallelPNGRowWriter(out_file, 60, 80,
+                                              workers=workers,
+                                              strip_size=500)
+                zdicts = []
+                compress_strip = writer._compress_strip
+
+                def record_strip(item):
+                    zdicts.append(item[1])
+                    return compress_strip(item)
+
+                writer._compress_strip = record_strip
+                for offset in range(0, 80, 7):
+                    writer.write_rows(data[offset:offset + 7])
+                writer.close()
+                self.assertTrue(len(zdicts) > 1)
+                self.assertEqual(set(zdicts), set([b'']))
+
+                img = Image.open(out_file)
+                self.assertEqual(np.asarray(img).tolist(), data.tolist())
+                img.close()
+                raw = zlib.decompress(get_idat_data(out_file))
+                self.assertEqual(len(raw), 80 * 61)
+        finally:
+            imagestream.ZLIB_SUPPORTS_ZDICT = orig
+            shutil.rmtree(temp_dir)
+
+    def test_strip_larger_then_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(temp_dir, 'foo.png')
+            data = np.arange(0, 12, dtype=np.uint8).reshape((3, 4))
+            writer = ParallelPNGRowWriter(out_file, 4, 3, workers=2)
+            writer.write_rows(data)
+            writer.close()
+            img = Image.open(out_file)
+            self.assertEqual(np.asarray(img).tolist(), data.tolist())
+            img.close()
+            self.assertEqual(zlib.decompress(get_idat_data(out_file)),
+                             b'\x02\x00\x01\x02\x03\x02\x04\x04\x04\x04'
+                             b'\x02\x04\x04\x04\x04')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_invalid_row_counts(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(temp_dir, 'foo.png')
+            writer = ParallelPNGRowWriter(out_file, 2, 2, workers=2)
+            try:
+                writer.write_rows(np.zeros((3, 2), dtype=np.uint8))
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Writing 3 rows would exceed '
+                                         'image height of 2')
+            writer.write_rows(np.zeros((0, 2), dtype=np.uint8))
+            writer.write_rows(np.zeros((1, 2), dtype=np.uint8))
+            try:
+                writer.close()
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Only 1 of 2 rows were written')
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
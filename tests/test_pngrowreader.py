@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_pngrowreader
+----------------------------------
+
+Tests for `PNGRowReader in imagestream`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+from PIL import Image
+from chmutil.imagestream import PNGRowReader
+from chmutil.imagestream import UnsupportedImageFormatError
+
+
+class TestPNGRowReader(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def _read_all_rows(self, reader, num_rows):
+        bands = []
+        while True:
+            band = reader.read_rows(num_rows)
+            if band is None:
+                break
+            self.assertTrue(band.size[1] <= num_rows)
+            bands.append(np.asarray(band))
+        return np.concatenate(bands)
+
+    def test_not_a_png(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tif = os.path.join(temp_dir, 'foo.tif')
+            Image.new('L', (10, 10)).save(tif)
+            try:
+                PNGRowReader(tif)
+                self.fail('Expected UnsupportedImageFormatError')
+            except UnsupportedImageFormatError as e:
+                self.assertEqual(str(e), tif + ' is not a PNG image')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_unsupported_png(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            Image.new('P', (10, 10)).save(png)
+            try:
+                PNGRowReader(png)
+                self.fail('Expected UnsupportedImageFormatError')
+            except UnsupportedImageFormatError as e:
+                self.assertTrue('must be non interlaced 8-bit' in str(e))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_read_rows_grayscale(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            # gradient plus noise so encoder uses a mix of filters
+            data = np.fromfunction(lambda y, x: (x * 3 + y * 5) % 256,
+                                   (97, 61)).astype(np.uint8)
+            rstate = np.random.RandomState(2)
+            data[40:50] = rstate.randint(0, 256, size=(10, 61))
+            Image.fromarray(data).save(png, 'PNG')
+
+            for num_rows in [1, 10, 96, 97, 200]:
+                reader = PNGRowReader(png)
+                self.assertEqual(reader.get_size(), (61, 97))
+                self.assertEqual(reader.get_mode(), 'L')
+                res = self._read_all_rows(reader, num_rows)
+                reader.close()
+                self.assertTrue(np.array_equal(res, data))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_read_rows_rgba(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            rstate = np.random.RandomState(3)
+            data = rstate.randint(0, 256, size=(33, 20, 4)).astype(np.uint8)
+            Image.fromarray(data).save(png, 'PNG')
+            reader = PNGRowReader(png)
+            self.assertEqual(reader.get_mode(), 'RGBA')
+            res = self._read_all_rows(reader, 7)
+            reader.close()
+            self.assertTrue(np.array_equal(res, data))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_read_rows_truncated_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            rstate = np.random.RandomState(4)
+            data = rstate.randint(0, 256, size=(50, 50)).astype(np.uint8)
+            Image.fromarray(data).save(png, 'PNG')
+            f = open(png, 'rb')
+            raw = f.read()
+            f.close()
+            f = open(png, 'wb')
+            f.write(raw[:len(raw) // 2])
+            f.close()
+            reader = PNGRowReader(png)
+            try:
+                reader.read_rows(50)
+                self.fail('Expected IOError')
+            except IOError as e:
+                self.assertEqual(str(e), 'PNG image data is truncated')
+            finally:
+                reader.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
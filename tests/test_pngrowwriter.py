@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_pngrowwriter
+----------------------------------
+
+Tests for `PNGRowWriter in imagestream`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+from PIL import Image
+from chmutil.imagestream import PNGRowWriter
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import InvalidRowCountError
+
+
+class TestPNGRowWriter(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_unsupported_mode(self):
+        try:
+            PNGRowWriter('/foo.png', 10, 10, mode='I')
+            self.fail('Expected UnsupportedImageFormatError')
+        except UnsupportedImageFormatError as e:
+            self.assertEqual(str(e), 'Mode I not supported')
+
+    def test_write_rows_grayscale_and_rgba(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(5)
+            for mode, shape in [('L', (45, 30)), ('RGBA', (45, 30, 4)),
+                                ('RGB', (45, 30, 3))]:
+                data = rstate.randint(0, 256, size=shape).astype(np.uint8)
+                png = os.path.join(temp_dir, mode + '.png')
+                writer = PNGRowWriter(png, 30, 45, mode=mode,
+                                      compress_level=1)
+                writer.write_rows(data[0:0])
+                for y in range(0, 45, 10):
+                    writer.write_rows(data[y:y + 10])
+                writer.close()
+                img = Image.open(png)
+                self.assertEqual(img.mode, mode)
+                self.assertTrue(np.array_equal(np.asarray(img), data))
+                img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_write_too_many_rows(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            writer = PNGRowWriter(png, 10, 5)
+            try:
+                writer.write_rows(np.zeros((6, 10), dtype=np.uint8))
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Writing 6 rows would exceed '
+                                         'image height of 5')
+            writer.write_rows(np.zeros((5, 10), dtype=np.uint8))
+            writer.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_close_with_too_few_rows(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            writer = PNGRowWriter(png, 10, 5)
+            writer.write_rows(np.zeros((4, 10), dtype=np.uint8))
+            try:
+                writer.close()
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Only 4 of 5 rows were written')
+            self.assertEqual(os.listdir(temp_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_image_renamed_into_place_on_close(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            png = os.path.join(temp_dir, 'foo.png')
+            writer = PNGRowWriter(png, 10, 5)
+            writer.write_rows(np.ones((5, 10), dtype=np.uint8))
+            self.assertEqual(os.listdir(temp_dir), ['foo.png.tmp'])
+            writer.close()
+            self.assertEqual(os.listdir(temp_dir), ['foo.png'])
+            img = Image.open(png)
+            self.assertEqual(img.getpixel((9, 4)), 1)
+            img.close()
+
+            writer = PNGRowWriter(png, 10, 5)
+            writer.write_rows(np.zeros((2, 10), dtype=np.uint8))
+            writer.abort()
+            self.assertEqual(os.listdir(temp_dir), ['foo.png'])
+            img = Image.open(png)
+            self.assertEqual(img.getpixel((9, 4)), 1)
+            img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
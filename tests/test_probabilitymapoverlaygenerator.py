@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_probabilitymapoverlaygenerator
+----------------------------------
+
+Tests for `ProbabilityMapOverlayGenerator in image`
+"""
+
+import unittest
+import numpy as np
+
+from PIL import Image
+
+from chmutil.image import ProbabilityMapOverlayGenerator
+from chmutil.image import ImageThresholder
+from chmutil.image import ColorizeGrayscaleImage
+from chmutil.image import InvalidImageError
+
+
+class TestProbabilityMapOverlayGenerator(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_create_overlay_none_passed_in(self):
+        gen = ProbabilityMapOverlayGenerator()
+        try:
+            gen.create_overlay(None, Image.new('L', (1, 1)))
+            self.fail('Expected InvalidImageError')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Image is None')
+
+        try:
+            gen.create_overlay(Image.new('L', (1, 1)), None)
+            self.fail('Expected InvalidImageError')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Image is None')
+
+    def test_create_overlay_size_mismatch(self):
+        gen = ProbabilityMapOverlayGenerator()
+        try:
+            gen.create_overlay(Image.new('L', (2, 1)), Image.new('L', (1, 2)))
+            self.fail('Expected InvalidImageError')
+        except InvalidImageError as e:
+            self.assertEqual(str(e), 'Base image size (2, 1) does not '
+                                     'match probability map size (1, 2)')
+
+    def test_create_overlay(self):
+        base = Image.new('L', (3, 1), color=100)
+        probmap = Image.new('L', (3, 1), color=0)
+        probmap.putpixel((1, 0), 200)
+        probmap.putpixel((2, 0), 50)
+        gen = ProbabilityMapOverlayGenerator(threshold_percent=30,
+                                             color=(1, 0, 0),
+                                             opacity=255)
+        res = gen.create_overlay(base, probmap)
+        self.assertEqual(res.mode, 'RGBA')
+        self.assertEqual(res.size, (3, 1))
+        self.assertEqual(res.getpixel((0, 0)), (100, 100, 100, 255))
+        self.assertEqual(res.getpixel((1, 0)), (255, 0, 0, 255))
+        self.assertEqual(res.getpixel((2, 0)), (100, 100, 100, 255))
+        self.assertEqual(base.mode, 'L')
+
+    def test_create_overlay_matches_alpha_composite(self):
+        rstate = np.random.RandomState(2)
+        probmap = Image.fromarray(rstate.randint(0, 256, size=(32, 40))
+                                  .astype(np.uint8))
+        rgba = rstate.randint(0, 256, size=(32, 40, 4)).astype(np.uint8)
+        rgba[0, :, 3] = 0
+        rgba[1, :, 3] = 255
+        bases = [Image.fromarray(rgba, 'RGBA'),
+                 Image.fromarray(rgba[:, :, :3].copy(), 'RGB'),
+                 Image.fromarray(rgba[:, :, 0].copy(), 'L'),
+                 Image.fromarray(rgba[:, :, :2].copy(), 'LA')]
+        for (threshpc, color, opacity) in [(30, (0, 0, 1), 70),
+                                           (0, (1, 0, 0), 255),
+                                           (50, (0.5, 0, 0.5), 0),
+                                           (100, (1, 1, 0), 150),
+                                           (10, (0, 1, 1), 1)]:
+            gen = ProbabilityMapOverlayGenerator(threshold_percent=threshpc,
+                                                 color=color,
+                                                 opacity=opacity)
+            # use bands that do not evenly divide image height
+            gen.ROWS_PER_BAND = 5
+            for base in bases:
+                thresh = ImageThresholder(threshpc).threshold_image(probmap)
+                col_img = ColorizeGrayscaleImage(
+                    color=color, opacity=opacity).colorize_image(thresh)
+                expected = Image.alpha_composite(base.convert(mode='RGBA'),
+                                                 col_img)
+                res = gen.create_overlay(base, probmap)
+                self.assertEqual(res.mode, 'RGBA')
+                self.assertEqual(res.tobytes(), expected.tobytes())
+
+    def test_create_overlay_array(self):
+        gen = ProbabilityMapOverlayGenerator(threshold_percent=30,
+                                             color=(1, 0, 0),
+                                             opacity=255)
+        base = np.full((1, 3, 4), 100, dtype=np.uint8)
+        probmap = np.array([[0, 200, 50]], dtype=np.uint8)
+        res = gen.create_overlay_array(base, probmap)
+        self.assertTrue(res is base)
+        self.assertEqual(base.tolist(), [[[100, 100, 100, 100],
+                                          [255, 0, 0, 255],
+                                          [100, 100, 100, 100]]])
+
+        # nothing above threshold leaves base untouched
+        probmap[:] = 0
+        base[:] = 7
+        gen.create_overlay_array(base, probmap)
+        self.assertEqual(base.ravel().tolist(), [7] * 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
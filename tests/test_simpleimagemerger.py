@@ -12,6 +12,7 @@ import unittest
 import os
 import tempfile
 import shutil
+import numpy as np
 
 from PIL import Image
 from chmutil.image import SimpleImageMerger
@@ -102,6 +103,409 @@ class TestSimpleImageMerger(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_merge_images_into_array(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 5):
+                subim = Image.new('L', (20, 10))
+                subim.putpixel((x, 0), 10 * (x + 1))
+                subim.putpixel((0, 5), 50 - x)
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+
+            sim = SimpleImageMerger()
+            self.assertEqual(sim.merge_images_into_array(None), None)
+            self.assertEqual(sim.merge_images_into_array([]), None)
+            res = sim.merge_images_into_array(im_list)
+            self.assertEqual(res.shape, (10, 20))
+            self.assertEqual(str(res.dtype), 'uint8')
+            self.assertEqual(res[0, 0], 10)
+            self.assertEqual(res[0, 4], 50)
+            self.assertEqual(res[5, 0], 50)
+            self.assertEqual(res[9, 19], 0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_into_array_with_canvas_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 3):
+                subim = Image.new('L', (20, 10))
+                subim.putpixel((x, 1), 10 * (x + 1))
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+
+            canvas_file = os.path.join(temp_dir, 'canvas.raw')
+            sim = SimpleImageMerger()
+            res = sim.merge_images_into_array(im_list,
+                                              canvas_file=canvas_file)
+            self.assertTrue(isinstance(res, np.memmap))
+            self.assertEqual(res.shape, (10, 20))
+            self.assertEqual(res[1, 0], 10)
+            self.assertEqual(res[1, 2], 30)
+            self.assertEqual(res[9, 19], 0)
+            res.flush()
+            del res
+            self.assertEqual(os.path.getsize(canvas_file), 200)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_converts_non_grayscale_images(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im1 = Image.new('L', (10, 10))
+            im1.putpixel((1, 1), 20)
+            im1_path = os.path.join(temp_dir, '1.png')
+            im1.save(im1_path, 'PNG')
+
+            im2 = Image.new('RGB', (10, 10))
+            im2.putpixel((2, 2), (100, 100, 100))
+            im2_path = os.path.join(temp_dir, '2.png')
+            im2.save(im2_path, 'PNG')
+
+            sim = SimpleImageMerger()
+            res = sim.merge_images([im1_path, im2_path])
+            self.assertEqual(res.mode, 'L')
+            self.assertEqual(res.getpixel((1, 1)), 20)
+            self.assertEqual(res.getpixel((2, 2)), 100)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_matches_imagemath_merge(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 10):
+                subim = Image.new('L', (30, 30))
+                for y in range(0, 30):
+                    subim.putpixel(((x * 7 + y) % 30, y), (x * 31 + y) % 256)
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+
+            res = SimpleImageMerger().merge_images(im_list)
+            imath_res = SimpleImageMerger(use_imagemath=True).\
+                merge_images(im_list)
+            self.assertEqual(res.tobytes(), imath_res.tobytes())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_with_tile_boxes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # first image has data everywhere, but only left half is
+            # valid
+            im1 = Image.new('L', (10, 10), color=5)
+            im1_path = os.path.join(temp_dir, '1.png')
+            im1.save(im1_path, 'PNG')
+
+            # second image has data everywhere, but only right half is
+            # valid
+            im2 = Image.new('L', (10, 10), color=7)
+            im2_path = os.path.join(temp_dir, '2.png')
+            im2.save(im2_path, 'PNG')
+
+            # third image has no boxes so it is merged in full
+            im3 = Image.new('L', (10, 10))
+            im3.putpixel((1, 1), 100)
+            im3_path = os.path.join(temp_dir, '3.png')
+            im3.save(im3_path, 'PNG')
+
+            tile_boxes = {im1_path: [(0, 0, 5, 10)],
+                          im2_path: [(5, 0, 10, 5), (5, 5, 10, 10),
+                                     (10, 10, 10, 10)]}
+            sim = SimpleImageMerger()
+            res = sim.merge_images([im1_path, im2_path, im3_path],
+                                   tile_boxes=tile_boxes)
+            self.assertEqual(res.size, (10, 10))
+            self.assertEqual(res.getpixel((0, 0)), 5)
+            self.assertEqual(res.getpixel((4, 9)), 5)
+            self.assertEqual(res.getpixel((5, 0)), 7)
+            self.assertEqual(res.getpixel((9, 9)), 7)
+            self.assertEqual(res.getpixel((1, 1)), 100)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_to_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            sim = SimpleImageMerger()
+            out_file = os.path.join(temp_dir, 'out.png')
+            self.assertEqual(sim.merge_images_to_file(None, out_file, 10),
+                             False)
+            self.assertEqual(sim.merge_images_to_file([], out_file, 10),
+                             False)
+
+            im_list = []
+            for x in range(0, 4):
+                subim = Image.new('L', (40, 35), color=x)
+                subim.putpixel((x * 10, x * 8), 100 + x)
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+
+            # last image is an RGB tiff
+            subim = Image.new('RGB', (40, 35))
+            subim.putpixel((39, 34), (200, 200, 200))
+            img_path = os.path.join(temp_dir, '4.tif')
+            im_list.append(img_path)
+            subim.save(img_path)
+
+            expected = sim.merge_images_into_array(im_list)
+            for band_height in [1, 7, 35, 100]:
+                for out_name in ['out.png', 'out.tif']:
+                    out_file = os.path.join(temp_dir, out_name)
+                    self.assertEqual(sim.merge_images_to_file(im_list,
+                                                              out_file,
+                                                              band_height),
+                                     True)
+                    res = Image.open(out_file)
+                    self.assertEqual(res.getpixel((39, 34)), 200)
+                    self.assertEqual(res.getpixel((10, 8)), 101)
+                    self.assertEqual(res.tobytes(), expected.tobytes())
+                    res.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_to_file_with_tile_boxes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im1 = Image.new('L', (10, 10), color=5)
+            im1_path = os.path.join(temp_dir, '1.png')
+            im1.save(im1_path, 'PNG')
+
+            im2 = Image.new('L', (10, 10), color=7)
+            im2_path = os.path.join(temp_dir, '2.png')
+            im2.save(im2_path, 'PNG')
+
+            tile_boxes = {im1_path: [(0, 0, 5, 10)],
+                          im2_path: [(5, 0, 10, 3), (5, 3, 10, 10)]}
+            sim = SimpleImageMerger()
+            out_file = os.path.join(temp_dir, 'out.png')
+            sim.merge_images_to_file([im1_path, im2_path], out_file, 4,
+                                     tile_boxes=tile_boxes)
+            res = Image.open(out_file)
+            self.assertEqual(res.tobytes(),
+                             sim.merge_images([im1_path, im2_path],
+                                              tile_boxes=tile_boxes).
+                             tobytes())
+            self.assertEqual(res.getpixel((4, 9)), 5)
+            self.assertEqual(res.getpixel((5, 9)), 7)
+            res.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_to_file_with_non_png_images(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 3):
+                subim = Image.new('L', (20, 15))
+                subim.putpixel((x, x), 10 + x)
+                img_path = os.path.join(temp_dir, str(x) + '.tif')
+                im_list.append(img_path)
+                subim.save(img_path)
+                subim.close()
+
+            sim = SimpleImageMerger()
+            expected = sim.merge_images_into_array(im_list)
+
+            def fail_read_band(item):
+                raise AssertionError('TIFF images should not be streamed')
+
+            sim._read_band = fail_read_band
+            bands = []
+            out_file = os.path.join(temp_dir, 'out.png')
+            self.assertEqual(sim.merge_images_to_file(
+                im_list, out_file, 4,
+                band_callback=lambda box, band: bands.append(box)), True)
+            res = Image.open(out_file)
+            self.assertEqual(res.tobytes(), expected.tobytes())
+            res.close()
+            self.assertEqual(bands, [(0, 0, 20, 4), (0, 4, 20, 8),
+                                     (0, 8, 20, 12), (0, 12, 20, 15)])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_to_file_failure_keeps_existing_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            good_path = os.path.join(temp_dir, 'good.png')
+            Image.new('L', (100, 100)).save(good_path, 'PNG')
+            bad_path = os.path.join(temp_dir, 'bad.png')
+            rstate = np.random.RandomState(1)
+            data = rstate.randint(0, 256, size=(100, 100)).astype(np.uint8)
+            Image.fromarray(data).save(bad_path, 'PNG')
+            with open(bad_path, 'rb') as f:
+                png_data = f.read()
+            with open(bad_path, 'wb') as f:
+                f.write(png_data[:len(png_data) // 2])
+
+            out_file = os.path.join(temp_dir, 'out.png')
+            with open(out_file, 'wb') as f:
+                f.write(b'previous')
+            sim = SimpleImageMerger()
+            try:
+                sim.merge_images_to_file([good_path, bad_path], out_file,
+                                         10)
+                self.fail('Expected IOError')
+            except IOError as e:
+                self.assertEqual(str(e), 'PNG image data is truncated')
+            with open(out_file, 'rb') as f:
+                self.assertEqual(f.read(), b'previous')
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['bad.png', 'good.png', 'out.png'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_with_workers(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            tile_boxes = {}
+            for x in range(0, 20):
+                subim = Image.new('L', (40, 20), color=1)
+                subim.putpixel((x, x % 20), 10 + x)
+                subim.putpixel((x + 20, x % 20), 10 + x)
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+                if x % 2 == 0:
+                    tile_boxes[img_path] = [(x, 0, x + 1, 20)]
+
+            expected = SimpleImageMerger().\
+                merge_images_into_array(im_list, tile_boxes=tile_boxes)
+
+            for workers in [0, 2, 4, 30]:
+                sim = SimpleImageMerger(workers=workers)
+                res = sim.merge_images_into_array(im_list,
+                                                  tile_boxes=tile_boxes)
+                self.assertEqual(res.tobytes(), expected.tobytes())
+                out_file = os.path.join(temp_dir, 'out.png')
+                sim.merge_images_to_file(im_list, out_file, 3,
+                                         tile_boxes=tile_boxes)
+                res = Image.open(out_file)
+                self.assertEqual(res.tobytes(), expected.tobytes())
+                res.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_merge_images_with_workers_invalid_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 10):
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                Image.new('L', (10, 10)).save(img_path, 'PNG')
+                im_list.append(img_path)
+            bad_path = os.path.join(temp_dir, 'bad.png')
+            open(bad_path, 'w').close()
+            im_list.insert(5, bad_path)
+
+            sim = SimpleImageMerger(workers=2)
+            try:
+                sim.merge_images_into_array(im_list)
+                self.fail('Expected IOError')
+            except IOError:
+                pass
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_decode_image_reads_only_rows_of_boxes(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(7)
+            data = (rstate.randint(0, 3, size=(600, 50)) * 100)
+            png = os.path.join(temp_dir, 'a.png')
+            Image.fromarray(data.astype(np.uint8)).save(png, 'PNG')
+            rgb = os.path.join(temp_dir, 'rgb.png')
+            Image.fromarray(data.astype(np.uint8)).convert('RGB').save(rgb)
+            tif = os.path.join(temp_dir, 'a.tif')
+            Image.fromarray(data.astype(np.uint8)).save(tif)
+
+            sim = SimpleImageMerger()
+            for box_list in [[(0, 0, 50, 10)], [(5, 300, 40, 310)],
+                             [(0, 290, 50, 595), (10, 10, 20, 20)],
+                             [(0, 590, 50, 600)], [(0, 0, 50, 600)],
+                             [(0, 10, 50, 10)], []]:
+                expected = sim._get_nonzero_regions(data.astype(np.uint8),
+                                                    box_list, True)
+                for image_file in [png, rgb, tif]:
+                    res = sim._decode_image((image_file, box_list))
+                    self.assertEqual([r[0] for r in res],
+                                     [r[0] for r in expected])
+                    for r, e in zip(res, expected):
+                        self.assertEqual(r[1].tolist(), e[1].tolist())
+                        self.assertEqual(r[2], True)
+
+            # rows below the boxes are never read so truncation after
+            # them does not matter
+            with open(png, 'rb') as f:
+                png_data = f.read()
+            with open(png, 'wb') as f:
+                f.write(png_data[:len(png_data) // 2])
+            res = sim._decode_image((png, [(0, 0, 50, 10)]))
+            self.assertEqual(res[0][1].tolist(),
+                             sim._get_nonzero_regions(
+                                 data[0:10].astype(np.uint8), [None],
+                                 True)[0][1].tolist())
+            self.assertEqual(sim._decode_png_regions(tif, [(0, 0, 1, 1)]),
+                             None)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_nonzero_regions(self):
+        img = np.zeros((8, 10), dtype=np.uint8)
+        img[3, 2] = 5
+        img[6, 4] = 7
+        img[0, 9] = 1
+        sim = SimpleImageMerger()
+        self.assertEqual(sim._get_nonzero_regions(img, [], False), [])
+
+        res = sim._get_nonzero_regions(img, [None], False, 'foo.png')
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0][0], (2, 0, 10, 7))
+        self.assertEqual(res[0][1].shape, (7, 8))
+        self.assertEqual(res[0][2], False)
+
+        res = sim._get_nonzero_regions(img, [(0, 0, 5, 5), (5, 5, 5, 8),
+                                             (5, 1, 10, 8),
+                                             (3, 4, 10, 8)], True)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[0][0], (2, 3, 3, 4))
+        self.assertEqual(res[0][1].tolist(), [[5]])
+        self.assertEqual(res[0][2], True)
+        self.assertEqual(res[1][0], (4, 6, 5, 7))
+        self.assertEqual(res[1][1].tolist(), [[7]])
+
+    def test_merge_images_with_empty_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            im_list = []
+            for x in range(0, 2):
+                subim = Image.new('L', (6, 4))
+                if x == 1:
+                    subim.putpixel((5, 3), 9)
+                img_path = os.path.join(temp_dir, str(x) + '.png')
+                im_list.append(img_path)
+                subim.save(img_path, 'PNG')
+                subim.close()
+            sim = SimpleImageMerger()
+            res = sim.merge_images_into_array(im_list)
+            self.assertEqual(int(res.sum()), 9)
+            self.assertEqual(res[3, 5], 9)
+        finally:
+            shutil.rmtree(temp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -86,6 +86,15 @@ class TestSingleColumnImageTileGenerator(unittest.TestCase):
 
         self.assertEqual(counter, 2)
 
+    def test_get_tile_boxes(self):
+        gen = SingleColumnImageTileGenerator(tileheight=100)
+        self.assertEqual(list(gen.get_tile_boxes(500, 0)), [])
+        self.assertEqual(list(gen.get_tile_boxes(500, 50)),
+                         [(0, 0, 500, 50)])
+        self.assertEqual(list(gen.get_tile_boxes(500, 250)),
+                         [(0, 0, 500, 100), (0, 100, 500, 200),
+                          (0, 200, 500, 250)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tiffrowwriter
+----------------------------------
+
+Tests for `TIFFRowWriter in imagestream`
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+
+from PIL import Image
+from chmutil.imagestream import TIFFRowWriter
+from chmutil.imagestream import UnsupportedImageFormatError
+from chmutil.imagestream import InvalidRowCountError
+
+
+class TestTIFFRowWriter(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_unsupported_mode_and_size(self):
+        try:
+            TIFFRowWriter('/foo.tif', 10, 10, mode='LA')
+            self.fail('Expected UnsupportedImageFormatError')
+        except UnsupportedImageFormatError as e:
+            self.assertEqual(str(e), 'Mode LA not supported')
+
+        try:
+            TIFFRowWriter('/foo.tif', 100000, 100000)
+            self.fail('Expected UnsupportedImageFormatError')
+        except UnsupportedImageFormatError as e:
+            self.assertEqual(str(e), 'Image too large for TIFF')
+
+    def test_write_rows(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            rstate = np.random.RandomState(6)
+            for mode, shape in [('L', (25, 17)), ('RGB', (25, 17, 3)),
+                                ('RGBA', (25, 17, 4))]:
+                data = rstate.randint(0, 256, size=shape).astype(np.uint8)
+                tif = os.path.join(temp_dir, mode + '.tif')
+                writer = TIFFRowWriter(tif, 17, 25, mode=mode)
+                for y in range(0, 25, 6):
+                    writer.write_rows(data[y:y + 6])
+                writer.close()
+                img = Image.open(tif)
+                self.assertEqual(img.mode, mode)
+                self.assertEqual(img.size, (17, 25))
+                self.assertTrue(np.array_equal(np.asarray(img), data))
+                img.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_row_count_errors(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            tif = os.path.join(temp_dir, 'foo.tif')
+            writer = TIFFRowWriter(tif, 10, 5)
+            try:
+                writer.write_rows(np.zeros((6, 10), dtype=np.uint8))
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Writing 6 rows would exceed '
+                                         'image height of 5')
+            try:
+                writer.close()
+                self.fail('Expected InvalidRowCountError')
+            except InvalidRowCountError as e:
+                self.assertEqual(str(e), 'Only 0 of 5 rows were written')
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tilegrid
+----------------------------------
+
+Tests for `TileGrid in core`
+"""
+
+import unittest
+
+from chmutil.core import TileGrid
+from chmutil.core import OverlapTooLargeForTileSizeError
+
+
+class TestTileGrid(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_overlap_too_large(self):
+        try:
+            TileGrid(100, 100, 10, 20, overlap_width=5)
+            self.fail('expected exception')
+        except OverlapTooLargeForTileSizeError as e:
+            self.assertEqual(str(e), 'Overlap width too large for tile')
+
+        try:
+            TileGrid(100, 100, 10, 20, overlap_height=10)
+            self.fail('expected exception')
+        except OverlapTooLargeForTileSizeError as e:
+            self.assertEqual(str(e), 'Overlap height too large for tile')
+
+    def test_counts(self):
+        grid = TileGrid(505, 650, 100, 200, overlap_width=20,
+                        overlap_height=20, tiles_per_task=10)
+        self.assertEqual(grid.get_size(), (505, 650))
+        self.assertEqual(grid.get_number_of_tiles_tuple(), (9, 5))
+        self.assertEqual(grid.get_number_of_tiles(), 45)
+        self.assertEqual(grid.get_number_of_tasks(), 5)
+
+        grid = TileGrid(0, 0, 100, 200)
+        self.assertEqual(grid.get_number_of_tiles(), 0)
+        self.assertEqual(grid.get_number_of_tasks(), 0)
+        self.assertEqual(list(grid.get_args()), [])
+
+        # tiles per task less then 1 is treated as 1
+        grid = TileGrid(200, 200, 100, 100, tiles_per_task=0)
+        self.assertEqual(grid.get_number_of_tasks(), 4)
+
+    def test_tile_boxes(self):
+        grid = TileGrid(150, 90, 60, 50, overlap_width=5,
+                        overlap_height=10)
+        self.assertEqual(grid.get_number_of_tiles_tuple(), (3, 3))
+        self.assertEqual(grid.get_tile_box(1, 1), (0, 0, 50, 30))
+        self.assertEqual(grid.get_padded_tile_box(1, 1), (0, 0, 55, 40))
+        self.assertEqual(grid.get_tile_box(2, 2), (50, 30, 100, 60))
+        self.assertEqual(grid.get_padded_tile_box(2, 2), (45, 20, 105, 70))
+        self.assertEqual(grid.get_tile_box(3, 3), (100, 60, 150, 90))
+        self.assertEqual(grid.get_padded_tile_box(3, 3), (95, 50, 150, 90))
+        # tiles past the image are clipped
+        self.assertEqual(grid.get_tile_box(5, 5), (150, 90, 150, 90))
+
+    def test_tasks_and_args(self):
+        grid = TileGrid(300, 200, 100, 100, tiles_per_task=4)
+        self.assertEqual(grid.get_number_of_tiles_tuple(), (3, 2))
+        self.assertEqual(grid.get_tile(0), (1, 1))
+        self.assertEqual(grid.get_tile(1), (1, 2))
+        self.assertEqual(grid.get_tile(2), (2, 1))
+        self.assertEqual(grid.get_tile(5), (3, 2))
+        self.assertEqual(grid.get_task_tile_range(0), (0, 4))
+        self.assertEqual(grid.get_task_tile_range(1), (4, 6))
+        self.assertEqual(list(grid.get_task_tiles(1)), [(3, 1), (3, 2)])
+        self.assertEqual(grid.get_task_args(0), ['-t 1,1', '-t 1,2',
+                                                 '-t 2,1', '-t 2,2'])
+        self.assertEqual(list(grid.get_args()),
+                         [['-t 1,1', '-t 1,2', '-t 2,1', '-t 2,2'],
+                          ['-t 3,1', '-t 3,2']])
+
+    def test_valid_boxes_cover_image_once(self):
+        grid = TileGrid(517, 333, 64, 48, overlap_width=7,
+                        overlap_height=3, tiles_per_task=11)
+        covered = [[0] * 517 for x in range(333)]
+        num_tiles = 0
+        for task in range(grid.get_number_of_tasks()):
+            for (col, row) in grid.get_task_tiles(task):
+                num_tiles += 1
+                (left, upper, right, lower) = grid.get_tile_box(col, row)
+                for y in range(upper, lower):
+                    for x in range(left, right):
+                        covered[y][x] += 1
+        self.assertEqual(num_tiles, grid.get_number_of_tiles())
+        for line in covered:
+            self.assertEqual(set(line), set([1]))
+
+
+if __name__ == '__main__':
+    unittest.main()